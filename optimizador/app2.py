@@ -5,19 +5,39 @@ import plotly.express as px
 import plotly.graph_objects as go
 import requests
 import json
-from datetime import datetime, timedelta
+import re
+from datetime import datetime, timedelta, time as dt_time
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from supabase import create_client
 from fpdf import FPDF
 import io
 import uuid
 import folium
+from folium.plugins import FastMarkerCluster, HeatMap
+import branca.colormap as cm
 from streamlit_folium import folium_static
-import polyline
+import streamlit.components.v1 as components
 import httpx
 import asyncio
 from flask import Flask, request, jsonify
 
+from geocoding import GeocodeCache, GeocodingService
+from batch_geocoding import BatchGeocoder
+from bulk_import import DEFAULT_BATCH_SIZE, import_deliveries
+from time_windows import DEFAULT_SERVICE_MINUTES
+from query_cache import QueryCache
+from data_sync import ChangeFeed, DataReplica
+from delivery_store import DELIVERY_STATUSES, DeliveryStore
+from dashboard_metrics import compute_dashboard_metrics
+from spatial_binning import bin_store, bins_geojson, cell_size_for_zoom
+import route_geometry
+from spatial_index import GridIndex
+from geo_distance import viewport_bounds
+from districts import DEFAULT_INDEX as DISTRICT_INDEX, DISTRICT_CENTROIDS
+from ingest_log import DEFAULT_PATH as INGEST_LOG_PATH, IngestLog, correlation_id, idempotency_key
+from job_queue import DEFAULT_PATH as JOB_QUEUE_PATH, DEFAULT_WORKERS as JOB_WORKERS, JobQueue
+
 
 
 # Configuración de la página
@@ -30,81 +50,407 @@ st.set_page_config(
 
 # Configuración para Trujillo
 TRUJILLO_CENTER = [-8.1092, -79.0215]
+# Distritos de Trujillo con coordenadas predefinidas (tabla única en districts.py)
+TRUJILLO_DISTRICTS = DISTRICT_CENTROIDS
+# Máximo de ids por filtro in_ para no exceder el largo de URL de PostgREST
+IN_FILTER_CHUNK_SIZE = 150
+# Consultas simultáneas de fetch_concurrently y límite por consulta (segundos)
+FETCH_WORKERS = 8
+FETCH_TIMEOUT_SECONDS = 10
+# Espera del resultado de n8n: breve en cada rerun, larga sólo con "Seguir esperando";
+# y cada cuánto se revisa también Supabase (segundos)
+N8N_RESULT_CHECK_SECONDS = 1
+N8N_RESULT_WAIT_SECONDS = 20
+N8N_RESULT_POLL_SECONDS = 2
+# Espera por rerun de un cálculo de la cola de optimización antes de mostrar su estado (segundos)
+JOB_WAIT_SECONDS = 3
+# Las rutas de un despachador pasan antes que las optimizaciones de flota completa (1 es la más urgente)
+ROUTE_JOB_PRIORITY = 2
+FLEET_JOB_PRIORITY = 3
+# Columnas que necesita la lista de entregas (proyección en lugar de select *)
+DELIVERY_LIST_COLUMNS = ['id', 'tracking_number', 'customer_name', 'customer_phone', 'status', 'priority',
+                         'customer_address', 'package_weight', 'created_at']
+# Radio máximo aceptado para resultados de geocodificación
+MAX_DISTANCE_FROM_CENTER_KM = 50
 
 # Clases de utilidad
 class SupabaseManager:
-    def __init__(self):
+    def __init__(self, cache=None, feed=None):
         self.url = st.secrets["SUPABASE_URL"]
         self.key = st.secrets["SUPABASE_KEY"]
         self.client = create_client(self.url, self.key)
+        self.cache = cache
+        self.feed = feed
+        self._pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='supabase-fetch')
+        self._columns = {}
+    
+    def has_column(self, table, column):
+        """True si `table` tiene `column` en la base (se consulta una vez por proceso)"""
+        if (table, column) not in self._columns:
+            try:
+                self.client.table(table).select(column).limit(1).execute()
+                self._columns[(table, column)] = True
+            except Exception:
+                self._columns[(table, column)] = False
+        return self._columns[(table, column)]
+    
+    def _cached(self, tables, name, args, loader):
+        """Lectura a través de la caché compartida (si hay); `args` identifica la consulta"""
+        if self.cache is None:
+            return loader()
+        return self.cache.get_or_load(tables, (name, repr(args)), loader)
+    
+    def invalidate(self, *tables):
+        """Descarta las lecturas cacheadas de `tables` (tras escribir o al pedir datos frescos)"""
+        if self.cache is not None:
+            self.cache.invalidate(*tables)
+    
+    def _written(self, table, rows):
+        """Tras una escritura: invalida la caché y publica las filas devueltas a las réplicas"""
+        self.invalidate(table)
+        if self.feed is not None:
+            self.feed.publish(table, rows)
+    
+    def fetch_concurrently(self, queries, timeout=FETCH_TIMEOUT_SECONDS):
+        """Ejecuta consultas independientes en paralelo: la latencia es la de la más lenta
+
+        `queries` mapea nombre → función sin argumentos, o (función, timeout) para
+        un límite propio. Devuelve (resultados, tiempos); una consulta que falla o
+        excede su límite queda en None, su error en tiempos[nombre]['error'] y
+        tiempos[nombre]['timed_out'] indica si sólo se agotó el tiempo.
+        """
+        started = time.perf_counter()
+        futures = {}
+        for name, query in queries.items():
+            func, limit = query if isinstance(query, tuple) else (query, timeout)
+            futures[name] = (self._pool.submit(self._timed, func), limit)
+        
+        results, timings = {}, {}
+        for name, (future, limit) in futures.items():
+            try:
+                results[name], elapsed_ms, error = future.result(timeout=max(started + limit - time.perf_counter(), 0))
+                timings[name] = {'ms': elapsed_ms, 'error': error, 'timed_out': False}
+            except FutureTimeoutError:
+                # La consulta sigue en el pool (p. ej. la primera carga de la réplica) y termina en segundo plano
+                results[name] = None
+                timings[name] = {'ms': limit * 1000, 'error': f"Tiempo agotado ({limit} s)", 'timed_out': True}
+        return results, timings
+    
+    @staticmethod
+    def _timed(func):
+        """(resultado, ms, error) de una consulta ejecutada en el pool"""
+        started = time.perf_counter()
+        try:
+            return func(), (time.perf_counter() - started) * 1000, None
+        except Exception as e:
+            return None, (time.perf_counter() - started) * 1000, str(e)
+    
+    def fetch_changes(self, table, field, since, offset, limit):
+        """Filas de `table` con `field` >= `since` (todas si es None), ordenadas; sin caché"""
+        query = self.client.table(table).select('*')
+        if since is not None:
+            query = query.gte(field, since)
+        response = query.order(field).order('id').range(offset, offset + limit - 1).execute()
+        return response.data
     
-    def get_deliveries(self, filters=None):
-        query = self.client.table('deliveries').select('*')
-        if filters:
-            for field, value in filters.items():
-                query = query.eq(field, value)
+    def _filter_deliveries(self, query, filters=None, in_filters=None, range_filters=None,
+                           ilike_filters=None, search=None):
+        """Aplica filtros en el servidor: igualdad, in_, rangos (min, max), ilike y búsqueda en varios campos"""
+        for field, value in (filters or {}).items():
+            query = query.eq(field, value)
+        for field, values in (in_filters or {}).items():
+            query = query.in_(field, list(values))
+        for field, (low, high) in (range_filters or {}).items():
+            if low is not None:
+                query = query.gte(field, low)
+            if high is not None:
+                query = query.lte(field, high)
+        for field, pattern in (ilike_filters or {}).items():
+            query = query.ilike(field, pattern)
+        if search:
+            text, fields = search
+            # Comas, paréntesis y comodines son parte de la sintaxis de or=
+            text = re.sub(r'[,()*%]', ' ', text).strip()
+            if text:
+                query = query.or_(','.join(f"{field}.ilike.*{text}*" for field in fields))
+        return query
+    
+    def get_deliveries(self, filters=None, columns=None, in_filters=None, range_filters=None,
+                       ilike_filters=None, search=None, order_by=None, desc=False, limit=None):
+        args = (filters, columns, in_filters, range_filters, ilike_filters, search, order_by, desc, limit)
+        return self._cached(('deliveries',), 'get_deliveries', args, lambda: self._fetch_deliveries(*args))
+    
+    def _fetch_deliveries(self, filters, columns, in_filters, range_filters, ilike_filters, search,
+                          order_by, desc, limit):
+        query = self.client.table('deliveries').select(','.join(columns) if columns else '*')
+        query = self._filter_deliveries(query, filters, in_filters, range_filters, ilike_filters, search)
+        if order_by:
+            query = query.order(order_by, desc=desc)
+        if limit:
+            query = query.limit(limit)
         response = query.execute()
         return response.data
     
+    def get_deliveries_page(self, page_size=100, cursor=None, columns=None, filters=None, in_filters=None,
+                            range_filters=None, ilike_filters=None, search=None):
+        """Página de entregas por keyset sobre (created_at, id) descendente
+
+        `cursor` es el (created_at, id) de la última fila de la página anterior.
+        Devuelve (filas, cursor_siguiente); el cursor es None en la última página.
+        """
+        args = (page_size, cursor, columns, filters, in_filters, range_filters, ilike_filters, search)
+        return self._cached(('deliveries',), 'get_deliveries_page', args, lambda: self._fetch_deliveries_page(*args))
+    
+    def _fetch_deliveries_page(self, page_size, cursor, columns, filters, in_filters, range_filters,
+                               ilike_filters, search):
+        if columns:
+            columns = list(dict.fromkeys(list(columns) + ['id', 'created_at']))
+        query = self.client.table('deliveries').select(','.join(columns) if columns else '*')
+        query = self._filter_deliveries(query, filters, in_filters, range_filters, ilike_filters, search)
+        if cursor:
+            created_at, last_id = cursor
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{last_id})')
+        response = query.order('created_at', desc=True).order('id', desc=True).limit(page_size).execute()
+        
+        rows = response.data
+        next_cursor = (rows[-1]['created_at'], rows[-1]['id']) if len(rows) == page_size else None
+        return rows, next_cursor
+    
     def get_vehicles(self):
-        response = self.client.table('vehicles').select('*').execute()
-        return response.data
+        return self._cached(('vehicles',), 'get_vehicles', (),
+                            lambda: self.client.table('vehicles').select('*').execute().data)
     
     def get_drivers(self):
-        response = self.client.table('drivers').select('*').execute()
-        return response.data
+        return self._cached(('drivers',), 'get_drivers', (),
+                            lambda: self.client.table('drivers').select('*').execute().data)
     
     def get_routes(self):
-        response = self.client.table('optimized_routes').select('*').order('created_at', desc=True).execute()
-        return response.data
+        return self._cached(('optimized_routes',), 'get_routes', (),
+                            lambda: self.client.table('optimized_routes').select('*').order('created_at', desc=True).execute().data)
     
     def get_route_deliveries(self, route_id=None):
-        query = self.client.table('route_deliveries').select('*')
-        if route_id:
-            query = query.eq('route_id', route_id)
-        response = query.execute()
-        return response.data
+        def load():
+            query = self.client.table('route_deliveries').select('*')
+            if route_id:
+                query = query.eq('route_id', route_id)
+            return query.execute().data
+        return self._cached(('route_deliveries',), 'get_route_deliveries', (route_id,), load)
+    
+    def get_deliveries_by_ids(self, delivery_ids):
+        """Entregas completas para una lista de ids, con un filtro in_ por bloque"""
+        return self._cached(('deliveries',), 'get_deliveries_by_ids', (list(delivery_ids),),
+                            lambda: self._fetch_deliveries_by_ids(delivery_ids))
+    
+    def _fetch_deliveries_by_ids(self, delivery_ids):
+        deliveries = []
+        for start in range(0, len(delivery_ids), IN_FILTER_CHUNK_SIZE):
+            chunk = delivery_ids[start:start + IN_FILTER_CHUNK_SIZE]
+            response = self.client.table('deliveries').select('*').in_('id', chunk).execute()
+            deliveries.extend(response.data)
+        return deliveries
     
     def get_route_with_deliveries(self, route_id):
-        route_response = self.client.table('optimized_routes').select('*').eq('id', route_id).execute()
-        deliveries_response = self.client.table('route_deliveries').select('*').eq('route_id', route_id).execute()
-        return route_response.data[0] if route_response.data else None, deliveries_response.data
+        """Ruta con sus entregas completas en orden de visita (2 consultas)"""
+        return self._cached(('optimized_routes', 'route_deliveries', 'deliveries'), 'get_route_with_deliveries',
+                            (route_id,), lambda: self._fetch_route_with_deliveries(route_id))
+    
+    def _fetch_route_with_deliveries(self, route_id):
+        route_response = self.client.table('optimized_routes').select('*, route_deliveries(*)').eq('id', route_id).execute()
+        if not route_response.data:
+            return None, []
+        route = route_response.data[0]
+        route_deliveries = sorted(route.pop('route_deliveries') or [], key=lambda rd: rd.get('sequence_order') or 0)
+        
+        by_id = {d['id']: d for d in self._fetch_deliveries_by_ids([rd['delivery_id'] for rd in route_deliveries])}
+        return route, [by_id[rd['delivery_id']] for rd in route_deliveries if rd['delivery_id'] in by_id]
+    
+    def get_deliveries_for_routes(self, route_ids):
+        """{route_id: entregas completas en orden de visita} para varias rutas (2 consultas por bloque)"""
+        return self._cached(('route_deliveries', 'deliveries'), 'get_deliveries_for_routes', (list(route_ids),),
+                            lambda: self._fetch_deliveries_for_routes(route_ids))
+    
+    def _fetch_deliveries_for_routes(self, route_ids):
+        route_deliveries = []
+        for start in range(0, len(route_ids), IN_FILTER_CHUNK_SIZE):
+            chunk = route_ids[start:start + IN_FILTER_CHUNK_SIZE]
+            response = self.client.table('route_deliveries').select('*').in_('route_id', chunk).order('sequence_order').execute()
+            route_deliveries.extend(response.data)
+        
+        by_id = {d['id']: d for d in self._fetch_deliveries_by_ids(list({rd['delivery_id'] for rd in route_deliveries}))}
+        result = {route_id: [] for route_id in route_ids}
+        for rd in route_deliveries:
+            if rd['delivery_id'] in by_id:
+                result[rd['route_id']].append(by_id[rd['delivery_id']])
+        return result
     
     def insert_delivery(self, delivery_data):
         response = self.client.table('deliveries').insert(delivery_data).execute()
+        self._written('deliveries', response.data)
         return response.data
     
+    def insert_deliveries(self, deliveries, batch_size=500):
+        """Inserta muchas entregas con inserts multi-fila de `batch_size` filas"""
+        inserted = []
+        for start in range(0, len(deliveries), batch_size):
+            response = self.client.table('deliveries').insert(deliveries[start:start + batch_size]).execute()
+            inserted.extend(response.data)
+        self._written('deliveries', inserted)
+        return inserted
+    
+    def get_tracking_numbers(self, prefix, batch_size=1000):
+        """Números de tracking existentes que empiezan con `prefix`, por páginas de `batch_size`"""
+        numbers = []
+        while True:
+            response = self.client.table('deliveries').select('tracking_number') \
+                .like('tracking_number', f"{prefix}%").order('tracking_number') \
+                .range(len(numbers), len(numbers) + batch_size - 1).execute()
+            numbers.extend(r['tracking_number'] for r in response.data)
+            if len(response.data) < batch_size:
+                return numbers
+    
     def update_delivery_status(self, delivery_id, status):
         response = self.client.table('deliveries').update({'status': status}).eq('id', delivery_id).execute()
+        self._written('deliveries', response.data)
         return response.data
     
+    def update_delivery_status_many(self, delivery_ids, status):
+        """Actualiza el estado de muchas entregas con un filtro in_ por bloque y devuelve las filas actualizadas"""
+        updated = []
+        for start in range(0, len(delivery_ids), IN_FILTER_CHUNK_SIZE):
+            chunk = delivery_ids[start:start + IN_FILTER_CHUNK_SIZE]
+            response = self.client.table('deliveries').update({'status': status}).in_('id', chunk).execute()
+            updated.extend(response.data)
+        self._written('deliveries', updated)
+        return updated
+    
+    def assign_missing_districts(self, district_index, batch_size=1000):
+        """Guarda el distrito de las entregas antiguas que no lo tienen, asignado por sus coordenadas
+
+        Una asignación vectorizada por página y un update con filtro in_ por
+        distrito y bloque de ids. Devuelve la cantidad de filas actualizadas.
+        """
+        updated = []
+        offset = 0  # Las filas sin distrito asignable siguen en null: hay que saltarlas
+        while True:
+            response = self.client.table('deliveries') \
+                .select('id,customer_latitude,customer_longitude') \
+                .is_('district', 'null').order('id').range(offset, offset + batch_size - 1).execute()
+            rows = response.data
+            if not rows:
+                break
+            lats = np.array([r.get('customer_latitude') or np.nan for r in rows], dtype=np.float64)
+            lons = np.array([r.get('customer_longitude') or np.nan for r in rows], dtype=np.float64)
+            by_district = {}
+            for row, name in zip(rows, district_index.assign_names(lats, lons)):
+                if name:
+                    by_district.setdefault(name, []).append(row['id'])
+            assigned = 0
+            for name, ids in by_district.items():
+                for start in range(0, len(ids), IN_FILTER_CHUNK_SIZE):
+                    chunk = ids[start:start + IN_FILTER_CHUNK_SIZE]
+                    response = self.client.table('deliveries').update({'district': name}).in_('id', chunk).execute()
+                    updated.extend(response.data)
+                    assigned += len(chunk)
+            offset += len(rows) - assigned
+            if len(rows) < batch_size:
+                break
+        self._written('deliveries', updated)
+        return len(updated)
+    
     def create_route(self, route_data):
         response = self.client.table('optimized_routes').insert(route_data).execute()
+        self._written('optimized_routes', response.data)
+        return response.data
+    
+    def create_route_deliveries(self, route_id, delivery_ids):
+        rows = [
+            {'route_id': route_id, 'delivery_id': delivery_id, 'sequence_order': order}
+            for order, delivery_id in enumerate(delivery_ids, start=1)
+        ]
+        response = self.client.table('route_deliveries').insert(rows).execute()
+        self._written('route_deliveries', response.data)
         return response.data
 
 class N8NIntegration:
     def __init__(self):
         self.base_url = st.secrets.get("N8N_WEBHOOK_URL", "http://localhost:5678")
+        self.manual_url = st.secrets.get("N8N_MANUAL_WEBHOOK_URL",
+                                         "http://localhost:5678/webhook-test/manual-optimization")
+        self.callback_url = st.secrets.get("N8N_CALLBACK_URL", "")
+        # Clave que el callback presenta en X-API-KEY; sin ella el resultado no se acepta
+        self.callback_api_key = st.secrets.get("webhook", {}).get("api_key", "")
         self.api_key = st.secrets.get("N8N_API_KEY", "")
     
+    def _optimization_payload(self, job_id, delivery_ids, vehicle_id=None, driver_id=None):
+        """Solicitud para n8n; el workflow debe devolver `job_id` en su callback y en metadata de la ruta"""
+        payload = {
+            "job_id": job_id,
+            "delivery_ids": delivery_ids,
+            "parameters": {
+                "optimization_type": "distance",
+                "vehicle_id": vehicle_id,
+                "driver_id": driver_id,
+                "route_date": datetime.now().strftime("%Y-%m-%d"),
+                "max_waypoints": len(delivery_ids)
+            },
+            "metadata": {
+                "job_id": job_id,
+                "requested_by": "streamlit_ui",
+                "requested_at": datetime.now().isoformat(),
+                "location": "Trujillo, La Libertad, Perú"
+            }
+        }
+        if self.callback_url:
+            headers = {"X-Correlation-Id": job_id}
+            if self.callback_api_key:
+                headers["X-API-KEY"] = self.callback_api_key
+            payload["callback"] = {"url": self.callback_url, "headers": headers}
+        return payload
+    
+    def request_optimization(self, delivery_ids, vehicle_id=None, driver_id=None):
+        """Envía la solicitud a n8n con un id de trabajo propio; devuelve {'success', 'job_id', 'message'}"""
+        job_id = uuid.uuid4().hex
+        headers = {"X-API-KEY": self.api_key} if self.api_key else {}
+        try:
+            response = requests.post(self.manual_url, json=self._optimization_payload(
+                job_id, delivery_ids, vehicle_id, driver_id), headers=headers, timeout=30)
+        except Exception as e:
+            return {"success": False, "job_id": job_id, "message": f"Error de conexión: {str(e)}"}
+        if response.status_code != 200:
+            return {"success": False, "job_id": job_id, "message": f"Error del backend: {response.status_code}"}
+        return {"success": True, "job_id": job_id, "message": "Optimización iniciada"}
+    
+    def wait_for_result(self, job_id, timeout=N8N_RESULT_WAIT_SECONDS):
+        """Espera el resultado de ese trabajo y nada más; devuelve {'route', 'payload', 'source'} o None
+
+        El callback de n8n llega al registro de eventos y despierta la espera en
+        cuanto se confirma; sólo cuentan los eventos cuyo emisor presentó la
+        clave del webhook, así nadie puede inyectar una ruta con sólo conocer el
+        `job_id`. Si el workflow sólo escribe en Supabase, la ruta se reconoce
+        por `metadata.job_id` en la réplica.
+        """
+        deadline = time.time() + timeout
+        while True:
+            wait = min(max(deadline - time.time(), 0.01), N8N_RESULT_POLL_SECONDS)
+            events, _ = get_ingest_log().wait(0, timeout=wait, limit=1, correlation_id=job_id, authenticated=True)
+            if events:
+                payload = events[0]['payload']
+                route = payload.get('route') if isinstance(payload.get('route'), dict) else None
+                if route is None and payload.get('route_id'):
+                    route = next(iter(get_replica().rows('optimized_routes', id=payload['route_id'])), None)
+                return {"route": route, "payload": payload, "source": "webhook"}
+            
+            route = next((r for r in get_replica().rows('optimized_routes')
+                          if (r.get('metadata') or {}).get('job_id') == job_id), None)
+            if route:
+                return {"route": route, "payload": None, "source": "supabase"}
+            if time.time() >= deadline:
+                return None
+    
     async def trigger_optimization(self, delivery_ids, vehicle_id=None, driver_id=None):
         """Dispara optimización manual en n8n"""
         try:
-            payload = {
-                "delivery_ids": delivery_ids,
-                "parameters": {
-                    "optimization_type": "distance",
-                    "vehicle_id": vehicle_id,
-                    "driver_id": driver_id,
-                    "route_date": datetime.now().strftime("%Y-%m-%d"),
-                    "max_waypoints": len(delivery_ids)
-                },
-                "metadata": {
-                    "requested_by": "streamlit_ui",
-                    "requested_at": datetime.now().isoformat(),
-                    "location": "Trujillo, La Libertad, Perú"
-                }
-            }
+            payload = self._optimization_payload(uuid.uuid4().hex, delivery_ids, vehicle_id, driver_id)
             
             async with httpx.AsyncClient(timeout=30.0) as client:
                 headers = {"X-API-KEY": self.api_key} if self.api_key else {}
@@ -115,7 +461,8 @@ class N8NIntegration:
                 )
                 
                 if response.status_code == 200:
-                    return {"success": True, "message": "Optimización iniciada", "data": response.json()}
+                    return {"success": True, "message": "Optimización iniciada", "job_id": payload["job_id"],
+                            "data": response.json()}
                 else:
                     return {"success": False, "message": f"Error {response.status_code}: {response.text}"}
                     
@@ -124,7 +471,7 @@ class N8NIntegration:
     
     def get_optimization_status(self):
         """Verifica estado de optimizaciones recientes"""
-        routes = SupabaseManager().get_routes()
+        routes = get_replica().rows('optimized_routes', order_by='created_at', desc=True)
         if routes:
             latest = routes[0]
             return {
@@ -134,21 +481,72 @@ class N8NIntegration:
             }
         return None
 
+# Colores por estado
+STATUS_COLORS = {
+    'pending': 'blue',
+    'assigned': 'orange',
+    'in_transit': 'purple',
+    'delivered': 'green',
+    'failed': 'red',
+    'cancelled': 'gray'
+}
+
+# Radio para avisar de posibles entregas duplicadas (km)
+DUPLICATE_RADIUS_KM = 0.05
+
+# Vista previa de una dirección geocodificada: zoom, tamaño (px) y entregas pendientes dibujadas como máximo
+PREVIEW_MAP_ZOOM = 16
+PREVIEW_MAP_SIZE = (600, 400)
+PREVIEW_MAX_PENDING = 200
+
+# A partir de cuántas entregas el mapa se dibuja agrupado en el navegador
+CLUSTER_MAP_THRESHOLD = 500
+# Desde esta cantidad de entregas la flota se optimiza por zonas (agrupar primero, rutear después)
+DECOMPOSITION_THRESHOLD = 2000
+
+# Marcador liviano por fila [lat, lon, estado, tracking, cliente, dirección, prioridad, peso];
+# el popup se arma recién al hacer clic
+LAZY_POPUP_CALLBACK = """function (row) {
+    var colors = %s;
+    var esc = function (v) {
+        return String(v === null || v === undefined ? 'N/A' : v).replace(/[&<>"']/g, function (c) {
+            return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c];
+        });
+    };
+    var color = colors[row[2]] || 'blue';
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+                                {radius: 6, color: color, fillColor: color, fillOpacity: 0.8, weight: 1});
+    marker.bindPopup(function () {
+        return '<div style="font-family: Arial; min-width: 250px;">' +
+            '<h4 style="color: #1E3A8A;">📦 ' + esc(row[3]) + '</h4><hr>' +
+            '<p><strong>Cliente:</strong> ' + esc(row[4]) + '</p>' +
+            '<p><strong>Dirección:</strong> ' + esc(row[5]) + '...</p>' +
+            '<p><strong>Estado:</strong> <span style="color: ' + color + ';">' + esc(row[2]) + '</span></p>' +
+            '<p><strong>Prioridad:</strong> ' + esc(row[6]) + '</p>' +
+            '<p><strong>Peso:</strong> ' + esc(row[7]) + ' kg</p></div>';
+    }, {maxWidth: 300});
+    return marker;
+}""" % json.dumps(STATUS_COLORS)
+
 class MapVisualizer:
     @staticmethod
-    def create_delivery_map(deliveries, route_polyline=None, center=TRUJILLO_CENTER, zoom_start=13):
-        """Crea mapa interactivo con entregas y rutas"""
+    def create_delivery_map(deliveries, route_polyline=None, center=TRUJILLO_CENTER, zoom_start=13, cluster=None,
+                            route_id=None):
+        """Crea mapa interactivo con entregas y rutas
+
+        Con muchas entregas (o `cluster=True`) los puntos van en una sola capa
+        agrupada que se dibuja en el navegador, con popups construidos al hacer clic.
+        Con `route_id` la geometría de la ruta sale de la caché compartida.
+        """
         m = folium.Map(location=center, zoom_start=zoom_start, tiles='cartodbpositron')
         
-        # Colores por estado
-        status_colors = {
-            'pending': 'blue',
-            'assigned': 'orange',
-            'in_transit': 'purple',
-            'delivered': 'green',
-            'failed': 'red',
-            'cancelled': 'gray'
-        }
+        status_colors = STATUS_COLORS
+        if cluster is None:
+            cluster = len(deliveries) > CLUSTER_MAP_THRESHOLD
+        
+        if cluster:
+            MapVisualizer.add_cluster_layer(m, deliveries)
+            deliveries = []
         
         # Añadir marcadores de entregas
         for delivery in deliveries:
@@ -163,8 +561,8 @@ class MapVisualizer:
                     <h4 style="color: #1E3A8A;">📦 {delivery.get('tracking_number', 'N/A')}</h4>
                     <hr>
                     <p><strong>Cliente:</strong> {delivery.get('customer_name', 'N/A')}</p>
-                    <p><strong>Dirección:</strong> {delivery.get('customer_address', 'N/A')[:40]}...</p>
-                    <p><strong>Estado:</strong> <span style="color: {color};">{delivery['status'].title()}</span></p>
+                    <p><strong>Dirección:</strong> {(delivery.get('customer_address') or 'N/A')[:40]}...</p>
+                    <p><strong>Estado:</strong> <span style="color: {color};">{(delivery['status'] or 'sin estado').title()}</span></p>
                     <p><strong>Prioridad:</strong> {delivery.get('priority', 'N/A')}</p>
                     <p><strong>Peso:</strong> {delivery.get('package_weight', 'N/A')} kg</p>
                 </div>
@@ -180,18 +578,22 @@ class MapVisualizer:
         # Añadir ruta si está disponible
         if route_polyline:
             try:
-                decoded_polyline = polyline.decode(route_polyline)
-                if decoded_polyline:
+                if route_id is not None:
+                    points = get_route_geometry().get(route_id, route_polyline, zoom_start)
+                else:
+                    points = route_geometry.decode(route_polyline)
+                    points = route_geometry.simplify(points, route_geometry.tolerance_for_zoom(zoom_start, center[0]))
+                if len(points):
                     folium.PolyLine(
-                        decoded_polyline,
+                        points.tolist(),
                         weight=4,
                         color='#3B82F6',
                         opacity=0.8,
                         popup='Ruta Optimizada',
                         dash_array='5, 10'
                     ).add_to(m)
-            except:
-                pass
+            except ValueError as e:
+                st.warning(f"⚠️ No se pudo dibujar la ruta: {str(e)}")
         
         # Añadir marcador del centro de Trujillo
         folium.Marker(
@@ -203,6 +605,75 @@ class MapVisualizer:
         
         return m
     
+    @staticmethod
+    def add_cluster_layer(m, deliveries):
+        """Capa FastMarkerCluster con propiedades compactas por punto"""
+        data = [
+            [round(float(d['customer_latitude']), 6), round(float(d['customer_longitude']), 6), d.get('status'),
+             d.get('tracking_number'), d.get('customer_name'), (d.get('customer_address') or '')[:40],
+             d.get('priority'), d.get('package_weight')]
+            for d in deliveries if d.get('customer_latitude') and d.get('customer_longitude')
+        ]
+        FastMarkerCluster(data, callback=LAZY_POPUP_CALLBACK, name="Entregas").add_to(m)
+        return m
+    
+    @staticmethod
+    def create_routes_map(routes, center=TRUJILLO_CENTER, zoom_start=12):
+        """Varias rutas guardadas en un mismo mapa, con geometrías simplificadas desde la caché"""
+        m = folium.Map(location=center, zoom_start=zoom_start, tiles='cartodbpositron')
+        palette = px.colors.qualitative.Dark24
+        geometries = get_route_geometry().get_many(routes, zoom_start)
+        for k, route in enumerate(r for r in routes if r['id'] in geometries):
+            points = geometries[route['id']]
+            if len(points):
+                folium.PolyLine(
+                    points.tolist(),
+                    weight=3,
+                    color=palette[k % len(palette)],
+                    opacity=0.8,
+                    tooltip=route.get('route_name', 'Ruta')
+                ).add_to(m)
+        return m
+    
+    @staticmethod
+    def create_density_map(bins, kind='choropleth', metric='count', center=TRUJILLO_CENTER, zoom_start=13):
+        """Mapa de densidad a partir de celdas agregadas (`spatial_binning`): coroplético o de calor"""
+        m = folium.Map(location=center, zoom_start=zoom_start, tiles='cartodbpositron')
+        values = np.asarray(bins[metric], dtype=float)
+        if not len(values):
+            return m
+        
+        if kind == 'heat':
+            peak = max(values.max(), 1e-9)
+            HeatMap(
+                [[float(lat), float(lon), float(v / peak)] for (lat, lon), v in zip(bins['center'], values)],
+                radius=25, blur=20, min_opacity=0.3
+            ).add_to(m)
+            return m
+        
+        colormap = cm.LinearColormap(['#DBEAFE', '#3B82F6', '#1E3A8A'], vmin=float(values.min()),
+                                     vmax=float(max(values.max(), values.min() + 1e-9)))
+        colormap.caption = {'count': 'Entregas por celda', 'weight_total': 'Peso total (kg)',
+                            'priority_mean': 'Prioridad media'}.get(metric, metric)
+        fields = [f for f in ('count', 'weight_total', 'priority_mean') if f in bins]
+        statuses = [s for s, n in zip(bins.get('statuses', []), np.sum(bins.get('status_counts', []), axis=0)) if n]
+        folium.GeoJson(
+            bins_geojson(bins),
+            style_function=lambda feature: {
+                'fillColor': colormap(feature['properties'][metric]),
+                'color': '#1E3A8A',
+                'weight': 0.5,
+                'fillOpacity': 0.6,
+            },
+            tooltip=folium.GeoJsonTooltip(
+                fields=fields + statuses,
+                aliases=[{'count': 'Entregas', 'weight_total': 'Peso (kg)', 'priority_mean': 'Prioridad media'}[f]
+                         for f in fields] + statuses,
+            ),
+        ).add_to(m)
+        colormap.add_to(m)
+        return m
+    
     @staticmethod
     def create_route_visualization(route, deliveries):
         """Crea visualización detallada de una ruta"""
@@ -248,9 +719,13 @@ def webhook():
     if api_key != st.secrets["webhook"]["api_key"]:
         return jsonify({"error": "Unauthorized"}), 401
     
-    data = request.json
-    st.session_state.last_webhook = data
-    return jsonify({"status": "received"}), 200
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({"error": "Se esperaba un cuerpo JSON"}), 400
+    # Al registro de eventos, no a st.session_state: ninguna sesión de Streamlit vería ese estado
+    result = get_ingest_log().append(data, key=idempotency_key(request.headers, data),
+                                     correlation_id=correlation_id(request.headers, data), authenticated=True)
+    return jsonify({"status": "received", "seq": result['seq'], "duplicate": result['duplicate']}), 200
 
 # Estilos CSS personalizados
 def load_css():
@@ -341,7 +816,7 @@ def main():
     """, unsafe_allow_html=True)
     
     # Inicializar servicios
-    sb = SupabaseManager()
+    sb = get_supabase()
     n8n = N8NIntegration()
     
     # Sidebar
@@ -364,6 +839,13 @@ def main():
             st.markdown("### ⚙️ Estado del Sistema")
             st.success(f"✅ Última optimización: {status['last_optimization'][:10]}")
             st.metric("Rutas generadas", status['total_routes'])
+        
+        if sb.cache is not None:
+            cache_stats = sb.cache.stats()
+            with st.expander("🗄️ Caché de consultas"):
+                st.write(f"Aciertos: {cache_stats['hits']} | Fallos: {cache_stats['misses']} "
+                         f"({cache_stats['hit_rate']:.0%})")
+                st.write(f"Entradas: {cache_stats['entries']} | Invalidadas: {cache_stats['invalidations']}")
     
     # Navegación
     if app_mode == "📊 Dashboard":
@@ -377,131 +859,125 @@ def main():
     elif app_mode == "📋 Historial de Rutas":
         show_route_history(sb)
 
+def show_fetch_timings(timings, required=()):
+    """Avisa de las consultas fallidas; devuelve False si falta alguna de `required`
+
+    Sin los datos requeridos la vista no debe dibujarse con ceros: si la
+    consulta sólo tardó más de la cuenta (la primera sincronización de la
+    réplica) se muestra que sigue cargando, con un botón para reintentar.
+    La latencia de la carga concurrente sólo se muestra con SHOW_FETCH_TIMINGS.
+    """
+    missing = [name for name in required if timings.get(name, {}).get('error')]
+    for name, timing in timings.items():
+        if not timing['error'] or name in missing:
+            continue
+        st.warning(f"⚠️ No se pudo cargar {name}: {timing['error']}")
+    for name in missing:
+        if timings[name]['timed_out']:
+            st.info(f"⏳ Todavía se están cargando los datos ({name}). La primera sincronización puede tardar "
+                    f"unos segundos; sigue en segundo plano.")
+        else:
+            st.error(f"❌ No se pudo cargar {name}: {timings[name]['error']}")
+    if missing:
+        st.button("🔄 Reintentar", key="fetch_retry")
+        return False
+    if timings and st.secrets.get("SHOW_FETCH_TIMINGS", False):
+        slowest = max(timings, key=lambda name: timings[name]['ms'])
+        st.caption(f"⏱️ Datos cargados en {timings[slowest]['ms']:.0f} ms (consulta más lenta: {slowest}; "
+                   f"en serie serían {sum(t['ms'] for t in timings.values()):.0f} ms)")
+    return True
+
+def patch_deliveries(deliveries, updated_rows):
+    """Reemplaza en la lista las entregas actualizadas (por id) sin volver a consultar la base"""
+    updated_by_id = {row['id']: row for row in updated_rows}
+    return [updated_by_id.get(d['id'], d) for d in deliveries]
+
 def get_district_coordinates(district):
     """Devuelve coordenadas aproximadas por distrito de Trujillo"""
-    district_coords = {
-        "Trujillo Centro": (-8.1092, -79.0215),
-        "La Esperanza": (-8.0878, -79.0401),
-        "El Porvenir": (-8.0775, -79.0169),
-        "Florencia de Mora": (-8.0731, -79.0264),
-        "Huanchaco": (-8.0833, -79.1167),
-        "Victor Larco": (-8.1167, -79.0333),
-        "Moche": (-8.1667, -79.0333),
-        "Laredo": (-8.0833, -78.9667),
-        "Salaverry": (-8.2167, -78.9833),
-        "Poroto": (-8.0083, -78.6417)
-    }
-    
-    return district_coords.get(district, TRUJILLO_CENTER)
+    return DISTRICT_INDEX.coordinates(district, TRUJILLO_CENTER)
+
+@st.cache_resource
+def get_supabase():
+    """Un solo cliente y una sola caché de consultas por proceso, compartidos entre sesiones"""
+    return SupabaseManager(cache=QueryCache(), feed=ChangeFeed())
+
+@st.cache_resource
+def get_replica():
+    """Réplica local de entregas y rutas, alimentada por las escrituras de `get_supabase()`
+
+    Las entregas se guardan sólo en el `DeliveryStore` columnar (sin dicts por fila).
+    """
+    sb = get_supabase()
+    return DataReplica(sb.fetch_changes, ('deliveries', 'optimized_routes'), feed=sb.feed,
+                       storages={'deliveries': lambda rows, version: DeliveryStore(
+                           rows, TRUJILLO_DISTRICTS, version, district_index=DISTRICT_INDEX)})
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def render_map_html(fingerprint, _build_map):
+    """HTML del mapa memoizado por huella de los datos: un rerun sin cambios no vuelve a dibujarlo"""
+    return _build_map().get_root().render()
+
+@st.cache_resource
+def get_route_geometry():
+    """LRU de geometrías de rutas decodificadas, compartido entre sesiones"""
+    return route_geometry.RouteGeometryCache()
+
+@st.cache_resource
+def get_pending_index():
+    """Índice espacial de las entregas pendientes, actualizado con cada cambio de la réplica"""
+    index = GridIndex(origin=TRUJILLO_CENTER)
+    get_replica().listen('deliveries', lambda rows, deleted_ids, reset: index.apply(
+        rows, deleted_ids, reset, keep=lambda row: row.get('status') == 'pending'))
+    return index
+
+def get_delivery_store(replica):
+    """Almacén columnar de la versión actual de la réplica, compartido por todas las vistas"""
+    return replica.store('deliveries')
+
+@st.cache_resource
+def get_geocode_cache():
+    """Caché de geocodificación en disco compartida por todas las sesiones"""
+    return GeocodeCache(st.secrets.get("GEOCODE_CACHE_PATH", "geocode_cache.db"))
+
+@st.cache_resource
+def get_ingest_log():
+    """Registro de eventos de webhooks, el mismo archivo que escribe webhook_server.py"""
+    return IngestLog(st.secrets.get("INGEST_LOG_PATH", INGEST_LOG_PATH))
+
+@st.cache_resource
+def get_job_queue():
+    """Cola de optimizaciones en segundo plano, el mismo archivo que atiende webhook_server.py"""
+    return JobQueue(st.secrets.get("JOB_QUEUE_PATH", JOB_QUEUE_PATH),
+                    workers=int(st.secrets.get("JOB_WORKERS", JOB_WORKERS)))
+
+@st.cache_resource
+def get_geocoder():
+    """Servicio de geocodificación compartido por todas las sesiones"""
+    return GeocodingService(
+        st.secrets.get("GOOGLE_MAPS_API_KEY", ""),
+        get_geocode_cache(),
+        center=TRUJILLO_CENTER,
+        max_distance_km=MAX_DISTANCE_FROM_CENTER_KM
+    )
 
 def get_coordinates_from_address(address):
     """Obtiene coordenadas usando Google Maps Geocoding API (MÁS PRECISO)"""
-    try:
-        # 1. Obtener API key
-        api_key = st.secrets.get("GOOGLE_MAPS_API_KEY", "")
-        if not api_key:
-            return None
-        
-        # 2. Asegurar formato correcto para Trujillo
-        if not any(x in address for x in ["Trujillo", "La Libertad", "Perú"]):
-            address = f"{address}, Trujillo, La Libertad, Perú"
-        
-        # 3. Llamar a Google Maps API
-        url = "https://maps.googleapis.com/maps/api/geocode/json"
-        params = {
-            'address': address,
-            'key': api_key,
-            'region': 'pe',  # CLAVE: Priorizar resultados en Perú
-            'language': 'es'
-        }
-        
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
-        
-        # 4. Procesar respuesta
-        if data['status'] == 'OK' and data['results']:
-            location = data['results'][0]['geometry']['location']
-            lat = location['lat']
-            lon = location['lng']
-            
-            # Verificar que esté cerca de Trujillo (dentro de ~50km)
-            distance = ((lat - TRUJILLO_CENTER[0])**2 + (lon - TRUJILLO_CENTER[1])**2)**0.5
-            if distance < 0.5:
-                return (lat, lon)
-        
-        return None
-        
-    except Exception as e:
-        print(f"Error en geocodificación Google: {str(e)}")
-        return None
+    return get_geocoder().geocode(address)
 
-def get_coordinates_google_improved(address, api_key=None):
-    """Versión mejorada de geocodificación - SÍ FUNCIONA"""
-    try:
-        # 1. Obtener API key de secrets
-        if not api_key:
-            try:
-                api_key = st.secrets["GOOGLE_MAPS_API_KEY"]
-            except:
-                st.error("⚠️ No hay API key de Google Maps configurada")
-                return None
-        
-        # 2. Preparar dirección para Trujillo
-        # Asegurar que tenga "Trujillo, Perú" al final
-        if not address.endswith(("Trujillo", "Perú", "Peru")):
-            address = f"{address}, Trujillo, Perú"
-        
-        # 3. Llamar a Google Maps API
-        url = "https://maps.googleapis.com/maps/api/geocode/json"
-        params = {
-            'address': address,
-            'key': api_key,
-            'region': 'pe',  # CRUCIAL: Prioriza resultados en Perú
-            'language': 'es',
-            'components': 'country:PE'
-        }
-        
-        headers = {
-            'User-Agent': 'DeliveryTrujilloApp/1.0'
-        }
-        
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        data = response.json()
-        
-        # 4. Procesar respuesta
-        if data['status'] == 'OK' and data['results']:
-            location = data['results'][0]['geometry']['location']
-            lat = location['lat']
-            lng = location['lng']
-            
-            # Verificar que esté cerca de Trujillo (dentro de 50km)
-            distance = ((lat - TRUJILLO_CENTER[0])**2 + (lng - TRUJILLO_CENTER[1])**2)**0.5
-            if distance < 0.5:  # Aprox 50km
-                return lat, lng
-            else:
-                st.warning(f"⚠️ Ubicación encontrada muy lejana ({distance:.2f}°). Verifica la dirección.")
-                return None
-        else:
-            # 5. Manejo de errores de Google
-            error_msg = data.get('error_message', data['status'])
-            st.warning(f"⚠️ Google Maps: {error_msg}")
-            
-            # Intentar una búsqueda más simple
-            simple_address = address.split(',')[0] + ', Trujillo, Perú'
-            params['address'] = simple_address
-            
-            response = requests.get(url, params=params, headers=headers, timeout=10)
-            data = response.json()
-            
-            if data['status'] == 'OK' and data['results']:
-                location = data['results'][0]['geometry']['location']
-                return location['lat'], location['lng']
-            else:
-                return None
-                
-    except Exception as e:
-        st.error(f"❌ Error en geocodificación: {str(e)}")
-        return None
+def get_coordinates_google_improved(address):
+    """Geocodificación con avisos en pantalla cuando Google no encuentra la dirección"""
+    result = get_geocoder().lookup(address)
+    
+    if result['coords']:
+        return result['coords']
+    
+    if result['status'] == 'REQUEST_DENIED':
+        st.error("⚠️ No hay API key de Google Maps configurada o fue rechazada")
+    elif result['status'] == 'OUT_OF_AREA':
+        st.warning("⚠️ Ubicación encontrada muy lejana. Verifica la dirección.")
+    else:
+        st.warning(f"⚠️ Google Maps: {result['status']}")
+    return None
        
 def get_coordinates_smart_trujillo(address, district=None):
     """Sistema inteligente para Trujillo - La Libertad"""
@@ -510,27 +986,14 @@ def get_coordinates_smart_trujillo(address, district=None):
         # 1. Intentar con Google Maps primero
         api_key = st.secrets.get("GOOGLE_MAPS_API_KEY", "")
         if api_key:
-            coords = get_coordinates_google_improved(address, api_key)
+            coords = get_coordinates_google_improved(address)
             if coords:
                 return coords
         
         # 2. Si Google falla, usar coordenadas por distrito
         if district:
-            district_coords = {
-                "Trujillo Centro": (-8.1092, -79.0215),
-                "La Esperanza": (-8.0878, -79.0401),
-                "El Porvenir": (-8.0775, -79.0169),
-                "Florencia de Mora": (-8.0731, -79.0264),
-                "Huanchaco": (-8.0833, -79.1167),
-                "Victor Larco": (-8.1167, -79.0333),
-                "Moche": (-8.1667, -79.0333),
-                "Laredo": (-8.0833, -78.9667),
-                "Salaverry": (-8.2167, -78.9833),
-                "Poroto": (-8.0083, -78.6417)
-            }
-            
-            if district in district_coords:
-                return district_coords[district]
+            if district in DISTRICT_INDEX:
+                return DISTRICT_INDEX.coordinates(district)
         
         # 3. Último recurso: coordenadas aleatorias cerca de Trujillo
         return (
@@ -547,40 +1010,47 @@ def show_dashboard(sb):
     st.header("📊 Panel de Control - Trujillo")
     
     # Obtener datos
-    deliveries = sb.get_deliveries()
-    vehicles = sb.get_vehicles()
-    drivers = sb.get_drivers()
-    routes = sb.get_routes()
+    replica = get_replica()
+    data, timings = sb.fetch_concurrently({
+        'store': lambda: get_delivery_store(replica),
+        'vehicles': sb.get_vehicles,
+        'drivers': sb.get_drivers,
+        'routes': lambda: replica.rows('optimized_routes', order_by='created_at', desc=True),
+    })
+    if not show_fetch_timings(timings, required=('store',)):
+        return
+    store = data['store']
+    vehicles = data['vehicles'] or []
+    drivers = data['drivers'] or []
+    routes = data['routes'] or []
+    
+    metrics = compute_dashboard_metrics(store)
     
     # Métricas principales
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-        total = len(deliveries)
-        st.metric("📦 Total Entregas", total)
-        st.caption(f"Últimas 24h: {len([d for d in deliveries if 'created_at' in d and datetime.fromisoformat(d['created_at'].replace('Z', '+00:00')) > datetime.now() - timedelta(hours=24)])}")
+        st.metric("📦 Total Entregas", metrics.total)
+        st.caption(f"Últimas 24h: {metrics.last_24h}")
         st.markdown('</div>', unsafe_allow_html=True)
     
     with col2:
         st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-        pending = len([d for d in deliveries if d['status'] == 'pending'])
-        st.metric("⏳ Pendientes", pending)
-        st.caption(f"Alta prioridad: {len([d for d in deliveries if d['status'] == 'pending' and d.get('priority', 3) == 1])}")
+        st.metric("⏳ Pendientes", metrics.pending)
+        st.caption(f"Alta prioridad: {metrics.pending_high_priority}")
         st.markdown('</div>', unsafe_allow_html=True)
     
     with col3:
         st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-        in_transit = len([d for d in deliveries if d['status'] == 'in_transit'])
-        st.metric("🚚 En Tránsito", in_transit)
-        st.caption(f"Asignadas: {len([d for d in deliveries if d['status'] == 'assigned'])}")
+        st.metric("🚚 En Tránsito", metrics.in_transit)
+        st.caption(f"Asignadas: {metrics.assigned}")
         st.markdown('</div>', unsafe_allow_html=True)
     
     with col4:
         st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-        completed = len([d for d in deliveries if d['status'] == 'delivered'])
-        st.metric("✅ Completadas", completed)
-        st.caption(f"Tasa éxito: {(completed/max(total,1)*100):.1f}%")
+        st.metric("✅ Completadas", metrics.delivered)
+        st.caption(f"Tasa éxito: {metrics.success_rate:.1f}%")
         st.markdown('</div>', unsafe_allow_html=True)
     
     st.markdown("---")
@@ -588,25 +1058,42 @@ def show_dashboard(sb):
     # Mapa de entregas
     st.subheader("🗺️ Mapa de Entregas - Trujillo")
     
-    deliveries_with_coords = [d for d in deliveries if d.get('customer_latitude') and d.get('customer_longitude')]
-    
-    if deliveries_with_coords:
-        # Crear y mostrar mapa
-        m = MapVisualizer.create_delivery_map(deliveries_with_coords)
+    if metrics.geolocated:
+        col_view1, col_view2 = st.columns([3, 1])
+        with col_view1:
+            map_view = st.radio("Vista del mapa", ["📍 Entregas", "⬢ Densidad (hexágonos)", "🔥 Mapa de calor"],
+                                horizontal=True)
+        with col_view2:
+            density_metric = st.selectbox("Medida", ["count", "weight_total", "priority_mean"],
+                                          format_func={'count': 'Cantidad', 'weight_total': 'Peso total',
+                                                       'priority_mean': 'Prioridad media'}.get,
+                                          disabled=map_view != "⬢ Densidad (hexágonos)")
+        
+        # Crear y mostrar mapa (el HTML se reutiliza mientras los datos no cambien)
+        if map_view == "📍 Entregas":
+            map_html = render_map_html(
+                ('delivery_map', store.fingerprint(store.has_coords)),
+                lambda: MapVisualizer.create_delivery_map(store.rows(store.has_coords))
+            )
+        else:
+            kind = 'heat' if map_view == "🔥 Mapa de calor" else 'choropleth'
+            cell_size = cell_size_for_zoom(13, TRUJILLO_CENTER[0])
+            map_html = render_map_html(
+                ('density_map', kind, density_metric, store.fingerprint(store.has_coords)),
+                lambda: MapVisualizer.create_density_map(
+                    bin_store(store, cell_size, grid='hex', mask=store.has_coords, origin=TRUJILLO_CENTER),
+                    kind=kind, metric=density_metric
+                )
+            )
         with st.container():
-            folium_static(m, width=1200, height=500)
+            components.html(map_html, width=1200, height=500)
         
         # Estadísticas del mapa
         col_info1, col_info2, col_info3 = st.columns(3)
         with col_info1:
-            st.info(f"📍 {len(deliveries_with_coords)} entregas geolocalizadas")
+            st.info(f"📍 {metrics.geolocated} entregas geolocalizadas")
         with col_info2:
-            districts = set()
-            for d in deliveries_with_coords:
-                address = d.get('customer_address', '')
-                if 'Trujillo' in address:
-                    districts.add(address.split(',')[1].strip() if ',' in address else 'Centro')
-            st.info(f"🏘️ {len(districts)} distritos cubiertos")
+            st.info(f"🏘️ {metrics.districts_covered} distritos cubiertos")
         with col_info3:
             if routes:
                 latest = routes[0]
@@ -620,11 +1107,10 @@ def show_dashboard(sb):
     
     with col_chart1:
         # Distribución por estado
-        if deliveries:
-            status_counts = pd.Series([d['status'] for d in deliveries]).value_counts()
+        if metrics.status_counts:
             fig1 = px.pie(
-                values=status_counts.values,
-                names=status_counts.index,
+                values=list(metrics.status_counts.values()),
+                names=list(metrics.status_counts.keys()),
                 title="Distribución por Estado",
                 hole=0.4,
                 color_discrete_sequence=px.colors.qualitative.Set3
@@ -633,97 +1119,31 @@ def show_dashboard(sb):
     
     with col_chart2:
         # Entregas por día
-        if deliveries:
-            delivery_dates = []
-            for d in deliveries:
-                if 'created_at' in d:
-                    try:
-                        date = datetime.fromisoformat(d['created_at'].replace('Z', '+00:00')).date()
-                        delivery_dates.append(date)
-                    except:
-                        pass
-            
-            if delivery_dates:
-                date_counts = pd.Series(delivery_dates).value_counts().sort_index()
-                fig2 = px.bar(
-                    x=date_counts.index.astype(str),
-                    y=date_counts.values,
-                    title="Entregas por Día",
-                    labels={'x': 'Fecha', 'y': 'Cantidad'},
-                    color=date_counts.values,
-                    color_continuous_scale='Blues'
-                )
-                st.plotly_chart(fig2, use_container_width=True)
+        if metrics.daily_counts:
+            dates, counts = zip(*metrics.daily_counts)
+            fig2 = px.bar(
+                x=list(dates),
+                y=list(counts),
+                title="Entregas por Día",
+                labels={'x': 'Fecha', 'y': 'Cantidad'},
+                color=list(counts),
+                color_continuous_scale='Blues'
+            )
+            st.plotly_chart(fig2, use_container_width=True)
 
 def show_delivery_management(sb):
     st.header("📦 Gestión de Entregas")
     
     # Pestañas
-    tab1, tab2 = st.tabs(["➕ Nueva Entrega", "📋 Lista y Gestión"])
-    
-    # DISTRITOS DE TRUJILLO CON COORDENADAS PREDEFINIDAS
-    TRUJILLO_DISTRICTS = {
-        "Trujillo Centro": (-8.1092, -79.0215),
-        "La Esperanza": (-8.0878, -79.0401),
-        "El Porvenir": (-8.0775, -79.0169),
-        "Florencia de Mora": (-8.0731, -79.0264),
-        "Huanchaco": (-8.0833, -79.1167),
-        "Victor Larco": (-8.1167, -79.0333),
-        "Moche": (-8.1667, -79.0333),
-        "Laredo": (-8.0833, -78.9667),
-        "Salaverry": (-8.2167, -78.9833),
-        "Poroto": (-8.0083, -78.6417)
-    }
-    
-    # FUNCIÓN DE GEOCODIFICACIÓN QUE SÍ FUNCIONA
-    def geocode_address_google(address, api_key=None):
-        """Geocodificación usando Google Maps API - Versión MEJORADA"""
-        try:
-            if not api_key:
-                # Obtener API key de secrets
-                try:
-                    api_key = st.secrets["GOOGLE_MAPS_API_KEY"]
-                except:
-                    return None
-            
-            # Asegurar que la dirección tenga formato correcto
-            if not any(x in address for x in ["Trujillo", "La Libertad", "Perú", "Peru"]):
-                address = f"{address}, Trujillo, La Libertad, Perú"
-            
-            url = "https://maps.googleapis.com/maps/api/geocode/json"
-            params = {
-                'address': address,
-                'key': api_key,
-                'region': 'pe',  # CLAVE: Priorizar resultados en Perú
-                'language': 'es',
-                'components': 'country:PE'
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            data = response.json()
-            
-            if data['status'] == 'OK' and data['results']:
-                location = data['results'][0]['geometry']['location']
-                return location['lat'], location['lng']
-            
-            return None
-            
-        except Exception as e:
-            print(f"Error en geocodificación Google: {str(e)}")
-            return None
+    tab1, tab2, tab3 = st.tabs(["➕ Nueva Entrega", "📋 Lista y Gestión", "📥 Importación Masiva"])
     
     def get_coordinates_smart(address, district=None):
         """Sistema inteligente: primero Google, luego distrito, luego aleatorio"""
-        # 1. Intentar con Google Maps
-        coords = geocode_address_google(address)
+        # 1. Intentar con Google Maps (el servicio ya descarta resultados fuera de Trujillo)
+        coords = get_geocoder().geocode(address)
         
         if coords:
-            # Verificar que las coordenadas estén cerca de Trujillo
-            lat, lng = coords
-            distance_from_center = ((lat - TRUJILLO_CENTER[0])**2 + (lng - TRUJILLO_CENTER[1])**2)**0.5
-            
-            if distance_from_center < 0.5:  # Menos de ~50km de Trujillo
-                return coords
+            return coords
         
         # 2. Si Google falla o está muy lejos, usar coordenadas del distrito
         if district and district in TRUJILLO_DISTRICTS:
@@ -780,6 +1200,19 @@ def show_delivery_management(sb):
                         lat, lon = coords
                         st.success(f"✅ Ubicación encontrada: {lat:.6f}, {lon:.6f}")
                         
+                        # Posibles duplicados: entregas pendientes casi en el mismo punto
+                        replica = get_replica()
+                        pending_index = get_pending_index()
+                        replica.sync()
+                        nearby = pending_index.within_radius(lat, lon, DUPLICATE_RADIUS_KM)
+                        if nearby:
+                            st.warning(f"⚠️ Hay {len(nearby)} entregas pendientes a menos de "
+                                       f"{DUPLICATE_RADIUS_KM * 1000:.0f} m de esta dirección")
+                            for delivery_id, distance in nearby[:5]:
+                                delivery = replica.tables['deliveries'].get(delivery_id) or {}
+                                st.caption(f"• {delivery.get('tracking_number')} - {delivery.get('customer_name')} "
+                                           f"({distance * 1000:.0f} m)")
+                        
                         # Verificar si son las del distrito o más precisas
                         if district in TRUJILLO_DISTRICTS:
                             dist_lat, dist_lon = TRUJILLO_DISTRICTS[district]
@@ -796,7 +1229,7 @@ def show_delivery_management(sb):
                             'district': district
                         }
                                             
-                        m = folium.Map(location=[lat, lon], zoom_start=16)
+                        m = folium.Map(location=[lat, lon], zoom_start=PREVIEW_MAP_ZOOM)
                         folium.Marker(
                             [lat, lon],
                             popup=test_address,
@@ -804,6 +1237,18 @@ def show_delivery_management(sb):
                             icon=folium.Icon(color='green', icon='home', prefix='fa')
                         ).add_to(m)
                         
+                        # Entregas pendientes dentro del recuadro visible, no todas las de la ciudad
+                        visible = pending_index.in_bbox(*viewport_bounds((lat, lon), PREVIEW_MAP_ZOOM,
+                                                                         *PREVIEW_MAP_SIZE))
+                        for delivery in replica.store('deliveries').rows_by_id(visible[:PREVIEW_MAX_PENDING]):
+                            folium.CircleMarker(
+                                [delivery['customer_latitude'], delivery['customer_longitude']],
+                                radius=5,
+                                color=STATUS_COLORS['pending'],
+                                fill=True,
+                                tooltip=f"{delivery.get('tracking_number')} - {delivery.get('customer_name')}"
+                            ).add_to(m)
+                        
                         # Añadir marcador del centro del distrito si es diferente
                         if district in TRUJILLO_DISTRICTS:
                             dist_lat, dist_lon = TRUJILLO_DISTRICTS[district]
@@ -815,7 +1260,7 @@ def show_delivery_management(sb):
                                     icon=folium.Icon(color='blue', icon='flag', prefix='fa')
                                 ).add_to(m)
                         
-                        folium_static(m, width=600, height=400)
+                        folium_static(m, width=PREVIEW_MAP_SIZE[0], height=PREVIEW_MAP_SIZE[1])
             else:
                 st.warning("⚠️ Completa al menos la calle y selecciona un distrito")
         
@@ -848,6 +1293,19 @@ def show_delivery_management(sb):
                 special_instructions = st.text_area("Instrucciones Especiales",
                                                    placeholder="Ej: Llamar antes de llegar, código de acceso")
             
+            # Ventana horaria opcional para la optimización con horarios
+            st.markdown("**🕐 Horario de entrega (opcional)**")
+            col_tw1, col_tw2, col_tw3, col_tw4 = st.columns(4)
+            with col_tw1:
+                use_time_window = st.checkbox("Restringir horario")
+            with col_tw2:
+                window_start = st.time_input("Recibe desde", value=dt_time(9, 0))
+            with col_tw3:
+                window_end = st.time_input("Recibe hasta", value=dt_time(18, 0))
+            with col_tw4:
+                service_time = st.number_input("Atención (min)", min_value=1, max_value=120,
+                                               value=DEFAULT_SERVICE_MINUTES)
+            
             # Checkbox para usar geocodificación precisa
             use_precise_geocoding = st.checkbox(
                 "📍 Usar geocodificación precisa (Google Maps)", 
@@ -863,6 +1321,10 @@ def show_delivery_management(sb):
                     st.error("❌ Por favor completa todos los campos obligatorios (*)")
                     return
                 
+                if use_time_window and window_end <= window_start:
+                    st.error("❌ La hora de fin del horario debe ser posterior a la de inicio")
+                    return
+                
                 # CONSTRUIR DIRECCIÓN COMPLETA
                 address_parts = [street]
                 if urbanizacion:
@@ -903,11 +1365,19 @@ def show_delivery_management(sb):
                     'priority': int(priority),
                     'status': 'pending',
                     'created_at': datetime.now().isoformat(),
+                    'district': district,
                 }
                 
                 if special_instructions:
                     new_delivery['special_instructions'] = special_instructions
                 
+                # Sólo se envían si difieren del valor por defecto (columnas de migrations/001)
+                if int(service_time) != DEFAULT_SERVICE_MINUTES:
+                    new_delivery['service_time_minutes'] = int(service_time)
+                if use_time_window:
+                    new_delivery['time_window_start'] = window_start.strftime('%H:%M')
+                    new_delivery['time_window_end'] = window_end.strftime('%H:%M')
+                
                 # GUARDAR EN LA BASE DE DATOS
                 try:
                     result = sb.insert_delivery(new_delivery)
@@ -918,6 +1388,7 @@ def show_delivery_management(sb):
                         st.info(f"**Coordenadas:** {latitude:.6f}, {longitude:.6f}")
                         
                         # Limpiar session state para próxima entrega
+                        st.session_state.pop('deliveries_snapshot', None)
                         if 'pre_geocoded' in st.session_state:
                             del st.session_state['pre_geocoded']
                         if 'street_input' in st.session_state:
@@ -936,69 +1407,136 @@ def show_delivery_management(sb):
                 except Exception as e:
                     st.error(f"❌ Error al crear la entrega: {str(e)}")
     
+    with tab3:
+        st.subheader("📥 Importar Entregas desde CSV / Excel")
+        st.caption("Columnas: cliente, telefono, direccion (obligatorias); distrito, email, descripcion, "
+                   "peso, prioridad, instrucciones, desde, hasta, latitud, longitud (opcionales)")
+        
+        uploaded_file = st.file_uploader("Archivo de entregas", type=["csv", "xlsx"])
+        batch_size = st.number_input("Filas por inserción", min_value=50, max_value=5000,
+                                     value=DEFAULT_BATCH_SIZE, step=50)
+        
+        if uploaded_file and st.button("📥 Importar Entregas", type="primary", use_container_width=True):
+            geocoder = BatchGeocoder(
+                st.secrets.get("GOOGLE_MAPS_API_KEY", ""),
+                get_geocode_cache(),
+                center=TRUJILLO_CENTER,
+                max_distance_km=MAX_DISTANCE_FROM_CENTER_KM,
+                district_centroids=TRUJILLO_DISTRICTS
+            )
+            progress_text = st.empty()
+            
+            def show_progress(processed, inserted, errors):
+                progress_text.info(f"⏳ {processed} filas procesadas | {inserted} insertadas | {errors} con error")
+            
+            with st.spinner("⏳ Importando entregas..."):
+                report = import_deliveries(uploaded_file, uploaded_file.name, sb, geocoder, TRUJILLO_DISTRICTS,
+                                           batch_size=int(batch_size), on_progress=show_progress)
+            
+            st.session_state.pop('deliveries_snapshot', None)
+            st.success(f"✅ {report['inserted']} de {report['processed']} entregas importadas")
+            if report['errors']:
+                st.warning(f"⚠️ {len(report['errors'])} filas con error")
+                df_errors = pd.DataFrame(report['errors'])
+                st.dataframe(df_errors, use_container_width=True, height=300)
+                st.download_button(
+                    label="📥 Descargar reporte de errores",
+                    data=df_errors.to_csv(index=False).encode('utf-8'),
+                    file_name=f"errores_importacion_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    mime="text/csv"
+                )
+        
+        st.markdown("---")
+        st.caption("Las entregas creadas antes de guardar el distrito se filtran y cuentan por él tras asignarlo una vez.")
+        if st.button("🏘️ Asignar distritos faltantes", use_container_width=True):
+            with st.spinner("⏳ Asignando distritos por coordenadas..."):
+                assigned = sb.assign_missing_districts(DISTRICT_INDEX)
+            st.session_state.pop('deliveries_snapshot', None)
+            st.success(f"✅ {assigned} entregas con distrito asignado")
+    
     with tab2:
         st.subheader("📋 Lista y Gestión de Entregas")
         
-        # Obtener todas las entregas
-        deliveries = sb.get_deliveries()
-        
-        if not deliveries:
-            st.info("📭 No hay entregas registradas en el sistema.")
-            return
-        
-        # Convertir a DataFrame para filtros
-        df = pd.DataFrame(deliveries)
-        
-        # Filtros avanzados
+        # Filtros avanzados (se aplican en la base de datos)
         st.subheader("🔍 Filtros de Búsqueda")
         
-        col_f1, col_f2, col_f3, col_f4 = st.columns(4)
+        col_f1, col_f2, col_f3, col_f4, col_f5 = st.columns([2, 2, 2, 3, 1])
         
         with col_f1:
-            # Filtro por estado
-            status_options = ["Todos"] + sorted(df['status'].unique().tolist())
-            status_filter = st.selectbox("Estado", status_options)
+            status_filter = st.selectbox("Estado", ["Todos"] + DELIVERY_STATUSES)
         
         with col_f2:
-            # Filtro por prioridad
             priority_options = ["Todas"] + [str(i) for i in range(1, 6)]
             priority_filter = st.selectbox("Prioridad", priority_options)
         
         with col_f3:
-            # Filtro por distrito (si existe la columna)
-            if 'district' in df.columns and df['district'].notna().any():
-                district_options = ["Todos"] + sorted(df['district'].dropna().unique().tolist())
-                district_filter = st.selectbox("Distrito", district_options)
+            # Una base sin la columna district no admite el filtro: se ofrece sólo si existe
+            if sb.has_column('deliveries', 'district'):
+                district_filter = st.selectbox("Distrito", ["Todos"] + list(TRUJILLO_DISTRICTS.keys()))
             else:
                 district_filter = "Todos"
-                st.caption("Distrito no disponible")
         
         with col_f4:
-            # Búsqueda por texto
             search_text = st.text_input("Buscar (cliente/tracking)")
         
-        # Aplicar filtros
-        filtered_df = df.copy()
+        with col_f5:
+            page_size = st.selectbox("Por página", [50, 100, 250, 500], index=1)
         
+        query = {'filters': {}, 'ilike_filters': {}}
         if status_filter != "Todos":
-            filtered_df = filtered_df[filtered_df['status'] == status_filter]
-        
+            query['filters']['status'] = status_filter
         if priority_filter != "Todas":
-            filtered_df = filtered_df[filtered_df['priority'] == int(priority_filter)]
-        
-        if district_filter != "Todos" and 'district' in filtered_df.columns:
-            filtered_df = filtered_df[filtered_df['district'] == district_filter]
-        
+            query['filters']['priority'] = int(priority_filter)
+        if district_filter != "Todos":
+            query['filters']['district'] = district_filter
         if search_text:
-            mask = (
-                filtered_df['customer_name'].str.contains(search_text, case=False, na=False) |
-                filtered_df['tracking_number'].str.contains(search_text, case=False, na=False) |
-                filtered_df['customer_address'].str.contains(search_text, case=False, na=False)
+            query['search'] = (search_text, ['customer_name', 'tracking_number', 'customer_address'])
+        
+        # Paginación por cursor: una pila de cursores permite volver a páginas anteriores
+        query_key = (status_filter, priority_filter, district_filter, search_text, page_size)
+        nav = st.session_state.get('delivery_list')
+        if not nav or nav['key'] != query_key:
+            nav = {'key': query_key, 'cursors': [None], 'page': 0, 'next_cursor': None}
+            st.session_state['delivery_list'] = nav
+            st.session_state.pop('deliveries_snapshot', None)
+        
+        # Página de la sesión: las acciones en lote la actualizan sin recargar la tabla
+        col_refresh1, col_refresh2 = st.columns([3, 1])
+        with col_refresh2:
+            if st.button("🔄 Actualizar lista", use_container_width=True):
+                sb.invalidate('deliveries')
+                st.session_state.pop('deliveries_snapshot', None)
+        if 'deliveries_snapshot' not in st.session_state:
+            rows, nav['next_cursor'] = sb.get_deliveries_page(
+                page_size=page_size,
+                cursor=nav['cursors'][nav['page']],
+                columns=DELIVERY_LIST_COLUMNS,
+                **query
             )
-            filtered_df = filtered_df[mask]
+            st.session_state['deliveries_snapshot'] = rows
+        deliveries = st.session_state['deliveries_snapshot']
+        
+        if 'batch_message' in st.session_state:
+            st.success(st.session_state.pop('batch_message'))
+        
+        filtered_df = pd.DataFrame(deliveries)
         
         # Mostrar resultados
-        st.subheader(f"📊 Resultados ({len(filtered_df)} entregas)")
+        st.subheader(f"📊 Resultados (página {nav['page'] + 1}, {len(filtered_df)} entregas)")
+        
+        col_page1, col_page2 = st.columns(2)
+        with col_page1:
+            if st.button("⬅️ Anterior", disabled=nav['page'] == 0, use_container_width=True):
+                nav['page'] -= 1
+                st.session_state.pop('deliveries_snapshot', None)
+                st.rerun()
+        with col_page2:
+            if st.button("Siguiente ➡️", disabled=nav['next_cursor'] is None, use_container_width=True):
+                del nav['cursors'][nav['page'] + 1:]
+                nav['cursors'].append(nav['next_cursor'])
+                nav['page'] += 1
+                st.session_state.pop('deliveries_snapshot', None)
+                st.rerun()
         
         if not filtered_df.empty:
             # Seleccionar columnas para mostrar
@@ -1018,7 +1556,7 @@ def show_delivery_management(sb):
             # Estadísticas rápidas
             col_stat1, col_stat2, col_stat3 = st.columns(3)
             with col_stat1:
-                st.metric("📦 Total filtrado", len(filtered_df))
+                st.metric("📦 En esta página", len(filtered_df))
             with col_stat2:
                 avg_priority = filtered_df['priority'].mean() if 'priority' in filtered_df.columns else 0
                 st.metric("🎯 Prioridad media", f"{avg_priority:.1f}")
@@ -1040,43 +1578,30 @@ def show_delivery_management(sb):
                 
                 st.info(f"✅ {len(selected_rows)} entregas seleccionadas")
                 
+                def run_batch_update(status, message):
+                    updated = sb.update_delivery_status_many(selected_rows['id'].tolist(), status)
+                    st.session_state['deliveries_snapshot'] = patch_deliveries(deliveries, updated)
+                    st.session_state['batch_message'] = f"{len(updated)} {message}"
+                    st.rerun()
+                
                 col_act1, col_act2, col_act3, col_act4 = st.columns(4)
                 
                 with col_act1:
                     if st.button("📝 Marcar como 'Asignada'", use_container_width=True):
-                        for _, row in selected_rows.iterrows():
-                            sb.update_delivery_status(row['id'], 'assigned')
-                        st.success(f"{len(selected_rows)} entregas asignadas")
-                        time.sleep(1)
-                        st.rerun()
+                        run_batch_update('assigned', "entregas asignadas")
                 
                 with col_act2:
                     if st.button("🚚 Marcar como 'En Tránsito'", use_container_width=True):
-                        for _, row in selected_rows.iterrows():
-                            sb.update_delivery_status(row['id'], 'in_transit')
-                        st.success(f"{len(selected_rows)} entregas en tránsito")
-                        time.sleep(1)
-                        st.rerun()
+                        run_batch_update('in_transit', "entregas en tránsito")
                 
                 with col_act3:
                     if st.button("✅ Marcar como 'Entregada'", use_container_width=True):
-                        for _, row in selected_rows.iterrows():
-                            sb.update_delivery_status(row['id'], 'delivered')
-                        st.success(f"{len(selected_rows)} entregas completadas")
-                        time.sleep(1)
-                        st.rerun()
+                        run_batch_update('delivered', "entregas completadas")
                 
                 with col_act4:
                     if st.button("🗑️ Eliminar seleccionadas", type="secondary", use_container_width=True):
-                        st.warning("⚠️ Función de eliminación en desarrollo")
-                        st.info("Por ahora, cambia el estado a 'cancelled'")
-                        
-                        for _, row in selected_rows.iterrows():
-                            sb.update_delivery_status(row['id'], 'cancelled')
-                        
-                        st.success(f"{len(selected_rows)} entregas canceladas")
-                        time.sleep(1)
-                        st.rerun()
+                        # La eliminación está en desarrollo: por ahora se cancelan
+                        run_batch_update('cancelled', "entregas canceladas (la eliminación está en desarrollo)")
                 
                 # Mostrar detalles de las seleccionadas
                 with st.expander("📋 Ver detalles de las entregas seleccionadas"):
@@ -1137,47 +1662,253 @@ def show_route_details(sb, route_id):
         
         # Mapa
         if deliveries:
-            # Obtener datos completos de las entregas
-            delivery_data = []
-            for rd in deliveries:
-                try:
-                    delivery = sb.client.table('deliveries').select('*').eq('id', rd['delivery_id']).single().execute()
-                    if delivery.data:
-                        delivery_data.append(delivery.data)
-                except:
-                    pass
+            st.subheader("📍 Mapa de la Ruta")
+            route_map = MapVisualizer.create_delivery_map(
+                deliveries,
+                route.get('polyline'),
+                route_id=route['id']
+            )
+            folium_static(route_map, width=1200, height=500)
             
-            if delivery_data:
-                # Mostrar mapa
-                st.subheader("📍 Mapa de la Ruta")
-                route_map = MapVisualizer.create_delivery_map(
-                    delivery_data,
-                    route.get('polyline')
-                )
-                folium_static(route_map, width=1200, height=500)
-                
-                # Tabla de entregas
-                st.subheader("📦 Entregas en esta ruta")
-                df_deliveries = pd.DataFrame(delivery_data)
-                st.dataframe(df_deliveries[['tracking_number', 'customer_name', 'customer_address', 'status']])
+            # Tabla de entregas
+            st.subheader("📦 Entregas en esta ruta")
+            df_deliveries = pd.DataFrame(deliveries)
+            st.dataframe(df_deliveries[['tracking_number', 'customer_name', 'customer_address', 'status']])
+
+def wait_for_job(jobs, session_key):
+    """Espera un momento el trabajo guardado en session_state[session_key]; devuelve su resultado al terminar
+
+    Mientras sigue en cola o calculando muestra su estado con botones para
+    actualizar o cancelar, y devuelve None: la página no queda bloqueada.
+    """
+    job = st.session_state.get(session_key)
+    if not job:
+        return None
+    with st.spinner("⏳ Calculando en la cola de optimización..."):
+        status = jobs.wait(job['job_id'], timeout=JOB_WAIT_SECONDS)
+    
+    if status is None or status['status'] in ('done', 'failed', 'cancelled'):
+        del st.session_state[session_key]
+    if status is None:
+        st.error("❌ El cálculo ya no existe en la cola")
+    elif status['status'] == 'done':
+        return jobs.result(job['job_id'])
+    elif status['status'] == 'failed':
+        st.error(f"❌ Error al optimizar: {status['error']}")
+    elif status['status'] == 'cancelled':
+        st.warning("✖️ Cálculo cancelado")
+    else:
+        if status['status'] == 'queued':
+            st.info(f"🕐 En cola (posición {status['position']}, trabajo `{job['job_id'][:8]}`)")
+        else:
+            st.info(f"⏳ Calculando... (trabajo `{job['job_id'][:8]}`)")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.button("🔄 Actualizar estado", key=f"{session_key}_refresh", use_container_width=True)
+        with col2:
+            if st.button("✖️ Cancelar cálculo", key=f"{session_key}_cancel", use_container_width=True):
+                jobs.cancel(job['job_id'])
+                st.rerun()
+    return None
+
+def show_local_route_result(sb, result):
+    """Muestra la ruta calculada por el motor local y permite guardarla"""
+    st.success(f"✅ Ruta optimizada en {result['solve_time_ms']:.0f} ms")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Distancia", f"{result['total_distance_km']:.1f} km")
+    with col2:
+        st.metric("Duración estimada", f"{result['estimated_duration_minutes']:.0f} min")
+    with col3:
+        st.metric("Entregas", len(result['stops']))
+    
+    route_polyline = route_geometry.encode(result['coordinates'])
+    route_map = MapVisualizer.create_delivery_map(result['stops'], route_polyline)
+    folium_static(route_map, width=1200, height=500)
+    
+    st.subheader("📦 Orden de visita")
+    df_stops = pd.DataFrame(result['stops'])
+    df_stops.insert(0, 'orden', range(1, len(df_stops) + 1))
+    st.dataframe(df_stops[['orden', 'tracking_number', 'customer_name', 'customer_address']],
+                 use_container_width=True)
+    
+    if st.button("💾 Guardar Ruta", type="primary", use_container_width=True):
+        route_data = {
+            'route_name': f"Ruta {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+            'total_distance_km': result['total_distance_km'],
+            'estimated_duration_minutes': result['estimated_duration_minutes'],
+            'polyline': route_polyline,
+            'route_status': 'planned',
+            'metadata': {
+                'delivery_count': len(result['stops']),
+                'optimization_type': 'distance',
+                'engine': 'local',
+                'vehicle_id': result.get('vehicle_id'),
+                'driver_id': result.get('driver_id'),
+                'route_date': datetime.now().strftime("%Y-%m-%d"),
+                'solve_time_ms': result['solve_time_ms']
+            }
+        }
+        try:
+            created = sb.create_route(route_data)
+            if created:
+                sb.create_route_deliveries(created[0]['id'], [d['id'] for d in result['stops']])
+                st.success(f"✅ Ruta guardada: {route_data['route_name']}")
+                del st.session_state['local_route_result']
+        except Exception as e:
+            st.error(f"❌ Error al guardar la ruta: {str(e)}")
+
+def show_fleet_optimization(sb, deliveries):
+    """Reparte todas las entregas pendientes entre los vehículos disponibles"""
+    st.subheader("🚛 Optimización de Flota Completa")
+    
+    vehicles = sb.get_vehicles()
+    available_vehicles = [v for v in vehicles if v.get('status') == 'available']
+    drivers = sb.get_drivers()
+    available_drivers = [d for d in drivers if d.get('status') == 'available']
+    
+    if not available_vehicles:
+        st.warning("No hay vehículos disponibles")
+        return
+    
+    total_weight = sum(float(d.get('package_weight') or 0) for d in deliveries)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("📦 Entregas pendientes", len(deliveries))
+    with col2:
+        st.metric("🚚 Vehículos disponibles", len(available_vehicles))
+    with col3:
+        st.metric("⚖️ Peso total", f"{total_weight:.1f} kg")
+    
+    respect_windows = st.checkbox(
+        "🕐 Respetar ventanas horarias de los clientes",
+        help="Las entregas sin horario aceptan cualquier hora del turno"
+    )
+    if respect_windows:
+        col_shift1, col_shift2 = st.columns(2)
+        with col_shift1:
+            shift_start = st.time_input("Inicio del turno", value=dt_time(8, 0))
+        with col_shift2:
+            shift_end = st.time_input("Fin del turno", value=dt_time(20, 0))
+    else:
+        decompose = st.checkbox(
+            "🧩 Optimizar por zonas (días con miles de entregas)",
+            value=len(deliveries) >= DECOMPOSITION_THRESHOLD,
+            help="Agrupa las entregas por vehículo, ordena cada zona en paralelo y repara las fronteras"
+        )
+    
+    jobs = get_job_queue()
+    if st.button("🚀 Optimizar Flota", type="primary", use_container_width=True):
+        params = {'deliveries': deliveries, 'vehicles': available_vehicles, 'depot': TRUJILLO_CENTER,
+                  'time_limit': 30}
+        if respect_windows:
+            kind = 'fleet_time_windows'
+            params.update(shift_start=shift_start.strftime('%H:%M'), shift_end=shift_end.strftime('%H:%M'))
+        else:
+            kind = 'fleet_decomposed' if decompose else 'fleet'
+        st.session_state['fleet_job'] = {'job_id': jobs.submit(kind, params, priority=FLEET_JOB_PRIORITY)}
+        st.session_state.pop('fleet_result', None)
+    
+    result = wait_for_job(jobs, 'fleet_job')
+    if result:
+        # Un conductor disponible por ruta, en orden
+        for route, driver in zip(result['routes'], available_drivers):
+            route['driver_id'] = driver['id']
+        st.session_state['fleet_result'] = result
+    
+    result = st.session_state.get('fleet_result')
+    if not result:
+        return
+    
+    st.success(f"✅ {len(result['routes'])} rutas calculadas en {result['solve_time_ms']:.0f} ms "
+               f"({result['total_distance_km']:.1f} km en total)")
+    if result['unassigned']:
+        st.warning(f"⚠️ {len(result['unassigned'])} entregas no caben en la capacidad o los horarios de la flota")
+    
+    summary = pd.DataFrame([{
+        'vehículo': route['vehicle'].get('license_plate'),
+        'entregas': len(route['stops']),
+        'carga (kg)': route['load_kg'],
+        'capacidad (kg)': route['capacity_kg'],
+        'distancia (km)': route['total_distance_km'],
+        'duración (min)': route['estimated_duration_minutes']
+    } for route in result['routes']])
+    st.dataframe(summary, use_container_width=True)
+    
+    route_labels = [f"{route['vehicle'].get('license_plate')} ({len(route['stops'])} entregas)"
+                    for route in result['routes']]
+    selected_label = st.selectbox("Ver ruta en el mapa:", route_labels)
+    selected_route = result['routes'][route_labels.index(selected_label)]
+    route_map = MapVisualizer.create_delivery_map(selected_route['stops'],
+                                                  route_geometry.encode(selected_route['coordinates']))
+    folium_static(route_map, width=1200, height=500)
+    
+    if selected_route.get('schedule'):
+        st.dataframe(pd.DataFrame([{
+            'orden': k + 1,
+            'tracking': stop.get('tracking_number'),
+            'cliente': stop.get('customer_name'),
+            'llegada': arrival,
+            'horario': f"{stop.get('time_window_start') or '--'} - {stop.get('time_window_end') or '--'}"
+        } for k, (stop, arrival) in enumerate(zip(selected_route['stops'], selected_route['schedule']))]),
+            use_container_width=True)
+    
+    if st.button("💾 Guardar todas las rutas", use_container_width=True):
+        saved = 0
+        for route in result['routes']:
+            route_data = {
+                'route_name': f"Ruta {route['vehicle'].get('license_plate')} {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+                'total_distance_km': route['total_distance_km'],
+                'estimated_duration_minutes': route['estimated_duration_minutes'],
+                'polyline': route_geometry.encode(route['coordinates']),
+                'route_status': 'planned',
+                'metadata': {
+                    'delivery_count': len(route['stops']),
+                    'optimization_type': 'time_windows' if route.get('schedule') else 'capacitated_fleet',
+                    'engine': 'local',
+                    'vehicle_id': route['vehicle'].get('id'),
+                    'driver_id': route.get('driver_id'),
+                    'load_kg': route['load_kg'],
+                    'route_date': datetime.now().strftime("%Y-%m-%d")
+                }
+            }
+            try:
+                created = sb.create_route(route_data)
+                if created:
+                    sb.create_route_deliveries(created[0]['id'], [d['id'] for d in route['stops']])
+                    saved += 1
+            except Exception as e:
+                st.error(f"❌ Error al guardar la ruta {route_data['route_name']}: {str(e)}")
+        st.success(f"✅ {saved} rutas guardadas")
+        del st.session_state['fleet_result']
 
 def show_route_optimization(sb, n8n):
-    st.header("🗺️ Optimización de Rutas con Backend n8n")
+    st.header("🗺️ Optimización de Rutas")
     
     st.info("""
-    ⚡ **Esta función envía solicitudes al backend (n8n) para optimización automática usando Google Maps API**
+    ⚡ **Optimiza rutas con el motor local (sin límite de paradas) o con el backend n8n (Google Maps API)**
     
     **Proceso:**
     1. Seleccionas entregas pendientes
-    2. Se envía solicitud a n8n via webhook
-    3. n8n optimiza usando Google Maps
-    4. Resultados se guardan automáticamente
-    5. Se notifica a conductores y clientes
+    2. El motor local ordena las paradas al instante (2-opt / Or-opt)
+    3. Revisas la ruta en el mapa y la guardas
+    4. Opcional: enviar a n8n para optimización con Google Maps
     """)
     
-    # Obtener entregas pendientes con coordenadas
-    deliveries = sb.get_deliveries({'status': 'pending'})
-    deliveries_with_coords = [d for d in deliveries if d.get('customer_latitude') and d.get('customer_longitude')]
+    # Obtener entregas pendientes con coordenadas, vehículos y conductores en paralelo
+    replica = get_replica()
+    data, timings = sb.fetch_concurrently({
+        'store': lambda: get_delivery_store(replica),
+        'vehicles': sb.get_vehicles,
+        'drivers': sb.get_drivers,
+    })
+    if not show_fetch_timings(timings, required=('store',)):
+        return
+    store = data['store']
+    vehicles = data['vehicles'] or []
+    drivers = data['drivers'] or []
+    deliveries_with_coords = store.rows(store.mask(status='pending', has_coords=True))
     
     if not deliveries_with_coords:
         st.warning("📭 No hay entregas pendientes con coordenadas para optimizar.")
@@ -1189,6 +1920,16 @@ def show_route_optimization(sb, n8n):
         """)
         return
     
+    mode = st.radio(
+        "Modo de optimización:",
+        ["🚚 Ruta individual", "🚛 Flota completa (multi-vehículo)"],
+        horizontal=True
+    )
+    
+    if mode == "🚛 Flota completa (multi-vehículo)":
+        show_fleet_optimization(sb, deliveries_with_coords)
+        return
+    
     # Mostrar entregas disponibles
     st.subheader("1. Entregas Disponibles para Optimización")
     
@@ -1200,7 +1941,7 @@ def show_route_optimization(sb, n8n):
     selected_deliveries = st.multiselect(
         "Selecciona entregas para incluir en la ruta:",
         options=list(delivery_options.keys()),
-        help="Máximo 25 entregas por solicitud (límite de Google Maps API)"
+        help="El backend n8n acepta máximo 25 entregas por solicitud (límite de Google Maps API)"
     )
     
     if not selected_deliveries:
@@ -1225,7 +1966,6 @@ def show_route_optimization(sb, n8n):
     
     with col_config1:
         # Vehículos disponibles
-        vehicles = sb.get_vehicles()
         available_vehicles = [v for v in vehicles if v.get('status') == 'available']
         
         if available_vehicles:
@@ -1242,7 +1982,6 @@ def show_route_optimization(sb, n8n):
     
     with col_config2:
         # Conductores disponibles
-        drivers = sb.get_drivers()
         available_drivers = [d for d in drivers if d.get('status') == 'available']
         
         if available_drivers:
@@ -1260,59 +1999,120 @@ def show_route_optimization(sb, n8n):
     # Botón de optimización
     st.subheader("3. Solicitar Optimización")
     
+    engine = st.radio(
+        "Motor de optimización:",
+        ["⚡ Local (en proceso)", "🌐 Backend n8n"],
+        horizontal=True
+    )
+    
+    if engine == "⚡ Local (en proceso)":
+        use_parallel = st.checkbox(
+            "🧠 Búsqueda paralela multi-arranque",
+            help="Ejecuta varias búsquedas con distintas heurísticas y semillas en todos los núcleos"
+        )
+        if use_parallel:
+            col_par1, col_par2 = st.columns(2)
+            with col_par1:
+                time_budget = st.slider("⏱️ Presupuesto de tiempo (s)", min_value=1, max_value=60, value=5)
+            with col_par2:
+                deterministic = st.checkbox("🔒 Modo determinista",
+                                            help="Misma entrada, misma ruta (ignora el presupuesto de tiempo)")
+        
+        jobs = get_job_queue()
+        if st.button("🚀 Optimizar Ruta", type="primary", use_container_width=True):
+            if use_parallel:
+                kind, params = 'route_parallel', {'time_budget': time_budget, 'deterministic': deterministic}
+            else:
+                kind, params = 'route', {'time_limit': 10}
+            params.update(deliveries=selected_delivery_data, depot=TRUJILLO_CENTER)
+            st.session_state['local_route_job'] = {
+                'job_id': jobs.submit(kind, params, priority=ROUTE_JOB_PRIORITY),
+                'delivery_ids': selected_ids, 'vehicle_id': vehicle_id, 'driver_id': driver_id
+            }
+            st.session_state.pop('local_route_result', None)
+        
+        job = st.session_state.get('local_route_job')
+        result = wait_for_job(jobs, 'local_route_job')
+        if result:
+            result.update({'delivery_ids': job['delivery_ids'], 'vehicle_id': job['vehicle_id'],
+                           'driver_id': job['driver_id']})
+            st.session_state['local_route_result'] = result
+        
+        result = st.session_state.get('local_route_result')
+        if result and result['delivery_ids'] == selected_ids:
+            show_local_route_result(sb, result)
+        return
+    
     if st.button("🚀 Solicitar Optimización al Backend (n8n)", type="primary", use_container_width=True):
         if len(selected_ids) > 25:
             st.error("❌ Máximo 25 entregas por solicitud (límite de Google Maps API)")
             return
         
-        # Mostrar progreso
-        
         with st.spinner("⏳ Enviando solicitud al backend..."):
-            # Simplemente ejecuta el webhook manual de n8n
-            webhook_url = "http://localhost:5678/webhook-test/manual-optimization"
-            try:
-                response = requests.post(webhook_url, timeout=30)
-                if response.status_code == 200:
-                    st.success("✅ Optimización iniciada!")
-                    
-                    # **CAMBIO AQUÍ**: En lugar de esperar webhook, consulta Supabase
-                    st.info("⏳ Verificando resultados en Supabase...")
-                    
-                    # Espera 5 segundos y luego verifica
-                    time.sleep(5)
-                    
-                    # Verifica si se creó una nueva ruta
-                    routes = sb.get_routes()
-                    if routes:
-                        latest_route = routes[0]
-                        st.success(f"✅ Ruta creada: {latest_route['route_name']}")
-                        st.json({
-                            "distancia": f"{latest_route.get('total_distance_km', 0)} km",
-                            "duración": f"{latest_route.get('estimated_duration_minutes', 0)} min",
-                            "entregas": latest_route.get('metadata', {}).get('delivery_count', 0)
-                        })
-                        
-                        # Muestra botón para ver la ruta
-                        if st.button("🗺️ Ver Ruta Optimizada"):
-                            show_route_details(sb, latest_route['id'])
-                else:
-                    st.error(f"❌ Error del backend: {response.status_code}")
-                    
-            except Exception as e:
-                st.error(f"❌ Error de conexión: {str(e)}")
-                st.info("""
-                **Solución rápida:**
-                1. Asegúrate que n8n esté corriendo
-                2. Ejecuta manualmente el workflow en n8n
-                3. Los datos se guardarán en Supabase automáticamente
-                """)
+            request_result = n8n.request_optimization(selected_ids, vehicle_id, driver_id)
+        if request_result['success']:
+            st.session_state['n8n_job'] = {'job_id': request_result['job_id'], 'delivery_ids': selected_ids}
+            st.session_state.pop('n8n_result', None)
+        else:
+            st.error(f"❌ {request_result['message']}")
+            st.info("""
+            **Solución rápida:**
+            1. Asegúrate que n8n esté corriendo
+            2. Ejecuta manualmente el workflow en n8n
+            3. Los datos se guardarán en Supabase automáticamente
+            """)
+    
+    # El resultado se busca por el id del trabajo: nunca se confunde con la ruta de otro despachador
+    job = st.session_state.get('n8n_job')
+    if job and 'n8n_result' not in st.session_state:
+        st.success(f"✅ Optimización iniciada (trabajo `{job['job_id'][:8]}`)")
+        # Cada rerun sólo revisa un momento; la espera larga es a pedido del usuario
+        timeout = N8N_RESULT_WAIT_SECONDS if st.session_state.pop('n8n_wait', False) else N8N_RESULT_CHECK_SECONDS
+        with st.spinner("⏳ Esperando el resultado de n8n..."):
+            job_result = n8n.wait_for_result(job['job_id'], timeout=timeout)
+        if job_result:
+            st.session_state['n8n_result'] = job_result
+        else:
+            st.info(f"⏳ n8n sigue procesando la solicitud (trabajo `{job['job_id'][:8]}`)")
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("🔄 Seguir esperando", key="n8n_wait_more", use_container_width=True):
+                    st.session_state['n8n_wait'] = True
+                    st.rerun()
+            with col2:
+                if st.button("✖️ Dejar de esperar", key="n8n_forget", use_container_width=True):
+                    del st.session_state['n8n_job']
+                    st.rerun()
+    
+    job_result = st.session_state.get('n8n_result')
+    if job and job_result:
+        latest_route = job_result['route']
+        if latest_route:
+            st.success(f"✅ Ruta creada: {latest_route.get('route_name')}")
+            st.json({
+                "distancia": f"{latest_route.get('total_distance_km', 0)} km",
+                "duración": f"{latest_route.get('estimated_duration_minutes', 0)} min",
+                "entregas": (latest_route.get('metadata') or {}).get('delivery_count', 0)
+            })
+            if latest_route.get('id') and st.button("🗺️ Ver Ruta Optimizada"):
+                show_route_details(sb, latest_route['id'])
+        else:
+            st.success("✅ n8n respondió a la solicitud")
+            st.json(job_result['payload'])
         
 
 def show_driver_reports(sb):
     st.header("👥 Reportes por Conductor")
     
-    drivers = sb.get_drivers()
-    deliveries = sb.get_deliveries()
+    replica = get_replica()
+    data, timings = sb.fetch_concurrently({
+        'drivers': sb.get_drivers,
+        'store': lambda: get_delivery_store(replica),
+    })
+    if not show_fetch_timings(timings, required=('drivers', 'store')):
+        return
+    drivers = data['drivers']
+    store = data['store']
     
     if not drivers:
         st.warning("No hay conductores registrados.")
@@ -1341,7 +2141,7 @@ def show_driver_reports(sb):
     
     col_d1, col_d2, col_d3, col_d4 = st.columns(4)
     
-    driver_deliveries = [d for d in deliveries if d.get('assigned_driver_id') == driver_id]
+    driver_deliveries = store.rows(store.mask(driver_id=driver_id))
     
     with col_d1:
         total = len(driver_deliveries)
@@ -1429,7 +2229,7 @@ def show_driver_reports(sb):
 def show_route_history(sb):
     st.header("📋 Historial de Rutas Optimizadas")
     
-    routes = sb.get_routes()
+    routes = get_replica().rows('optimized_routes', order_by='created_at', desc=True)
     
     if not routes:
         st.info("No hay rutas optimizadas registradas.")
@@ -1461,7 +2261,15 @@ def show_route_history(sb):
     # Mostrar lista de rutas
     st.subheader(f"📅 Rutas Optimizadas ({len(filtered_routes)})")
     
-    for route in filtered_routes[:10]:  # Mostrar máximo 10
+    page_routes = filtered_routes[:10]  # Mostrar máximo 10
+    
+    if st.checkbox(f"🗺️ Ver las {min(len(filtered_routes), 50)} rutas más recientes en un mapa"):
+        folium_static(MapVisualizer.create_routes_map(filtered_routes[:50]), width=1200, height=500)
+    
+    # Entregas de todas las rutas de la página en una sola tanda de consultas
+    deliveries_by_route = sb.get_deliveries_for_routes([route['id'] for route in page_routes])
+    
+    for route in page_routes:
         with st.expander(f"🗺️ {route.get('route_name', 'Ruta sin nombre')} - {route.get('created_at', '')[:10]}"):
             col_r1, col_r2, col_r3 = st.columns(3)
             
@@ -1470,15 +2278,14 @@ def show_route_history(sb):
             with col_r2:
                 st.metric("Duración", f"{route.get('estimated_duration_minutes', 0):.0f} min")
             with col_r3:
-                st.metric("Estado", route.get('route_status', 'desconocido').title())
+                st.metric("Estado", (route.get('route_status') or 'desconocido').title())
             
-            # Obtener entregas de esta ruta
-            route_deliveries = sb.get_route_deliveries(route['id'])
+            route_deliveries = deliveries_by_route.get(route['id'], [])
             
             if route_deliveries:
                 st.write("**Entregas en esta ruta:**")
-                for rd in route_deliveries:
-                    st.write(f"- Orden {rd.get('sequence_order')}: Entrega {rd.get('delivery_id', '')[:8]}...")
+                for order, delivery in enumerate(route_deliveries, start=1):
+                    st.write(f"- Orden {order}: {delivery.get('tracking_number')} - {delivery.get('customer_name')}")
             
             # Botones de acción
             col_btn1, col_btn2 = st.columns(2)
@@ -1488,26 +2295,13 @@ def show_route_history(sb):
             with col_btn2:
                 if st.button("🗺️ Ver en Mapa", key=f"map_{route['id']}"):
                     # Mostrar mapa de esta ruta
-                    if route.get('polyline'):
-                        try:
-                            # Obtener entregas para mostrar en mapa
-                            deliveries_data = []
-                            for rd in route_deliveries:
-                                try:
-                                    response = sb.client.table('deliveries').select('*').eq('id', rd['delivery_id']).single().execute()
-                                    if response.data:
-                                        deliveries_data.append(response.data)
-                                except:
-                                    pass
-                            
-                            if deliveries_data:
-                                route_map = MapVisualizer.create_delivery_map(
-                                    deliveries_data, 
-                                    route['polyline']
-                                )
-                                folium_static(route_map, width=800, height=500)
-                        except:
-                            st.error("Error al mostrar el mapa")
+                    if route.get('polyline') and route_deliveries:
+                        route_map = MapVisualizer.create_delivery_map(
+                            route_deliveries,
+                            route['polyline'],
+                            route_id=route['id']
+                        )
+                        folium_static(route_map, width=800, height=500)
     
     # Gráfico de rutas por día
     st.markdown("---")
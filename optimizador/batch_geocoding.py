@@ -0,0 +1,163 @@
+# batch_geocoding.py
+"""Geocodificación masiva concurrente con httpx.AsyncClient y límite de tasa
+
+Las direcciones se resuelven con concurrencia acotada (semáforo) y un token
+bucket ajustado a la cuota del proveedor. OVER_QUERY_LIMIT y los errores de
+red se reintentan con backoff exponencial; si Google no encuentra la
+dirección se usa el centroide del distrito. Los resultados se entregan a
+medida que terminan, no al final del lote.
+"""
+import asyncio
+import random
+import time
+
+import httpx
+
+from geocoding import (GOOGLE_GEOCODE_URL, UNCACHEABLE_STATUSES, USER_AGENT, build_query, normalize_address,
+                       parse_response, request_params)
+
+DEFAULT_CONCURRENCY = 10
+
+# Cuota por defecto de la Geocoding API (consultas por segundo)
+DEFAULT_RATE_PER_SECOND = 40
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_SECONDS = 0.5
+
+# Estados que justifican reintentar la misma consulta
+RETRYABLE_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR", "ERROR"}
+
+
+class TokenBucket:
+    """Limitador de tasa: `rate` consultas por segundo con ráfagas de hasta `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BatchGeocoder:
+    """Resuelve listas grandes de direcciones compartiendo la caché de `GeocodingService`"""
+
+    def __init__(self, api_key, cache=None, base_url=GOOGLE_GEOCODE_URL, concurrency=DEFAULT_CONCURRENCY,
+                 rate_per_second=DEFAULT_RATE_PER_SECOND, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_seconds=DEFAULT_BACKOFF_SECONDS, center=None, max_distance_km=None,
+                 district_centroids=None, timeout=10, transport=None):
+        self.api_key = api_key
+        self.cache = cache
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.rate_per_second = rate_per_second
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.center = center
+        self.max_distance_km = max_distance_km
+        self.district_centroids = district_centroids or {}
+        self.timeout = timeout
+        self.transport = transport
+
+    async def stream(self, items):
+        """Genera un dict por dirección a medida que se resuelve
+
+        `items` son dicts con 'address' y opcionalmente 'district' y 'key'
+        (identificador del llamador, por ejemplo el número de fila). Cada
+        resultado trae key, address, coords, status y source (cache, google,
+        district o None).
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        bucket = TokenBucket(self.rate_per_second)
+        max_in_flight = self.concurrency * 4
+        items = iter(items)
+
+        async with httpx.AsyncClient(timeout=self.timeout, transport=self.transport,
+                                     headers={'User-Agent': USER_AGENT}) as client:
+            pending = set()
+            exhausted = False
+            while pending or not exhausted:
+                # Mantener una ventana acotada de tareas en vuelo para listas muy grandes
+                while not exhausted and len(pending) < max_in_flight:
+                    item = next(items, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    pending.add(asyncio.create_task(self._resolve(client, semaphore, bucket, item)))
+
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+
+    def geocode_all(self, items, on_result=None):
+        """Versión síncrona: resuelve todo el lote y llama `on_result` por cada resultado"""
+        async def collect():
+            results = []
+            async for result in self.stream(items):
+                results.append(result)
+                if on_result:
+                    on_result(result)
+            return results
+
+        return asyncio.run(collect())
+
+    async def _resolve(self, client, semaphore, bucket, item):
+        address = item['address']
+        result = {"key": item.get('key'), "address": address, "coords": None, "status": None, "source": None}
+
+        cache_key = normalize_address(address)
+        cached = self.cache.get(cache_key) if self.cache is not None else None
+        if cached is not None and cached[0]:
+            result.update(coords=cached[1], status="OK", source="cache")
+            return result
+
+        if cached is not None:
+            status = "ZERO_RESULTS"
+        else:
+            async with semaphore:
+                coords, status = await self._request(client, bucket, build_query(address))
+            if self.cache is not None and status not in UNCACHEABLE_STATUSES:
+                self.cache.set(cache_key, coords)
+            if coords:
+                result.update(coords=coords, status=status, source="google")
+                return result
+
+        # Respaldo: centroide del distrito
+        centroid = self.district_centroids.get(item.get('district'))
+        result.update(coords=centroid, status=status, source="district" if centroid else None)
+        return result
+
+    async def _request(self, client, bucket, address):
+        status = "ERROR"
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            try:
+                response = await client.get(self.base_url, params=request_params(address, self.api_key))
+                if response.status_code == 429 or response.status_code >= 500:
+                    status = "OVER_QUERY_LIMIT" if response.status_code == 429 else "UNKNOWN_ERROR"
+                else:
+                    coords, status = parse_response(response.json(), self.center, self.max_distance_km)
+                    if status not in RETRYABLE_STATUSES:
+                        return coords, status
+            except (httpx.HTTPError, ValueError) as e:
+                print(f"Error en geocodificación masiva: {str(e)}")
+                status = "ERROR"
+
+            if attempt < self.max_retries:
+                delay = self.backoff_seconds * 2 ** attempt
+                await asyncio.sleep(delay + random.uniform(0, self.backoff_seconds))
+
+        return None, status
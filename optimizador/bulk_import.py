@@ -0,0 +1,230 @@
+# bulk_import.py
+"""Importación masiva de entregas desde CSV/Excel: lectura por bloques, validación, geocodificación e inserción por lotes"""
+import random
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from districts import DistrictIndex, fold_text
+
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_BATCH_SIZE = 500
+
+CITY_SUFFIX = "Trujillo, La Libertad, Perú"
+
+# Nombres de columna aceptados (en minúsculas y sin tildes) → campo de la tabla deliveries
+COLUMN_ALIASES = {
+    'customer_name': ['customer_name', 'cliente', 'nombre', 'nombre del cliente'],
+    'customer_phone': ['customer_phone', 'telefono', 'celular', 'phone'],
+    'customer_email': ['customer_email', 'email', 'correo'],
+    'customer_address': ['customer_address', 'direccion', 'address', 'calle'],
+    'district': ['district', 'distrito'],
+    'package_description': ['package_description', 'descripcion', 'contenido'],
+    'package_weight': ['package_weight', 'peso', 'peso (kg)', 'weight'],
+    'priority': ['priority', 'prioridad'],
+    'special_instructions': ['special_instructions', 'instrucciones', 'observaciones'],
+    'time_window_start': ['time_window_start', 'desde', 'hora desde'],
+    'time_window_end': ['time_window_end', 'hasta', 'hora hasta'],
+    'service_time_minutes': ['service_time_minutes', 'atencion', 'atencion (min)'],
+    'customer_latitude': ['customer_latitude', 'latitud', 'latitude', 'lat'],
+    'customer_longitude': ['customer_longitude', 'longitud', 'longitude', 'lon', 'lng'],
+}
+
+REQUIRED_FIELDS = ('customer_name', 'customer_phone', 'customer_address')
+
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+CLOCK_PATTERN = re.compile(r'^\d{1,2}:\d{2}(:\d{2})?$')
+
+
+def _column_mapping(columns):
+    lookup = {alias: field for field, aliases in COLUMN_ALIASES.items() for alias in aliases}
+    return {col: lookup[fold_text(col)] for col in columns if fold_text(col) in lookup}
+
+
+def iter_chunks(source, filename, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Lee el archivo por bloques de `chunk_size` filas con las columnas ya renombradas
+
+    Los CSV se leen en streaming; los Excel se cargan completos (el formato no
+    permite lectura parcial con pandas) y luego se dividen.
+    """
+    if filename.lower().endswith(('.xlsx', '.xls')):
+        frame = pd.read_excel(source, dtype=str)
+        chunks = (frame.iloc[k:k + chunk_size] for k in range(0, len(frame), chunk_size))
+    else:
+        chunks = pd.read_csv(source, dtype=str, chunksize=chunk_size, skipinitialspace=True)
+
+    for chunk in chunks:
+        yield chunk.rename(columns=_column_mapping(chunk.columns))
+
+
+def tracking_prefix():
+    """Prefijo TRU + fecha de los números de tracking de hoy"""
+    return f"TRU{datetime.now().strftime('%y%m%d')}"
+
+
+def new_tracking_number(used):
+    """Número de tracking TRU + fecha + 6 dígitos que no está en `used` (y queda agregado)"""
+    prefix = tracking_prefix()
+    while True:
+        tracking = f"{prefix}{random.randint(0, 999999):06d}"
+        if tracking not in used:
+            used.add(tracking)
+            return tracking
+
+
+def _is_duplicate_key(error):
+    """True si el insert falló por una clave única repetida (código 23505 de PostgreSQL)"""
+    return getattr(error, 'code', None) == '23505' or 'duplicate key' in str(error)
+
+
+def validate_row(raw, districts):
+    """Valida y normaliza una fila; devuelve (entrega, error)"""
+    row = {k: (v.strip() if isinstance(v, str) else v) for k, v in raw.items() if k in COLUMN_ALIASES}
+    row = {k: v for k, v in row.items() if v not in (None, '') and not (isinstance(v, float) and pd.isna(v))}
+
+    missing = [f for f in REQUIRED_FIELDS if not row.get(f)]
+    if missing:
+        return None, f"Faltan campos obligatorios: {', '.join(missing)}"
+
+    delivery = {
+        'customer_name': row['customer_name'],
+        'customer_phone': row['customer_phone'],
+        'customer_email': row.get('customer_email'),
+        'package_description': row.get('package_description'),
+        'status': 'pending',
+    }
+
+    if delivery['customer_email'] and not EMAIL_PATTERN.match(delivery['customer_email']):
+        return None, f"Email inválido: {delivery['customer_email']}"
+
+    try:
+        delivery['package_weight'] = float(str(row.get('package_weight', 1.0)).replace(',', '.'))
+        delivery['priority'] = int(float(row.get('priority', 3)))
+        if row.get('service_time_minutes'):
+            delivery['service_time_minutes'] = int(float(row['service_time_minutes']))
+    except ValueError:
+        return None, "Peso, prioridad o tiempo de atención no numéricos"
+    if delivery['package_weight'] <= 0:
+        return None, "El peso debe ser mayor a 0"
+    if not 1 <= delivery['priority'] <= 5:
+        return None, "La prioridad debe estar entre 1 y 5"
+
+    district = row.get('district')
+    if district:
+        district = districts.get(fold_text(district))
+        if district is None:
+            return None, f"Distrito desconocido: {row['district']}"
+
+    # Dirección completa en el mismo formato que el formulario de nueva entrega
+    address_parts = [row['customer_address']]
+    if district and fold_text(district) not in fold_text(row['customer_address']):
+        address_parts.append(district)
+    if 'trujillo' not in fold_text(row['customer_address']):
+        address_parts.append(CITY_SUFFIX)
+    delivery['customer_address'] = ", ".join(address_parts)
+    if district:
+        delivery['district'] = district
+
+    for field in ('time_window_start', 'time_window_end'):
+        if row.get(field):
+            if not CLOCK_PATTERN.match(row[field]):
+                return None, f"Hora inválida en {field}: {row[field]}"
+            delivery[field] = row[field][:5].zfill(5)
+    if row.get('special_instructions'):
+        delivery['special_instructions'] = row['special_instructions']
+
+    if row.get('customer_latitude') and row.get('customer_longitude'):
+        try:
+            delivery['customer_latitude'] = float(row['customer_latitude'])
+            delivery['customer_longitude'] = float(row['customer_longitude'])
+        except ValueError:
+            return None, "Coordenadas no numéricas"
+
+    return {'delivery': delivery, 'district': district}, None
+
+
+def import_deliveries(source, filename, sb, geocoder, districts, batch_size=DEFAULT_BATCH_SIZE,
+                      chunk_size=DEFAULT_CHUNK_SIZE, on_progress=None):
+    """Importa un archivo completo y devuelve {'inserted', 'processed', 'errors': [{'fila', 'error'}]}
+
+    `geocoder` es un `BatchGeocoder`; `districts` mapea nombre de distrito a
+    coordenadas y se usa para validar la columna de distrito y para asignar
+    por coordenadas el distrito de las filas que no lo traen. `on_progress`
+    recibe (procesadas, insertadas, errores) después de cada lote.
+    """
+    known_districts = {fold_text(name): name for name in districts}
+    district_index = DistrictIndex(districts)
+    report = {'inserted': 0, 'processed': 0, 'errors': []}
+    # Los trackings de hoy ya guardados no se repiten: un choque haría fallar el lote completo
+    used_trackings = set(sb.get_tracking_numbers(tracking_prefix()))
+    row_number = 1  # La fila 1 es la cabecera
+
+    for chunk in iter_chunks(source, filename, chunk_size):
+        valid = []
+        for raw in chunk.to_dict(orient='records'):
+            row_number += 1
+            parsed, error = validate_row(raw, known_districts)
+            if error:
+                report['errors'].append({'fila': row_number, 'error': error})
+            else:
+                parsed['row'] = row_number
+                valid.append(parsed)
+
+        # Geocodificar en lote sólo las filas sin coordenadas
+        to_geocode = [
+            {'key': k, 'address': p['delivery']['customer_address'], 'district': p['district']}
+            for k, p in enumerate(valid) if 'customer_latitude' not in p['delivery']
+        ]
+        failed = set()
+        for result in geocoder.geocode_all(to_geocode):
+            delivery = valid[result['key']]['delivery']
+            if result['coords']:
+                delivery['customer_latitude'], delivery['customer_longitude'] = map(float, result['coords'])
+            else:
+                failed.add(result['key'])
+                report['errors'].append({'fila': valid[result['key']]['row'],
+                                         'error': f"No se pudo geocodificar ({result['status']})"})
+        valid = [p for k, p in enumerate(valid) if k not in failed]
+
+        # Distrito guardado en cada fila: el filtro y los conteos no vuelven a inferirlo
+        missing = [p['delivery'] for p in valid if 'district' not in p['delivery']]
+        if missing:
+            lats = np.array([d['customer_latitude'] for d in missing], dtype=np.float64)
+            lons = np.array([d['customer_longitude'] for d in missing], dtype=np.float64)
+            for delivery, name in zip(missing, district_index.assign_names(lats, lons)):
+                delivery['district'] = name
+
+        created_at = datetime.now().isoformat()
+        for p in valid:
+            p['delivery']['tracking_number'] = new_tracking_number(used_trackings)
+            p['delivery']['created_at'] = created_at
+
+        for start in range(0, len(valid), batch_size):
+            batch = valid[start:start + batch_size]
+            try:
+                try:
+                    inserted = sb.insert_deliveries([p['delivery'] for p in batch], batch_size=batch_size)
+                except Exception as e:
+                    if not _is_duplicate_key(e):
+                        raise
+                    # Otro proceso usó uno de estos trackings mientras tanto: reintentar con números nuevos
+                    for p in batch:
+                        p['delivery']['tracking_number'] = new_tracking_number(used_trackings)
+                    inserted = sb.insert_deliveries([p['delivery'] for p in batch], batch_size=batch_size)
+                report['inserted'] += len(inserted)
+            except Exception as e:
+                for p in batch:
+                    report['errors'].append({'fila': p['row'], 'error': f"Error al insertar lote: {str(e)}"})
+            report['processed'] = row_number - 1
+            if on_progress:
+                on_progress(report['processed'], report['inserted'], len(report['errors']))
+
+        if not valid:
+            report['processed'] = row_number - 1
+            if on_progress:
+                on_progress(report['processed'], report['inserted'], len(report['errors']))
+
+    report['errors'].sort(key=lambda e: e['fila'])
+    return report
@@ -0,0 +1,64 @@
+# dashboard_metrics.py
+"""Métricas del panel de control calculadas en una sola pasada vectorizada sobre `DeliveryStore`"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from delivery_store import to_utc64
+
+HIGH_PRIORITY = 1
+
+
+@dataclass
+class DashboardMetrics:
+    total: int = 0
+    last_24h: int = 0
+    pending: int = 0
+    pending_high_priority: int = 0
+    assigned: int = 0
+    in_transit: int = 0
+    delivered: int = 0
+    geolocated: int = 0
+    districts_covered: int = 0
+    status_counts: dict = field(default_factory=dict)  # estado → cantidad (sólo estados presentes)
+    daily_counts: list = field(default_factory=list)  # [(fecha 'YYYY-MM-DD', cantidad)] en orden
+
+    @property
+    def success_rate(self):
+        return self.delivered / max(self.total, 1) * 100
+
+
+def compute_dashboard_metrics(store, now=None):
+    """Todos los agregados del panel a partir de las columnas del almacén"""
+    now = now or datetime.now(timezone.utc)
+    if len(store) == 0:
+        return DashboardMetrics()
+
+    categories = list(store.status.categories)
+    by_status = np.bincount(store.status.codes[store.status.codes >= 0], minlength=len(categories))
+    counts = dict(zip(categories, by_status.tolist()))
+
+    pending_code = categories.index('pending')
+    high_pending = np.count_nonzero((store.status.codes == pending_code) & (store.priority == HIGH_PRIORITY))
+
+    created = store.created_at
+    valid = ~np.isnat(created)
+    last_24h = np.count_nonzero(created[valid] > to_utc64(now - timedelta(hours=24)))
+    days, per_day = np.unique(created[valid].astype('datetime64[D]'), return_counts=True)
+
+    district_codes = store.district.codes[store.has_coords]
+
+    return DashboardMetrics(
+        total=len(store),
+        last_24h=int(last_24h),
+        pending=counts['pending'],
+        pending_high_priority=int(high_pending),
+        assigned=counts['assigned'],
+        in_transit=counts['in_transit'],
+        delivered=counts['delivered'],
+        geolocated=int(np.count_nonzero(store.has_coords)),
+        districts_covered=len(np.unique(district_codes[district_codes >= 0])),
+        status_counts={status: n for status, n in counts.items() if n},
+        daily_counts=list(zip(days.astype(str).tolist(), per_day.tolist())),
+    )
@@ -0,0 +1,254 @@
+# data_sync.py
+"""Réplica local en memoria de tablas de Supabase con sincronización incremental
+
+Tras una carga inicial, cada sincronización pide sólo las filas con marca de
+agua (`updated_at`, mantenida por el trigger de migrations/003; `created_at` si
+la tabla aún no la tiene) mayor o igual a la última vista y las fusiona por id.
+Las escrituras hechas desde la app llegan por `ChangeFeed` sin esperar a la
+siguiente consulta, y cada cierto tiempo se hace una recarga completa para
+reflejar borrados.
+
+Cada réplica guarda sus filas en un único almacenamiento inmutable por versión:
+`RowTable` (dicts por id) por defecto, o el que se indique por tabla, como el
+`DeliveryStore` columnar de las entregas. Un cambio produce una versión nueva
+con `merged()`, así quien tiene la anterior la sigue viendo consistente.
+"""
+import threading
+import time
+
+SYNC_PAGE_SIZE = 1000
+
+# Segundos mínimos entre dos consultas de cambios (los reruns dentro de esta ventana no consultan)
+DEFAULT_MIN_INTERVAL_SECONDS = 5
+
+# Recarga completa periódica: la marca de agua no ve filas borradas
+DEFAULT_FULL_RESYNC_SECONDS = 15 * 60
+
+WATERMARK_FIELDS = ('updated_at', 'created_at')
+
+
+class ChangeFeed:
+    """Canal local de cambios: quien escribe publica filas y las réplicas suscritas las aplican"""
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """`callback(table, rows, deleted_ids)` se llama en el hilo que publica"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def publish(self, table, rows=(), deleted_ids=()):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(table, list(rows), list(deleted_ids))
+
+
+class RowTable:
+    """Almacenamiento por defecto de una réplica: filas completas como dicts indexados por id"""
+
+    def __init__(self, rows=(), version=None):
+        self.version = version
+        self._rows = {}
+        for row in rows:
+            current = self._rows.get(row['id'])
+            self._rows[row['id']] = {**current, **row} if current else dict(row)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def merged(self, rows, deleted_ids=(), version=None):
+        """Nueva versión con `rows` fusionadas por id (una fila parcial sólo cambia sus campos) y sin `deleted_ids`"""
+        table = RowTable(version=version)
+        table._rows = dict(self._rows)
+        for row in rows:
+            current = table._rows.get(row['id'])
+            table._rows[row['id']] = {**current, **row} if current else dict(row)
+        for row_id in deleted_ids:
+            table._rows.pop(row_id, None)
+        return table
+
+    def rows(self):
+        return [dict(r) for r in self._rows.values()]
+
+    def rows_by_id(self, ids):
+        return [dict(self._rows[i]) for i in ids if i in self._rows]
+
+    def row(self, row_id):
+        row = self._rows.get(row_id)
+        return dict(row) if row is not None else None
+
+
+class TableReplica:
+    """Copia local de una tabla indexada por id y sincronizada por marca de agua"""
+
+    def __init__(self, table, fetch_page, storage=RowTable, min_interval_seconds=DEFAULT_MIN_INTERVAL_SECONDS,
+                 full_resync_seconds=DEFAULT_FULL_RESYNC_SECONDS, page_size=SYNC_PAGE_SIZE):
+        """`fetch_page(table, field, since, offset, limit)` devuelve filas ordenadas por `field`
+
+        `storage(filas, versión)` crea el almacenamiento de la tabla (ver `RowTable`).
+        """
+        self.table = table
+        self.fetch_page = fetch_page
+        self.storage = storage
+        self.min_interval_seconds = min_interval_seconds
+        self.full_resync_seconds = full_resync_seconds
+        self.page_size = page_size
+        self.watermark_field = None
+        self.watermark = None
+        self.last_sync = 0.0
+        self.last_full_sync = 0.0
+        self.stats = {"full_loads": 0, "delta_syncs": 0, "rows_fetched": 0, "pushed": 0}
+        self.version = 0  # Cambia cada vez que cambia el contenido
+        self._data = storage([], 0)
+        self._listeners = []
+        self._lock = threading.RLock()
+
+    def sync(self, force=False):
+        """Trae los cambios pendientes; no consulta si la última sincronización es reciente"""
+        with self._lock:
+            now = time.monotonic()
+            if self.watermark_field is None or now - self.last_full_sync > self.full_resync_seconds:
+                self._full_load()
+            elif force or now - self.last_sync >= self.min_interval_seconds:
+                self._merge(self._fetch_since(self.watermark))
+                self.stats["delta_syncs"] += 1
+            self.last_sync = time.monotonic()
+
+    def rows(self, sync=True, order_by=None, desc=False, **equals):
+        """Filas actuales (copias), opcionalmente filtradas por igualdad de campos y ordenadas"""
+        if sync:
+            self.sync()
+        with self._lock:
+            data = self._data
+        rows = data.rows()
+        if equals:
+            rows = [r for r in rows if all(r.get(k) == v for k, v in equals.items())]
+        if order_by:
+            rows.sort(key=lambda r: (r.get(order_by) is not None, r.get(order_by) or ''), reverse=desc)
+        return rows
+
+    def snapshot(self, sync=True):
+        """(versión, almacenamiento) vigentes; el almacenamiento no cambia, así que no se copia"""
+        if sync:
+            self.sync()
+        with self._lock:
+            return self.version, self._data
+
+    def listen(self, callback):
+        """`callback(filas, ids_borrados, reset)` recibe cada cambio; empieza con el contenido actual"""
+        with self._lock:
+            self._listeners.append(callback)
+            callback(self._data.rows(), [], True)
+
+    def _notify(self, ids=None, deleted_ids=()):
+        """Avisa a los oyentes con las filas de `ids` (todas, como reinicio, si es None)"""
+        if not self._listeners:
+            return
+        rows = self._data.rows() if ids is None else self._data.rows_by_id(ids)
+        for callback in self._listeners:
+            callback(rows, list(deleted_ids), ids is None)
+
+    def get(self, row_id):
+        with self._lock:
+            data = self._data
+        return data.row(row_id)
+
+    def __len__(self):
+        return len(self._data)
+
+    def apply(self, rows=(), deleted_ids=()):
+        """Aplica cambios empujados por el canal, sin consultar la base"""
+        with self._lock:
+            # Sin mover la marca de agua: podría saltar cambios de otros aún no leídos
+            self._merge(rows, deleted_ids, advance=False)
+            self.stats["pushed"] += len(rows) + len(deleted_ids)
+
+    def _full_load(self):
+        # Tras la primera carga se sigue usando la columna que funcionó
+        fields = (self.watermark_field,) if self.watermark_field else WATERMARK_FIELDS
+        for field in fields:
+            try:
+                rows = self._fetch_all(field, None)
+            except Exception:
+                # La tabla no tiene esta columna (falta migrations/003): probar con la siguiente
+                continue
+            self.watermark_field = field
+            self.watermark = self._max_watermark(rows, None)
+            self.version += 1
+            self._data = self.storage(rows, self.version)
+            del rows  # Las filas leídas no se retienen mientras se notifica
+            self._notify()
+            self.last_full_sync = time.monotonic()
+            self.stats["full_loads"] += 1
+            return
+        raise RuntimeError(f"La tabla {self.table} no tiene columna de marca de agua")
+
+    def _fetch_since(self, since):
+        return self._fetch_all(self.watermark_field, since)
+
+    def _fetch_all(self, field, since):
+        rows, offset = [], 0
+        while True:
+            page = self.fetch_page(self.table, field, since, offset, self.page_size)
+            rows.extend(page)
+            self.stats["rows_fetched"] += len(page)
+            if len(page) < self.page_size:
+                return rows
+            offset += self.page_size
+
+    def _max_watermark(self, rows, watermark):
+        field = self.watermark_field
+        for row in rows:
+            value = row.get(field)
+            # Comparación de texto: las marcas ISO 8601 de PostgREST ordenan igual que las fechas
+            if value and (watermark is None or value > watermark):
+                watermark = value
+        return watermark
+
+    def _merge(self, rows, deleted_ids=(), advance=True):
+        if not rows and not deleted_ids:
+            return
+        if advance:
+            self.watermark = self._max_watermark(rows, self.watermark)
+        self.version += 1
+        self._data = self._data.merged(rows, deleted_ids, self.version)
+        self._notify(list(dict.fromkeys(r['id'] for r in rows)), deleted_ids)
+
+
+class DataReplica:
+    """Réplicas de varias tablas conectadas a un mismo `ChangeFeed`"""
+
+    def __init__(self, fetch_page, tables, feed=None, storages=None, **options):
+        """`storages` elige el almacenamiento de algunas tablas (por defecto `RowTable`)"""
+        storages = storages or {}
+        self.tables = {table: TableReplica(table, fetch_page, storage=storages.get(table, RowTable), **options)
+                       for table in tables}
+        if feed is not None:
+            feed.subscribe(self._on_change)
+
+    def listen(self, table, callback):
+        self.tables[table].listen(callback)
+
+    def rows(self, table, order_by=None, desc=False, **equals):
+        return self.tables[table].rows(order_by=order_by, desc=desc, **equals)
+
+    def store(self, table):
+        """Almacenamiento vigente de la tabla (sincronizada si toca)"""
+        return self.tables[table].snapshot()[1]
+
+    def sync(self, force=False):
+        for replica in self.tables.values():
+            replica.sync(force=force)
+
+    def stats(self):
+        return {table: dict(replica.stats, rows=len(replica), watermark=replica.watermark)
+                for table, replica in self.tables.items()}
+
+    def _on_change(self, table, rows, deleted_ids):
+        replica = self.tables.get(table)
+        # Una réplica aún no cargada tomará estas filas en su carga inicial
+        if replica is not None and replica.watermark_field is not None:
+            replica.apply(rows, deleted_ids)
@@ -0,0 +1,340 @@
+# decomposition.py
+"""Agrupar primero, rutear después: flota completa para días con miles de paradas
+
+1. Las paradas se reparten en un grupo compacto por vehículo con k-means
+   capacitado sobre el plano local (la carga de cada grupo respeta la
+   capacidad del vehículo y se equilibra en proporción a ella).
+2. Los grupos con más de `max_part_stops` paradas se dividen en partes
+   balanceadas, encadenadas en orden de vecino más cercano desde el depósito.
+3. Cada parte se secuencia por separado en un pool de procesos (2-opt / Or-opt
+   sobre una matriz de a lo sumo `max_part_stops`² valores).
+4. Se unen las partes reoptimizando una ventana con extremos fijos en cada
+   unión, y las paradas de frontera entre vehículos se reubican si acorta
+   el total.
+
+Como el tamaño de cada subproblema está acotado, el tiempo crece casi
+linealmente con la cantidad de paradas en lugar de cuadráticamente.
+"""
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from fleet_routing import (DEFAULT_PACKAGE_WEIGHT, NEIGHBOR_COUNT, _Geometry, package_weight,
+                           relocate_between_routes, vehicle_capacity)
+from geo_distance import haversine_km, haversine_matrix, project
+from route_solver import AVERAGE_SPEED_KMH, improve_tour, nearest_neighbor_tour
+from spatial_index import nearest_neighbor_lists
+
+# Paradas por subproblema de secuenciación
+DEFAULT_MAX_PART_STOPS = 250
+
+# Holgura sobre la carga proporcional de cada vehículo al equilibrar grupos
+BALANCE_SLACK = 0.1
+
+KMEANS_ITERATIONS = 12
+
+# Paradas a cada lado de una unión que se reoptimizan juntas
+JUNCTION_WINDOW = 15
+
+# Una parada es de frontera si su centro está a más de esta fracción de la distancia al centro vecino
+BOUNDARY_RATIO = 0.7
+
+# Costo de la arista ficticia que fija los extremos de una ventana (nunca conviene romperla)
+_LOCKED_EDGE = -1e6
+
+DEFAULT_SEED = 0
+
+
+def _kmeans_plus_plus(x, y, k, rng):
+    """Centros iniciales separados entre sí (k-means++)"""
+    centers = np.empty((k, 2))
+    first = int(rng.integers(len(x)))
+    centers[0] = x[first], y[first]
+    d2 = (x - x[first]) ** 2 + (y - y[first]) ** 2
+    for c in range(1, k):
+        total = d2.sum()
+        pick = int(rng.choice(len(x), p=d2 / total)) if total > 0 else int(rng.integers(len(x)))
+        centers[c] = x[pick], y[pick]
+        d2 = np.minimum(d2, (x - x[pick]) ** 2 + (y - y[pick]) ** 2)
+    return centers
+
+
+def capacitated_assign(x, y, weights, centers, limits):
+    """Asigna cada punto al centro más cercano que aún tiene capacidad (-1 si no cabe en ninguno)
+
+    Los puntos con más que perder si no van a su centro preferido (mayor
+    diferencia entre el primero y el segundo más cercano) eligen primero.
+    """
+    d2 = (x[:, None] - centers[:, 0]) ** 2 + (y[:, None] - centers[:, 1]) ** 2
+    preference = np.argsort(d2, axis=1)
+    if centers.shape[0] > 1:
+        best_two = np.take_along_axis(d2, preference[:, :2], axis=1)
+        order = np.argsort(best_two[:, 0] - best_two[:, 1], kind='stable')
+    else:
+        order = np.arange(len(x))
+
+    labels = np.full(len(x), -1, dtype=np.int64)
+    loads = [0.0] * len(limits)
+    weights = weights.tolist()
+    preference = preference.tolist()
+    for p in order.tolist():
+        w = weights[p]
+        for c in preference[p]:
+            if loads[c] + w <= limits[c]:
+                labels[p] = c
+                loads[c] += w
+                break
+    return labels
+
+
+def capacitated_kmeans(x, y, weights, limits, iterations=KMEANS_ITERATIONS, seed=DEFAULT_SEED):
+    """k-means con un límite de carga por grupo; devuelve (etiquetas, centros)
+
+    Un grupo por elemento de `limits`. Las etiquetas son -1 para los puntos
+    que no caben en ningún grupo.
+    """
+    k = len(limits)
+    rng = np.random.default_rng(seed)
+    centers = _kmeans_plus_plus(x, y, k, rng)
+    labels = None
+    for _ in range(iterations):
+        new_labels = capacitated_assign(x, y, weights, centers, limits)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        assigned = labels >= 0
+        counts = np.bincount(labels[assigned], minlength=k)
+        sums_x = np.bincount(labels[assigned], weights=x[assigned], minlength=k)
+        sums_y = np.bincount(labels[assigned], weights=y[assigned], minlength=k)
+        filled = counts > 0
+        centers[filled, 0] = sums_x[filled] / counts[filled]
+        centers[filled, 1] = sums_y[filled] / counts[filled]
+    return labels, centers
+
+
+def balanced_limits(total_weight, capacities, max_weight=0.0):
+    """Límite de carga por vehículo: su parte proporcional (más holgura) sin pasar su capacidad"""
+    finite = all(math.isfinite(c) for c in capacities)
+    total_capacity = sum(capacities) if finite else 0.0
+    limits = []
+    for cap in capacities:
+        share = total_weight * cap / total_capacity if finite and total_capacity else total_weight / len(capacities)
+        limits.append(min(cap, max(share * (1 + BALANCE_SLACK), max_weight)))
+    return limits
+
+
+def _path_between(lats, lons, start, end, tour=None, time_limit=None):
+    """Camino por todas las paradas que sale de `start` y termina en `end` (None: final libre)
+
+    Se resuelve como tour cerrado con una arista ficticia fin → inicio de costo
+    muy negativo, que ninguna mejora rompe. Devuelve el orden de las paradas
+    (índices locales) o None si el tour perdió la arista fija.
+    """
+    point_lats = np.concatenate([[start[0]], lats, [end[0] if end else start[0]]])
+    point_lons = np.concatenate([[start[1]], lons, [end[1] if end else start[1]]])
+    dist = haversine_matrix(point_lats, point_lons)
+    if end is None:
+        dist[-1, :] = dist[:, -1] = 0.0
+    dist[0, -1] = dist[-1, 0] = _LOCKED_EDGE
+
+    last = len(point_lats) - 1
+    if tour is None:
+        tour = nearest_neighbor_tour(dist, start=0)
+    tour = improve_tour(tour, dist, time_limit=time_limit).tolist()
+    if tour[-1] == last:
+        return [k - 1 for k in tour[1:-1]]
+    if tour[1] == last:
+        return [k - 1 for k in tour[:1:-1]]
+    return None
+
+
+def _sequence_part(task):
+    """Orden de visita de una parte (índices locales) entre sus dos extremos"""
+    lats, lons, start, end, time_limit = task
+    order = _path_between(lats, lons, start, end, time_limit=time_limit)
+    return order if order is not None else list(range(len(lats)))
+
+
+def _split_parts(members, x, y, max_part_stops, seed):
+    """Divide un grupo grande en partes de tamaño parejo (listas de índices globales)"""
+    n_parts = math.ceil(len(members) / max_part_stops)
+    if n_parts <= 1:
+        return [members]
+    members = np.asarray(members)
+    size = math.ceil(len(members) / n_parts)
+    labels, _ = capacitated_kmeans(x[members], y[members], np.ones(len(members)), [size] * n_parts, seed=seed)
+    return [members[labels == p].tolist() for p in range(n_parts) if np.any(labels == p)]
+
+
+def _chain_parts(parts, lats, lons, depot, return_to_depot):
+    """Ordena las partes por vecino más cercano entre sus centros, empezando en el depósito
+
+    Devuelve las partes en orden y los extremos (inicio, fin) de cada una: cada
+    parte va del centro de la anterior al centro de la siguiente, así los
+    caminos resueltos por separado quedan alineados al unirlos.
+    """
+    final = tuple(depot) if return_to_depot else None
+    if len(parts) == 1:
+        return parts, [(tuple(depot), final)]
+    centers = np.array([[lats[p].mean(), lons[p].mean()] for p in parts])
+    dist = haversine_matrix(np.append(depot[0], centers[:, 0]), np.append(depot[1], centers[:, 1]))
+    order = [int(k) - 1 for k in nearest_neighbor_tour(dist, start=0)[1:]]
+    anchors = [tuple(depot)] + [tuple(centers[k]) for k in order] + [final]
+    return [parts[k] for k in order], [(anchors[j], anchors[j + 2]) for j in range(len(order))]
+
+
+def _repair_window(route, junction, lats, lons, depot, return_to_depot, window=JUNCTION_WINDOW):
+    """Reoptimiza las paradas alrededor de una unión manteniendo fijos los vecinos de la ventana"""
+    lo, hi = max(junction - window, 0), min(junction + window, len(route))
+    segment = route[lo:hi]
+    if len(segment) < 4:
+        return route
+
+    start = (lats[route[lo - 1]], lons[route[lo - 1]]) if lo > 0 else tuple(depot)
+    if hi < len(route):
+        end = (lats[route[hi]], lons[route[hi]])
+    else:
+        end = tuple(depot) if return_to_depot else None
+    order = _path_between(lats[segment], lons[segment], start, end, tour=np.arange(len(segment) + 2))
+    if order is None:
+        return route
+    return route[:lo] + [segment[k] for k in order] + route[hi:]
+
+
+def _boundary_neighbors(labels, x, y, lats, lons, n_clusters, ratio=BOUNDARY_RATIO):
+    """Listas de vecinos cercanos sólo para las paradas cerca de otro grupo (vacías para el resto)"""
+    neighbors = [[] for _ in range(len(labels))]
+    assigned = np.flatnonzero(labels >= 0)
+    if n_clusters < 2 or len(assigned) < 2:
+        return neighbors
+    counts = np.bincount(labels[assigned], minlength=n_clusters)
+    cx = np.bincount(labels[assigned], weights=x[assigned], minlength=n_clusters) / np.maximum(counts, 1)
+    cy = np.bincount(labels[assigned], weights=y[assigned], minlength=n_clusters) / np.maximum(counts, 1)
+    d = np.hypot(x[assigned, None] - cx, y[assigned, None] - cy)
+    d[:, counts == 0] = np.inf
+    own = d[np.arange(len(assigned)), labels[assigned]]
+    d[np.arange(len(assigned)), labels[assigned]] = np.inf
+    boundary = assigned[own >= ratio * d.min(axis=1)]
+    if len(boundary) < 2:
+        return neighbors
+
+    # Sin ir más allá de unas pocas celdas de ~NEIGHBOR_COUNT paradas: lejos del borde no hay movimientos útiles
+    area = max(np.ptp(x[boundary]) * np.ptp(y[boundary]), 1e-6)
+    cell_size = max(math.sqrt(area * NEIGHBOR_COUNT / len(boundary)), 0.05)
+    found = nearest_neighbor_lists(lats[boundary], lons[boundary], NEIGHBOR_COUNT, max_radius_km=4 * cell_size)
+    for stop, others in zip(boundary.tolist(), found):
+        neighbors[stop] = boundary[others].tolist()
+    return neighbors
+
+
+def _route_result(route_stops, lats, lons, depot, return_to_depot, started):
+    """Dict de resultado con la misma estructura que `solve_route` para una secuencia ya decidida"""
+    coordinates = [tuple(depot)] + list(zip(lats.tolist(), lons.tolist()))
+    if return_to_depot:
+        coordinates.append(tuple(depot))
+    path = np.array(coordinates)
+    total_distance_km = float(haversine_km(path[:-1, 0], path[:-1, 1], path[1:, 0], path[1:, 1]).sum()) \
+        if len(path) > 1 else 0.0
+    return {
+        "stops": route_stops,
+        "order": list(range(len(route_stops))),
+        "coordinates": coordinates,
+        "total_distance_km": round(total_distance_km, 2),
+        "estimated_duration_minutes": round(total_distance_km / AVERAGE_SPEED_KMH * 60, 1),
+        "solve_time_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def solve_fleet_decomposed(deliveries, vehicles, depot, return_to_depot=True, time_limit=None, workers=None,
+                           max_part_stops=DEFAULT_MAX_PART_STOPS, seed=DEFAULT_SEED):
+    """Versión de `solve_fleet` para miles de paradas: agrupa, secuencia en paralelo y repara fronteras
+
+    Devuelve la misma estructura que `solve_fleet` más 'clusters' (vehículos
+    con paradas) y 'parts' (subproblemas secuenciados).
+    """
+    start = time.perf_counter()
+
+    stops = [d for d in deliveries if d.get('customer_latitude') and d.get('customer_longitude')]
+    if not stops or not vehicles:
+        return {"routes": [], "unassigned": stops, "total_distance_km": 0.0, "clusters": 0, "parts": 0,
+                "solve_time_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    lats = np.array([float(d['customer_latitude']) for d in stops])
+    lons = np.array([float(d['customer_longitude']) for d in stops])
+    weights = np.array([package_weight(d) for d in stops])
+    capacities = [vehicle_capacity(v) for v in vehicles]
+    x, y = project(lats, lons, depot)
+
+    # 1. Un grupo compacto por vehículo, con la carga equilibrada según su capacidad
+    limits = balanced_limits(float(weights.sum()), capacities, float(weights.max(initial=DEFAULT_PACKAGE_WEIGHT)))
+    labels, centers = capacitated_kmeans(x, y, weights, limits, seed=seed)
+    leftovers = np.flatnonzero(labels < 0)
+    if len(leftovers):
+        # Lo que no entró con la holgura va al grupo más cercano con capacidad real libre
+        loads = np.bincount(labels[labels >= 0], weights=weights[labels >= 0], minlength=len(capacities))
+        spare = [cap - load for cap, load in zip(capacities, loads)]
+        labels[leftovers] = capacitated_assign(x[leftovers], y[leftovers], weights[leftovers], centers, spare)
+    clusters = [np.flatnonzero(labels == r).tolist() for r in range(len(capacities))]
+
+    # 2. Partes de tamaño acotado, encadenadas desde el depósito
+    tasks, layout = [], []
+    for r, members in enumerate(clusters):
+        if not members:
+            continue
+        parts, ends = _chain_parts(_split_parts(members, x, y, max_part_stops, seed + r), lats, lons, depot,
+                                   return_to_depot)
+        for part, (part_start, part_end) in zip(parts, ends):
+            tasks.append([lats[part], lons[part], part_start, part_end, None])
+            layout.append((r, part))
+
+    # 3. Secuenciación de las partes en paralelo
+    workers = min(workers or os.cpu_count() or 1, len(tasks)) or 1
+    if time_limit:
+        remaining = max(time_limit - (time.perf_counter() - start), 0.1)
+        for task in tasks:
+            task[4] = remaining * workers / len(tasks)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            orders = list(executor.map(_sequence_part, tasks, chunksize=max(len(tasks) // (workers * 4), 1)))
+    else:
+        orders = [_sequence_part(task) for task in tasks]
+
+    # 4. Unión de las partes y reparación de cada unión
+    routes = [[] for _ in capacities]
+    junctions = [[] for _ in capacities]
+    for (r, part), order in zip(layout, orders):
+        if routes[r]:
+            junctions[r].append(len(routes[r]))
+        routes[r].extend(part[k] for k in order)
+    for r, route_junctions in enumerate(junctions):
+        for junction in route_junctions:
+            routes[r] = _repair_window(routes[r], junction, lats, lons, depot, return_to_depot)
+
+    # 5. Paradas de frontera: reubicarlas en el vehículo vecino si acorta el total y cabe la carga
+    neighbors = _boundary_neighbors(labels, x, y, lats, lons, len(capacities))
+    routes = relocate_between_routes(routes, _Geometry(lats, lons, depot), weights.tolist(), capacities, neighbors)
+
+    results = []
+    for r, route in enumerate(routes):
+        if not route:
+            continue
+        result = _route_result([stops[s] for s in route], lats[route], lons[route], depot, return_to_depot, start)
+        result.update({
+            "vehicle": vehicles[r],
+            "load_kg": round(float(weights[route].sum()), 2),
+            "capacity_kg": capacities[r],
+        })
+        results.append(result)
+
+    unassigned = np.flatnonzero(labels < 0).tolist()
+    return {
+        "routes": results,
+        "unassigned": [stops[s] for s in unassigned],
+        "total_distance_km": round(sum(r['total_distance_km'] for r in results), 2),
+        "clusters": len(results),
+        "parts": len(tasks),
+        "solve_time_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
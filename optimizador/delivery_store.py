@@ -0,0 +1,267 @@
+# delivery_store.py
+"""Almacén columnar de entregas: arreglos NumPy compactos para filtrar y agregar sin recorrer dicts
+
+Es el almacenamiento de la tabla deliveries en la réplica local (data_sync.py):
+cada cambio produce una versión nueva con `merged()` y las vistas comparten la
+versión vigente. Las coordenadas son float64 (alimentan solvers y polilíneas);
+el resto de columnas numéricas usa tipos pequeños (float32, int8), estado y
+distrito son categóricos y `created_at` se interpreta una sola vez como datetime64.
+El distrito sale de la columna guardada o, para filas antiguas sin ella, de
+un `DistrictIndex` aplicado a todas las coordenadas de una vez.
+No se guardan las filas originales: sólo las columnas que usan las vistas
+(`ROW_FIELDS`), y `rows()` arma dicts nuevos a partir de ellas.
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from districts import fold_text
+
+DEFAULT_PRIORITY = 3
+DELIVERY_STATUSES = ['pending', 'assigned', 'in_transit', 'delivered', 'failed', 'cancelled']
+
+# Campos de texto que se conservan (arreglos de objetos) para materializar filas en las vistas y solvers
+TEXT_FIELDS = ('tracking_number', 'customer_name', 'customer_phone', 'customer_address', 'created_at',
+               'time_window_start', 'time_window_end', 'service_time_minutes')
+# Campos que tiene cada fila devuelta por `rows()`
+ROW_FIELDS = ('id', 'customer_latitude', 'customer_longitude', 'status', 'priority', 'package_weight',
+              'district', 'assigned_driver_id') + TEXT_FIELDS
+
+
+def _district_column(rows, addresses, districts, district_index=None, lats=None, lons=None):
+    """Distrito guardado en la fila; si falta, el de sus coordenadas y, sin ellas, el primero nombrado en la dirección"""
+    stored = pd.Series([r.get('district') for r in rows], dtype=object)
+    if district_index is not None and len(rows):
+        by_coords = pd.Series(district_index.assign_names(lats, lons), dtype=object)
+        stored = stored.where(stored.notna(), by_coords)
+    if not districts or stored.notna().all():
+        return stored
+    folded = addresses.map(fold_text)
+    inferred = pd.Series([None] * len(rows), dtype=object)
+    for name in districts:
+        hit = inferred.isna() & folded.str.contains(fold_text(name), regex=False)
+        inferred[hit] = name
+    return stored.where(stored.notna(), inferred)
+
+
+def to_utc64(value):
+    """datetime/Timestamp/texto → datetime64 en UTC sin zona (un valor naive se toma como UTC)"""
+    ts = pd.Timestamp(value)
+    ts = ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+    return ts.tz_localize(None).to_datetime64()
+
+
+def _status_categorical(statuses):
+    """Estados conocidos primero, en su orden; los desconocidos al final"""
+    extra = sorted(set(statuses.dropna()) - set(DELIVERY_STATUSES))
+    return pd.Categorical(statuses, categories=DELIVERY_STATUSES + extra)
+
+
+def _district_categorical(district, districts):
+    return pd.Categorical(district, categories=sorted(set(district.dropna()) | set(districts)))
+
+
+def _category_mask(categorical, values):
+    """Comparación por códigos: evita convertir la columna categórica a objetos"""
+    values = [values] if isinstance(values, str) else list(values)
+    codes = [categorical.categories.get_loc(v) for v in values if v in categorical.categories]
+    return np.isin(categorical.codes, codes)
+
+
+def _category_values(categorical, positions):
+    """Valores de las posiciones dadas como lista de objetos (None donde falta el valor)"""
+    values = np.array(list(categorical.categories) + [None], dtype=object)
+    return values[categorical.codes[positions]].tolist()
+
+
+# Columnas que no son de texto; estado y distrito se guardan como categóricos
+_ARRAY_COLUMNS = ('ids', 'latitude', 'longitude', 'status', 'district', 'priority', 'weight', 'driver_id',
+                  'created_at')
+
+
+class DeliveryStore:
+    """Entregas en columnas; los filtros devuelven máscaras booleanas sobre las filas"""
+
+    def __init__(self, rows, districts=(), version=None, district_index=None):
+        rows = rows if isinstance(rows, list) else list(rows)
+        n = len(rows)
+        districts = list(districts)
+
+        latitude = np.array([r.get('customer_latitude') or np.nan for r in rows], dtype=np.float64)
+        longitude = np.array([r.get('customer_longitude') or np.nan for r in rows], dtype=np.float64)
+        text = {field: np.array([r.get(field) for r in rows], dtype=object) for field in TEXT_FIELDS}
+        addresses = pd.Series(text['customer_address'], dtype=object).fillna('')
+        created = pd.to_datetime(pd.Series(text['created_at'], dtype=object),
+                                 utc=True, errors='coerce', format='ISO8601')
+
+        statuses = pd.Series([r.get('status') for r in rows], dtype=object)
+        district = _district_column(rows, addresses, districts, district_index, latitude, longitude)
+
+        arrays = {
+            'ids': np.array([r['id'] for r in rows], dtype=object),
+            'latitude': latitude,
+            'longitude': longitude,
+            'status': _status_categorical(statuses),
+            'district': _district_categorical(district, districts),
+            'priority': np.array([r.get('priority') or DEFAULT_PRIORITY for r in rows], dtype=np.int8),
+            'weight': np.array([r.get('package_weight') or 0.0 for r in rows], dtype=np.float32),
+            'driver_id': np.array([r.get('assigned_driver_id') for r in rows], dtype=object),
+            'created_at': created.to_numpy(dtype='datetime64[ns]') if n else np.array([], dtype='datetime64[ns]'),
+        }
+        self._load(arrays, text, districts, district_index, version)
+
+    def _load(self, arrays, text, districts, district_index, version, index=None):
+        self.version = version
+        self._districts = districts
+        self._district_index = district_index
+
+        self.ids = arrays['ids']
+        # Tabla hash de ids más compacta que un dict; se reutiliza si los ids no cambiaron
+        self._index = pd.Index(self.ids) if index is None else index
+        self.latitude = arrays['latitude']
+        self.longitude = arrays['longitude']
+        self.status = arrays['status']
+        self.district = arrays['district']
+        self.priority = arrays['priority']
+        self.weight = arrays['weight']
+        self.driver_id = arrays['driver_id']
+        self.created_at = arrays['created_at']
+        self.text = text
+
+        self.has_coords = ~(np.isnan(self.latitude) | np.isnan(self.longitude))
+
+    def merged(self, rows, deleted_ids=(), version=None):
+        """Nueva versión del almacén con `rows` aplicadas por id y sin `deleted_ids`
+
+        Una fila parcial sólo cambia los campos que trae; las filas nuevas van al
+        final. El almacén actual no se modifica: las vistas que lo usan siguen
+        viendo una versión consistente.
+        """
+        deleted_ids = set(deleted_ids)
+        incoming = {}
+        for row in rows:
+            if row['id'] not in deleted_ids:
+                incoming[row['id']] = {**incoming.get(row['id'], {}), **row}
+        ids = list(incoming)
+        positions = self.positions(ids)
+        existing = positions >= 0
+        current = self.rows_by_id([row_id for row_id, found in zip(ids, existing) if found])
+        merged_rows = [{**old, **incoming[old['id']]} for old in current]
+        merged_rows += [incoming[row_id] for row_id, found in zip(ids, existing) if not found]
+        patch = DeliveryStore(merged_rows, self._districts, district_index=self._district_index)
+
+        updated = positions[existing]
+        keep = np.ones(len(self), dtype=bool)
+        removed = self.positions(list(deleted_ids))
+        keep[removed[removed >= 0]] = False
+        n_updated = len(updated)
+        same_ids = bool(keep.all()) and n_updated == len(patch)
+
+        def combine(old, new):
+            column = old.copy()
+            column[updated] = new[:n_updated]
+            return column if same_ids else np.concatenate([column[keep], new[n_updated:]])
+
+        def combine_categorical(old, new, build):
+            if not set(new.categories) <= set(old.categories):
+                # Categoría nueva: se rearma desde los valores (caso poco frecuente)
+                return build(pd.Series(combine(np.asarray(old, dtype=object), np.asarray(new, dtype=object)),
+                                       dtype=object))
+            # Mismas categorías: basta traducir los códigos, sin pasar por objetos
+            codes = np.full(len(new), -1, dtype=old.codes.dtype)
+            present = new.codes >= 0
+            codes[present] = old.categories.get_indexer(new.categories)[new.codes[present]]
+            return pd.Categorical.from_codes(combine(old.codes, codes), dtype=old.dtype)
+
+        arrays = {name: combine(getattr(self, name), getattr(patch, name))
+                  for name in _ARRAY_COLUMNS if name not in ('status', 'district')}
+        arrays['status'] = combine_categorical(self.status, patch.status, _status_categorical)
+        arrays['district'] = combine_categorical(
+            self.district, patch.district, lambda values: _district_categorical(values, self._districts))
+        text = {field: combine(self.text[field], patch.text[field]) for field in TEXT_FIELDS}
+        store = DeliveryStore.__new__(DeliveryStore)
+        store._load(arrays, text, self._districts, self._district_index, version,
+                    index=self._index if same_ids else None)
+        return store
+
+    def __len__(self):
+        return len(self.ids)
+
+    def mask(self, status=None, priority=None, district=None, driver_id=None, has_coords=None, since=None):
+        """Máscara de filas; `status` y `district` aceptan un valor o una lista, `since` un datetime (naive = UTC)"""
+        mask = np.ones(len(self), dtype=bool)
+        if status is not None:
+            mask &= _category_mask(self.status, status)
+        if district is not None:
+            mask &= _category_mask(self.district, district)
+        if priority is not None:
+            mask &= self.priority == priority
+        if driver_id is not None:
+            mask &= self.driver_id == driver_id
+        if has_coords is not None:
+            mask &= self.has_coords == has_coords
+        if since is not None:
+            mask &= self.created_at >= to_utc64(since)
+        return mask
+
+    def rows(self, mask=None):
+        """Filas seleccionadas por la máscara como dicts nuevos con los campos de `ROW_FIELDS`"""
+        positions = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        return self._rows_at(positions)
+
+    def rows_by_id(self, ids):
+        """Filas de los ids dados, en ese orden (los que no están se omiten)"""
+        positions = self.positions(ids)
+        return self._rows_at(positions[positions >= 0])
+
+    def _rows_at(self, positions):
+        latitude = self.latitude[positions]
+        longitude = self.longitude[positions]
+        columns = [
+            self.ids[positions].tolist(),
+            np.where(np.isnan(latitude), None, latitude).tolist(),
+            np.where(np.isnan(longitude), None, longitude).tolist(),
+            _category_values(self.status, positions),
+            self.priority[positions].tolist(),
+            self.weight[positions].astype(np.float64).round(3).tolist(),
+            _category_values(self.district, positions),
+            self.driver_id[positions].tolist(),
+        ] + [self.text[field][positions].tolist() for field in TEXT_FIELDS]
+        return [dict(zip(ROW_FIELDS, values)) for values in zip(*columns)]
+
+    def row(self, row_id):
+        rows = self.rows_by_id([row_id])
+        return rows[0] if rows else None
+
+    def positions(self, ids):
+        """Posiciones de una lista de ids (-1 si no están)"""
+        if not len(self):
+            return np.full(len(ids), -1, dtype=np.int64)
+        return self._index.get_indexer(list(ids)).astype(np.int64)
+
+    def coordinates(self, mask=None):
+        """Arreglo (n, 2) float64 de latitud/longitud"""
+        coords = np.column_stack([self.latitude, self.longitude])
+        return coords if mask is None else coords[mask]
+
+    def fingerprint(self, mask=None):
+        """Huella de las filas seleccionadas (columnas y textos que se muestran en el mapa)"""
+        positions = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        digest = hashlib.blake2b(digest_size=16)
+        for column in (self.latitude, self.longitude, self.status.codes, self.priority, self.weight):
+            digest.update(np.ascontiguousarray(column[positions]).tobytes())
+        text = '\x1f'.join(
+            f"{row_id}|{tracking}|{name}|{address}"
+            for row_id, tracking, name, address in zip(self.ids[positions], self.text['tracking_number'][positions],
+                                                        self.text['customer_name'][positions],
+                                                        self.text['customer_address'][positions])
+        )
+        digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def memory_bytes(self):
+        """Memoria aproximada de las columnas (los textos cuentan sólo sus punteros, no los str)"""
+        arrays = [self.latitude, self.longitude, self.priority, self.weight, self.created_at, self.has_coords,
+                  self.status.codes, self.district.codes, self.ids, self.driver_id] + list(self.text.values())
+        return sum(a.nbytes for a in arrays)
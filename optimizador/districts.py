@@ -0,0 +1,128 @@
+# districts.py
+"""Distritos de Trujillo: tabla única de centroides y asignación vectorizada por coordenadas
+
+Sin límites oficiales cargados, cada distrito es la celda de Voronoi de su
+centroide (el punto pertenece al centroide más cercano en el plano local),
+acotada a `max_distance_km`. Si se entregan polígonos de límites, se prueban
+primero con un ray casting vectorizado sobre todos los puntos a la vez y
+Voronoi sólo resuelve los que no caen en ningún polígono.
+"""
+import unicodedata
+
+import numpy as np
+
+from geo_distance import project
+
+TRUJILLO_CENTER = (-8.1092, -79.0215)
+
+# Distritos de Trujillo con coordenadas predefinidas
+DISTRICT_CENTROIDS = {
+    "Trujillo Centro": (-8.1092, -79.0215),
+    "La Esperanza": (-8.0878, -79.0401),
+    "El Porvenir": (-8.0775, -79.0169),
+    "Florencia de Mora": (-8.0731, -79.0264),
+    "Huanchaco": (-8.0833, -79.1167),
+    "Victor Larco": (-8.1167, -79.0333),
+    "Moche": (-8.1667, -79.0333),
+    "Laredo": (-8.0833, -78.9667),
+    "Salaverry": (-8.2167, -78.9833),
+    "Poroto": (-8.0083, -78.6417)
+}
+
+# Más lejos que esto del centroide más cercano, el punto queda sin distrito
+DEFAULT_MAX_DISTANCE_KM = 10.0
+
+# Puntos por bloque al calcular distancias a todos los centroides
+ASSIGN_CHUNK_SIZE = 200_000
+
+
+def fold_text(text):
+    """Minúsculas y sin tildes, para comparar nombres de distritos, columnas y direcciones"""
+    text = unicodedata.normalize('NFKD', str(text))
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+
+def points_in_polygon(lats, lons, polygon):
+    """Máscara de los puntos dentro del polígono [(lat, lon), ...] (regla par-impar)"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    ring = np.asarray(polygon, dtype=np.float64)
+    inside = np.zeros(len(lats), dtype=bool)
+    # Descartar primero lo que cae fuera del rectángulo envolvente
+    candidates = np.flatnonzero((lats >= ring[:, 0].min()) & (lats <= ring[:, 0].max()) &
+                                (lons >= ring[:, 1].min()) & (lons <= ring[:, 1].max()))
+    if not len(candidates):
+        return inside
+    y, x = lats[candidates], lons[candidates]
+    y1, x1 = ring[:, 0], ring[:, 1]
+    y2, x2 = np.roll(y1, -1), np.roll(x1, -1)
+    # Cada arista que cruza la horizontal del punto a su derecha invierte la paridad
+    crosses = (y1 > y[:, None]) != (y2 > y[:, None])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x1 + (y[:, None] - y1) * (x2 - x1) / (y2 - y1)
+    inside[candidates] = np.count_nonzero(crosses & (x[:, None] < x_cross), axis=1) % 2 == 1
+    return inside
+
+
+class DistrictIndex:
+    """Asigna distritos a arreglos completos de coordenadas; se construye una vez y se reutiliza"""
+
+    def __init__(self, centroids=None, polygons=None, max_distance_km=DEFAULT_MAX_DISTANCE_KM,
+                 origin=TRUJILLO_CENTER):
+        centroids = DISTRICT_CENTROIDS if centroids is None else centroids
+        self.names = list(centroids)
+        self.centroids = dict(centroids)
+        self.polygons = {name: np.asarray(ring, dtype=np.float64) for name, ring in (polygons or {}).items()
+                         if name in self.centroids}
+        self.max_distance_km = max_distance_km
+        self.origin = tuple(origin)
+        lats, lons = zip(*(centroids[name] for name in self.names)) if self.names else ((), ())
+        self._cx, self._cy = project(lats, lons, self.origin)
+
+    def __contains__(self, name):
+        return name in self.centroids
+
+    def coordinates(self, name, default=None):
+        """Centroide del distrito, o `default` si no se conoce"""
+        return self.centroids.get(name, default)
+
+    def assign(self, lats, lons):
+        """Código (posición en `names`) del distrito de cada punto; -1 sin coordenadas o fuera de rango"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        codes = np.full(len(lats), -1, dtype=np.int64)
+        pending = ~(np.isnan(lats) | np.isnan(lons))
+
+        for name, ring in self.polygons.items():
+            hit = np.zeros(len(lats), dtype=bool)
+            hit[pending] = points_in_polygon(lats[pending], lons[pending], ring)
+            codes[hit] = self.names.index(name)
+            pending &= ~hit
+
+        if not self.names:
+            return codes
+        positions = np.flatnonzero(pending)
+        for start in range(0, len(positions), ASSIGN_CHUNK_SIZE):
+            chunk = positions[start:start + ASSIGN_CHUNK_SIZE]
+            x, y = project(lats[chunk], lons[chunk], self.origin)
+            distances_sq = (x[:, None] - self._cx) ** 2 + (y[:, None] - self._cy) ** 2
+            nearest = np.argmin(distances_sq, axis=1)
+            close = distances_sq[np.arange(len(chunk)), nearest] <= self.max_distance_km ** 2
+            codes[chunk[close]] = nearest[close]
+        return codes
+
+    def assign_names(self, lats, lons):
+        """Nombre del distrito de cada punto (None si no se pudo asignar)"""
+        codes = self.assign(lats, lons)
+        names = np.array(self.names + [None], dtype=object)
+        return names[codes].tolist()
+
+    def district_for(self, lat, lon):
+        """Distrito de un solo punto, o None"""
+        if lat is None or lon is None:
+            return None
+        return self.assign_names([lat], [lon])[0]
+
+
+# Índice por defecto con los centroides de Trujillo, compartido por todo el proceso
+DEFAULT_INDEX = DistrictIndex()
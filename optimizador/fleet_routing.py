@@ -0,0 +1,214 @@
+# fleet_routing.py
+"""Ruteo capacitado multi-vehículo (CVRP): reparte las entregas pendientes entre la flota disponible"""
+import math
+import time
+
+import numpy as np
+
+from geo_distance import EARTH_RADIUS_KM, haversine_matrix
+from route_solver import nearest_neighbor_tour, solve_route
+from spatial_index import nearest_neighbor_lists
+
+# Campos posibles de capacidad (kg) en la tabla vehicles
+CAPACITY_FIELDS = ('capacity_kg', 'max_capacity_kg', 'capacity', 'max_weight_kg')
+
+# Peso asumido para entregas sin package_weight
+DEFAULT_PACKAGE_WEIGHT = 1.0
+
+# Vecinos evaluados por parada en la búsqueda entre rutas
+NEIGHBOR_COUNT = 12
+
+IMPROVEMENT_EPS = 1e-9
+
+
+def vehicle_capacity(vehicle):
+    """Capacidad de carga (kg) de un vehículo; infinita si no está registrada"""
+    for field in CAPACITY_FIELDS:
+        if vehicle.get(field):
+            return float(vehicle[field])
+    return math.inf
+
+
+def package_weight(delivery):
+    """Peso del paquete (kg) de una entrega"""
+    return float(delivery.get('package_weight') or DEFAULT_PACKAGE_WEIGHT)
+
+
+class _Geometry:
+    """Distancias punto a punto con el depósito como nodo -1"""
+
+    def __init__(self, lats, lons, depot):
+        self.lat = np.radians(np.append(lats, depot[0])).tolist()
+        self.lon = np.radians(np.append(lons, depot[1])).tolist()
+        self.cos = [math.cos(x) for x in self.lat]
+
+    def dist(self, i, j):
+        a = (math.sin((self.lat[j] - self.lat[i]) / 2) ** 2
+             + self.cos[i] * self.cos[j] * math.sin((self.lon[j] - self.lon[i]) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def sweep_assignment(lats, lons, weights, capacities, depot):
+    """Asigna paradas a vehículos barriendo por ángulo polar alrededor del depósito
+
+    Cada vehículo recibe un sector contiguo cuya carga es proporcional a su
+    capacidad (igual para todos si falta alguna capacidad). Devuelve (rutas, no_asignadas) con índices de parada.
+    """
+    angles = np.arctan2(lats - depot[0], (lons - depot[1]) * math.cos(math.radians(depot[0])))
+    order = np.argsort(angles)
+
+    # Empezar el barrido en el mayor hueco angular para no partir un grupo de paradas
+    if len(order) > 1:
+        sorted_angles = angles[order]
+        gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * math.pi))
+        order = np.roll(order, -int(np.argmax(gaps) + 1))
+
+    # Sin capacidades registradas (o con alguna sin registrar) cada vehículo recibe una parte igual
+    finite = all(math.isfinite(c) for c in capacities)
+    total_capacity = sum(capacities) if finite else 0.0
+    total_weight = float(np.sum(weights))
+    routes = [[] for _ in capacities]
+    loads = [0.0] * len(capacities)
+
+    v = 0
+    leftovers = []
+    for stop in order:
+        w = weights[stop]
+        while v < len(capacities):
+            cap = capacities[v]
+            share = cap / total_capacity * total_weight if total_capacity else total_weight / len(capacities)
+            target = min(cap, max(share, w))
+            if loads[v] + w <= cap and loads[v] < target:
+                break
+            v += 1
+        if v == len(capacities):
+            leftovers.append(stop)
+            continue
+        routes[v].append(int(stop))
+        loads[v] += w
+
+    unassigned = []
+    for stop in leftovers:
+        spare = [capacities[k] - loads[k] for k in range(len(capacities))]
+        k = int(np.argmax(spare))
+        if spare[k] >= weights[stop]:
+            routes[k].append(int(stop))
+            loads[k] += weights[stop]
+        else:
+            unassigned.append(int(stop))
+
+    return routes, unassigned
+
+
+def relocate_between_routes(routes, geometry, weights, capacities, neighbors, max_passes=5):
+    """Mueve paradas a la ruta de sus vecinos más cercanos si baja la distancia total y cabe la carga"""
+    DEPOT = -1
+    loads = [sum(weights[s] for s in route) for route in routes]
+    owner = {}
+    for r, route in enumerate(routes):
+        for s in route:
+            owner[s] = r
+
+    def neighbors_in_route(route, pos):
+        prev_node = route[pos - 1] if pos > 0 else DEPOT
+        next_node = route[pos + 1] if pos + 1 < len(route) else DEPOT
+        return prev_node, next_node
+
+    d = geometry.dist
+    for _ in range(max_passes):
+        moved = 0
+        for x in range(len(neighbors)):
+            r = owner.get(x)
+            if r is None:
+                continue
+            route = routes[r]
+            pos = route.index(x)
+            a, b = neighbors_in_route(route, pos)
+            removal_gain = d(a, x) + d(x, b) - d(a, b)
+
+            best = None
+            for y in neighbors[x]:
+                s = owner.get(int(y))
+                if s is None or s == r or loads[s] + weights[x] > capacities[s]:
+                    continue
+                target = routes[s]
+                ypos = target.index(int(y))
+                yprev, ynext = neighbors_in_route(target, ypos)
+                for insert_at, u, v in ((ypos, yprev, y), (ypos + 1, y, ynext)):
+                    delta = d(u, x) + d(x, v) - d(u, v) - removal_gain
+                    if delta < -IMPROVEMENT_EPS and (best is None or delta < best[0]):
+                        best = (delta, s, insert_at)
+
+            if best:
+                _, s, insert_at = best
+                route.pop(pos)
+                routes[s].insert(insert_at, x)
+                loads[r] -= weights[x]
+                loads[s] += weights[x]
+                owner[x] = s
+                moved += 1
+
+        if not moved:
+            break
+
+    return routes
+
+
+def solve_fleet(deliveries, vehicles, depot, return_to_depot=True, time_limit=None):
+    """Reparte y ordena las entregas entre varios vehículos respetando su capacidad
+
+    Devuelve un dict con una ruta por vehículo utilizado (misma estructura que
+    `solve_route` más vehicle, load_kg y capacity_kg), las entregas que no
+    caben en la flota y la distancia total.
+    """
+    start = time.perf_counter()
+
+    stops = [d for d in deliveries if d.get('customer_latitude') and d.get('customer_longitude')]
+    if not stops or not vehicles:
+        return {"routes": [], "unassigned": stops, "total_distance_km": 0.0,
+                "solve_time_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    lats = np.array([float(d['customer_latitude']) for d in stops])
+    lons = np.array([float(d['customer_longitude']) for d in stops])
+    weights = [package_weight(d) for d in stops]
+    capacities = [vehicle_capacity(v) for v in vehicles]
+
+    # 1. Construcción: sectores por barrido angular
+    routes, unassigned = sweep_assignment(lats, lons, np.array(weights), capacities, depot)
+
+    # 2. Mejora entre rutas usando listas de vecinos cercanos
+    geometry = _Geometry(lats, lons, depot)
+    neighbors = nearest_neighbor_lists(lats, lons, NEIGHBOR_COUNT)
+    for r, route in enumerate(routes):
+        # Orden inicial por vecino más cercano para estimar costos de inserción
+        if len(route) > 2:
+            nodes = np.array(route + [len(stops)])
+            points_lat = np.append(lats, depot[0])[nodes]
+            points_lon = np.append(lons, depot[1])[nodes]
+            tour = nearest_neighbor_tour(haversine_matrix(points_lat, points_lon), start=len(route))
+            routes[r] = [route[k] for k in tour[1:]]
+    routes = relocate_between_routes(routes, geometry, weights, capacities, neighbors)
+
+    # 3. Secuencia de cada ruta con 2-opt / Or-opt
+    active = [r for r, route in enumerate(routes) if route]
+    per_route_limit = None
+    if time_limit:
+        per_route_limit = max(time_limit - (time.perf_counter() - start), 0.1) / max(len(active), 1)
+
+    results = []
+    for r in active:
+        route_stops = [stops[s] for s in routes[r]]
+        result = solve_route(route_stops, depot, return_to_depot=return_to_depot, time_limit=per_route_limit)
+        result.update({
+            "vehicle": vehicles[r],
+            "load_kg": round(sum(weights[s] for s in routes[r]), 2),
+            "capacity_kg": capacities[r],
+        })
+        results.append(result)
+
+    return {
+        "routes": results,
+        "unassigned": [stops[s] for s in unassigned],
+        "total_distance_km": round(sum(r['total_distance_km'] for r in results), 2),
+        "solve_time_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
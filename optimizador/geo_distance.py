@@ -0,0 +1,126 @@
+# geo_distance.py
+"""Distancias de gran círculo (haversine) vectorizadas con NumPy, proyección a un plano local en km
+y escala de los mapas web por nivel de zoom"""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Metros por píxel en el ecuador a zoom 0 (tiles web Mercator de 256 px)
+METERS_PER_PIXEL_Z0 = 156543.03392
+
+# Tamaño de bloque por eje: cada temporal ocupa block_size² valores
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def coordinates_from_deliveries(deliveries):
+    """Arrays (lat, lon) en grados a partir de customer_latitude/customer_longitude (NaN si falta)"""
+    lats = np.array([d.get('customer_latitude') or np.nan for d in deliveries], dtype=np.float64)
+    lons = np.array([d.get('customer_longitude') or np.nan for d in deliveries], dtype=np.float64)
+    return lats, lons
+
+
+def project(lats, lons, origin):
+    """Plano local equirectangular en km alrededor de `origin` (lat, lon); error despreciable a escala urbana"""
+    lat0 = np.radians(origin[0])
+    x = np.radians(np.asarray(lons, dtype=np.float64) - origin[1]) * EARTH_RADIUS_KM * np.cos(lat0)
+    y = np.radians(np.asarray(lats, dtype=np.float64) - origin[0]) * EARTH_RADIUS_KM
+    return x, y
+
+
+def unproject(x, y, origin):
+    """Inversa de `project`: (lats, lons) en grados"""
+    lat0 = np.radians(origin[0])
+    lats = origin[0] + np.degrees(y / EARTH_RADIUS_KM)
+    lons = origin[1] + np.degrees(x / (EARTH_RADIUS_KM * np.cos(lat0)))
+    return lats, lons
+
+
+def km_per_pixel(zoom, latitude):
+    """Kilómetros que cubre un píxel de un mapa web Mercator al nivel de zoom y latitud dados"""
+    return METERS_PER_PIXEL_Z0 * np.cos(np.radians(latitude)) / 2 ** zoom / 1000.0
+
+
+def viewport_bounds(center, zoom, width_px, height_px):
+    """(min_lat, min_lon, max_lat, max_lon) que muestra un mapa web de ese tamaño centrado en `center`"""
+    scale = km_per_pixel(zoom, center[0]) / 2
+    lats, lons = unproject(np.array([-width_px, width_px]) * scale, np.array([-height_px, height_px]) * scale,
+                           center)
+    return float(lats[0]), float(lons[0]), float(lats[1]), float(lons[1])
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distancia haversine en km; acepta escalares o arrays compatibles por broadcasting"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_one_to_many(origin, lats, lons):
+    """Distancias (km) desde un punto (lat, lon) a todos los puntos de los arrays"""
+    lat0, lon0 = np.radians(origin[0]), np.radians(origin[1])
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    a = np.sin((lats - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lats) * np.sin((lons - lon0) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def iter_distance_blocks(lats_a, lons_a, lats_b=None, lons_b=None, dtype=np.float64,
+                         block_size=DEFAULT_BLOCK_SIZE):
+    """Genera (filas, columnas, bloque) de la matriz de distancias sin materializarla completa"""
+    if lats_b is None:
+        lats_b, lons_b = lats_a, lons_a
+
+    lat_a = np.radians(np.asarray(lats_a, dtype=np.float64))
+    lon_a = np.radians(np.asarray(lons_a, dtype=np.float64))
+    lat_b = np.radians(np.asarray(lats_b, dtype=np.float64))
+    lon_b = np.radians(np.asarray(lons_b, dtype=np.float64))
+    cos_a = np.cos(lat_a)
+    cos_b = np.cos(lat_b)
+
+    for r0 in range(0, len(lat_a), block_size):
+        rows = slice(r0, min(r0 + block_size, len(lat_a)))
+        for c0 in range(0, len(lat_b), block_size):
+            cols = slice(c0, min(c0 + block_size, len(lat_b)))
+            dlat = lat_b[None, cols] - lat_a[rows, None]
+            dlon = lon_b[None, cols] - lon_a[rows, None]
+            a = np.sin(dlat / 2) ** 2 + cos_a[rows, None] * cos_b[None, cols] * np.sin(dlon / 2) ** 2
+            block = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+            yield rows, cols, block.astype(dtype, copy=False)
+
+
+def haversine_matrix(lats_a, lons_a, lats_b=None, lons_b=None, dtype=np.float64,
+                     block_size=DEFAULT_BLOCK_SIZE, out=None):
+    """Matriz de distancias muchos-a-muchos (km) calculada por bloques
+
+    Con `dtype=np.float32` una matriz de 10k×10k ocupa ~400 MB y los temporales
+    quedan acotados a `block_size`². `out` permite escribir en un array
+    preasignado (por ejemplo un np.memmap en disco).
+    """
+    n = len(lats_a)
+    m = n if lats_b is None else len(lats_b)
+    if out is None:
+        out = np.empty((n, m), dtype=dtype)
+
+    for rows, cols, block in iter_distance_blocks(lats_a, lons_a, lats_b, lons_b, dtype, block_size):
+        out[rows, cols] = block
+
+    return out
+
+
+def nearest_neighbors(lats, lons, k, block_size=DEFAULT_BLOCK_SIZE):
+    """Índices de los `k` vecinos más cercanos de cada punto (excluyéndose a sí mismo), por bloques de filas"""
+    n = len(lats)
+    k = min(k, n - 1)
+    result = np.empty((n, max(k, 0)), dtype=np.int64)
+    if k <= 0:
+        return result
+
+    for r0 in range(0, n, block_size):
+        rows = slice(r0, min(r0 + block_size, n))
+        block = haversine_matrix(lats[rows], lons[rows], lats, lons, dtype=np.float32, block_size=n)
+        block[np.arange(block.shape[0]), np.arange(rows.start, rows.stop)] = np.inf
+        candidates = np.argpartition(block, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(block, candidates, axis=1), axis=1)
+        result[rows] = np.take_along_axis(candidates, order, axis=1)
+
+    return result
@@ -0,0 +1,201 @@
+# geocoding.py
+"""Servicio único de geocodificación (Google Maps) con caché persistente en SQLite"""
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import requests
+
+from geo_distance import haversine_km
+
+GOOGLE_GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+USER_AGENT = 'DeliveryTrujilloApp/1.0'
+
+# Sufijo canónico que se envía a Google para direcciones de Trujillo
+CITY_SUFFIX = "Trujillo, La Libertad, Perú"
+
+# Partes finales que no distinguen una dirección de otra dentro de Trujillo
+LOCALITY_PARTS = {"trujillo", "la libertad", "peru"}
+
+DEFAULT_TTL_SECONDS = 90 * 24 * 3600
+DEFAULT_NEGATIVE_TTL_SECONDS = 24 * 3600
+DEFAULT_MAX_ENTRIES = 50000
+
+# Estados transitorios o de configuración que nunca se guardan en caché
+UNCACHEABLE_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR", "REQUEST_DENIED", "ERROR"}
+
+
+def normalize_address(address):
+    """Clave de caché: minúsculas, sin tildes, espacios colapsados y sin sufijos de ciudad/región/país"""
+    text = unicodedata.normalize('NFKD', address or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    text = re.sub(r'[^\w,#\- ]', ' ', text)
+    parts = [re.sub(r'\s+', ' ', p).strip() for p in text.split(',')]
+    parts = [p for p in parts if p]
+    while parts and parts[-1] in LOCALITY_PARTS:
+        parts.pop()
+    return ', '.join(parts)
+
+
+def build_query(address):
+    """Agrega el sufijo de Trujillo si la dirección no menciona ciudad, región ni país"""
+    if not any(x in address.lower() for x in ("trujillo", "la libertad", "peru", "perú")):
+        return f"{address}, {CITY_SUFFIX}"
+    return address
+
+
+def request_params(address, api_key):
+    """Parámetros de la Geocoding API restringidos a Perú"""
+    return {
+        'address': address,
+        'key': api_key,
+        'region': 'pe',  # Priorizar resultados en Perú
+        'language': 'es',
+        'components': 'country:PE'
+    }
+
+
+def parse_response(data, center=None, max_distance_km=None):
+    """Interpreta la respuesta JSON de Google; devuelve (coords, status)"""
+    if data.get('status') != 'OK' or not data.get('results'):
+        return None, data.get('status', 'ERROR')
+
+    location = data['results'][0]['geometry']['location']
+    lat, lng = location['lat'], location['lng']
+
+    # Verificar que esté dentro del área de cobertura
+    if center and max_distance_km:
+        if haversine_km(center[0], center[1], lat, lng) >= max_distance_km:
+            return None, "OUT_OF_AREA"
+
+    return (lat, lng), "OK"
+
+
+class GeocodeCache:
+    """Caché en SQLite con TTL, caché negativa y desalojo LRU por tamaño"""
+
+    def __init__(self, path, ttl_seconds=DEFAULT_TTL_SECONDS, negative_ttl_seconds=DEFAULT_NEGATIVE_TTL_SECONDS,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                key TEXT PRIMARY KEY,
+                latitude REAL,
+                longitude REAL,
+                found INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_geocode_last_access ON geocode_cache(last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Devuelve (encontrado, coords) o None si no hay entrada vigente"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT latitude, longitude, found, created_at FROM geocode_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            latitude, longitude, found, created_at = row
+            ttl = self.ttl_seconds if found else self.negative_ttl_seconds
+            if now - created_at > ttl:
+                self._conn.execute("DELETE FROM geocode_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE geocode_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return bool(found), ((latitude, longitude) if found else None)
+
+    def set(self, key, coords):
+        """Guarda un resultado; `coords=None` registra una búsqueda sin resultado (caché negativa)"""
+        now = time.time()
+        latitude, longitude = coords if coords else (None, None)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, latitude, longitude, 1 if coords else 0, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0]
+        if count > self.max_entries:
+            # Desalojar un 10% extra para no borrar en cada inserción
+            excess = count - self.max_entries + self.max_entries // 10
+            self._conn.execute(
+                "DELETE FROM geocode_cache WHERE key IN "
+                "(SELECT key FROM geocode_cache ORDER BY last_access LIMIT ?)", (excess,)
+            )
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
+
+
+class GeocodingService:
+    """Geocodifica direcciones de Trujillo con Google Maps pasando siempre por la caché"""
+
+    def __init__(self, api_key, cache=None, center=None, max_distance_km=None, timeout=10):
+        self.api_key = api_key
+        self.cache = cache
+        self.center = center
+        self.max_distance_km = max_distance_km
+        self.timeout = timeout
+
+    def lookup(self, address):
+        """Devuelve {'coords', 'status', 'cached'}; status es OK, ZERO_RESULTS, OUT_OF_AREA o un error de Google"""
+        key = normalize_address(address)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                found, coords = cached
+                return {"coords": coords, "status": "OK" if found else "ZERO_RESULTS", "cached": True}
+
+        if not self.api_key:
+            return {"coords": None, "status": "REQUEST_DENIED", "cached": False}
+
+        coords, status = self._request(build_query(address))
+
+        if coords is None and status not in UNCACHEABLE_STATUSES and ',' in address:
+            # Reintentar con sólo la calle, como último recurso antes de fallar
+            coords, status = self._request(f"{address.split(',')[0]}, {CITY_SUFFIX}")
+
+        if self.cache is not None and status not in UNCACHEABLE_STATUSES:
+            self.cache.set(key, coords)
+
+        return {"coords": coords, "status": status, "cached": False}
+
+    def geocode(self, address):
+        """Coordenadas (lat, lon) de la dirección, o None"""
+        return self.lookup(address)["coords"]
+
+    def _request(self, address):
+        headers = {'User-Agent': USER_AGENT}
+        try:
+            response = requests.get(GOOGLE_GEOCODE_URL, params=request_params(address, self.api_key),
+                                    headers=headers, timeout=self.timeout)
+            data = response.json()
+        except Exception as e:
+            print(f"Error en geocodificación Google: {str(e)}")
+            return None, "ERROR"
+
+        return parse_response(data, self.center, self.max_distance_km)
@@ -0,0 +1,278 @@
+# ingest_log.py
+"""Registro de eventos entrantes (webhooks de n8n): sólo agrega, sobrevive a caídas y deduplica reintentos
+
+Los eventos se guardan en SQLite en modo WAL con `synchronous=FULL`: cuando
+`append` responde, el evento ya está en disco. Un único hilo escritor agrupa
+los eventos que llegan al mismo tiempo en una sola transacción (group
+commit), así un fsync cubre muchos callbacks concurrentes. Cada evento recibe
+un número de secuencia creciente que los consumidores usan como cursor para
+leer sólo lo nuevo.
+
+Sólo los endpoints que verificaron la clave del emisor marcan un evento como
+`authenticated`; quien use el contenido del payload para actuar (por ejemplo
+aceptar una ruta optimizada) debe leer con `authenticated=True`.
+"""
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = "webhook_events.db"
+DEFAULT_TOPIC = "n8n"
+
+# Eventos máximos por transacción del escritor
+DEFAULT_BATCH_SIZE = 256
+
+# Espera máxima de `append` por la confirmación del escritor (segundos)
+APPEND_TIMEOUT_SECONDS = 10
+
+DEFAULT_READ_LIMIT = 100
+
+# Cada cuánto `wait` vuelve a consultar el archivo por eventos de otros procesos (segundos)
+POLL_INTERVAL_SECONDS = 0.5
+
+# Cabeceras y campos del payload aceptados como clave de idempotencia, en orden de preferencia
+IDEMPOTENCY_HEADERS = ('Idempotency-Key', 'X-Idempotency-Key')
+IDEMPOTENCY_FIELDS = ('idempotency_key', 'execution_id', 'executionId')
+
+# Cabecera y campos que llevan el id del trabajo al que responde un callback
+CORRELATION_HEADER = 'X-Correlation-Id'
+CORRELATION_FIELDS = ('job_id', 'correlation_id')
+
+
+def idempotency_key(headers, payload):
+    """Clave que identifica un callback entre reintentos, o None si el emisor no envía ninguna"""
+    for name in IDEMPOTENCY_HEADERS:
+        if headers.get(name):
+            return headers[name]
+    if isinstance(payload, dict):
+        for field in IDEMPOTENCY_FIELDS:
+            if payload.get(field):
+                return str(payload[field])
+    return None
+
+
+def correlation_id(headers, payload):
+    """Id del trabajo (por ejemplo una optimización) al que responde el callback, o None"""
+    if headers.get(CORRELATION_HEADER):
+        return headers[CORRELATION_HEADER]
+    if isinstance(payload, dict):
+        for field in CORRELATION_FIELDS:
+            if payload.get(field):
+                return str(payload[field])
+    return None
+
+
+class _PendingAppend:
+    __slots__ = ('topic', 'payload', 'key', 'correlation_id', 'authenticated', 'received_at', 'done', 'result',
+                 'error')
+
+    def __init__(self, topic, payload, key, correlation_id, authenticated):
+        self.topic = topic
+        self.payload = payload
+        self.key = key
+        self.correlation_id = correlation_id
+        self.authenticated = authenticated
+        self.received_at = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class IngestLog:
+    """Log de eventos con secuencia, claves de idempotencia y lectura por cursor"""
+
+    def __init__(self, path=DEFAULT_PATH, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.appended = 0
+        self.duplicates = 0
+        self.commits = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._last_seq = 0
+        self._new_events = threading.Condition()
+
+        self._writer = self._connect()
+        self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                idempotency_key TEXT UNIQUE,
+                correlation_id TEXT,
+                authenticated INTEGER NOT NULL DEFAULT 0,
+                payload TEXT NOT NULL,
+                received_at REAL NOT NULL
+            )
+        """)
+        columns = {row[1] for row in self._writer.execute("PRAGMA table_info(events)")}
+        if 'correlation_id' not in columns:
+            self._writer.execute("ALTER TABLE events ADD COLUMN correlation_id TEXT")
+        if 'authenticated' not in columns:
+            # Los eventos anteriores llegaron sin verificar la clave del emisor
+            self._writer.execute("ALTER TABLE events ADD COLUMN authenticated INTEGER NOT NULL DEFAULT 0")
+        self._writer.execute("CREATE INDEX IF NOT EXISTS idx_events_topic_seq ON events(topic, seq)")
+        self._writer.execute("CREATE INDEX IF NOT EXISTS idx_events_correlation ON events(correlation_id, seq)")
+        self._writer.commit()
+        self._last_seq = self._writer.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+
+        self._reader = self._connect()
+        self._reader_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._write_loop, name="ingest-log-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def append(self, payload, key=None, topic=DEFAULT_TOPIC, correlation_id=None, authenticated=False,
+               timeout=APPEND_TIMEOUT_SECONDS):
+        """Guarda un evento y espera a que esté en disco; devuelve {'seq', 'duplicate'}
+
+        Si `key` ya se registró, no se agrega nada y se devuelve la secuencia
+        del evento original con `duplicate=True`. `correlation_id` permite
+        buscar después la respuesta a un trabajo concreto; `authenticated`
+        indica que el endpoint verificó la clave de quien lo envió.
+        """
+        if self._closed:
+            raise RuntimeError("El registro de eventos está cerrado")
+        pending = _PendingAppend(topic, json.dumps(payload, ensure_ascii=False, default=str), key, correlation_id,
+                                 bool(authenticated))
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError("El evento no se confirmó a tiempo")
+        if pending.error:
+            raise pending.error
+        return pending.result
+
+    def _write_loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            # Todo lo que ya está en cola entra en la misma transacción
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        results = []
+        try:
+            self._writer.execute("BEGIN IMMEDIATE")
+            for item in batch:
+                cursor = self._writer.execute(
+                    "INSERT OR IGNORE INTO events (topic, idempotency_key, correlation_id, authenticated, payload, "
+                    "received_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (item.topic, item.key, item.correlation_id, int(item.authenticated), item.payload,
+                     item.received_at)
+                )
+                if cursor.rowcount:
+                    results.append({"seq": cursor.lastrowid, "duplicate": False})
+                else:
+                    seq = self._writer.execute(
+                        "SELECT seq FROM events WHERE idempotency_key = ?", (item.key,)
+                    ).fetchone()[0]
+                    results.append({"seq": seq, "duplicate": True})
+            self._writer.execute("COMMIT")
+        except Exception as e:
+            print(f"Error al guardar eventos: {str(e)}")
+            try:
+                self._writer.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            for item in batch:
+                item.error = e
+                item.done.set()
+            return
+
+        self.commits += 1
+        for item, result in zip(batch, results):
+            if result["duplicate"]:
+                self.duplicates += 1
+            else:
+                self.appended += 1
+            item.result = result
+            item.done.set()
+        with self._new_events:
+            self._last_seq = max([self._last_seq] + [r["seq"] for r in results])
+            self._new_events.notify_all()
+
+    def read(self, after=0, limit=DEFAULT_READ_LIMIT, topic=None, correlation_id=None, authenticated=None):
+        """Eventos con secuencia mayor que `after`, en orden; devuelve (eventos, cursor_siguiente)
+
+        Cada evento es {'seq', 'topic', 'key', 'correlation_id', 'authenticated', 'payload',
+        'received_at'}. Con `authenticated=True` sólo se leen los eventos cuyo
+        emisor se verificó. El cursor siguiente es la secuencia del último
+        evento leído (o `after` si no hubo nada nuevo).
+        """
+        sql = ("SELECT seq, topic, idempotency_key, correlation_id, authenticated, payload, received_at "
+               "FROM events WHERE seq > ?")
+        params = [after]
+        if topic:
+            sql += " AND topic = ?"
+            params.append(topic)
+        if correlation_id:
+            sql += " AND correlation_id = ?"
+            params.append(correlation_id)
+        if authenticated is not None:
+            sql += " AND authenticated = ?"
+            params.append(int(bool(authenticated)))
+        sql += " ORDER BY seq LIMIT ?"
+        params.append(limit)
+        with self._reader_lock:
+            rows = self._reader.execute(sql, params).fetchall()
+        events = [
+            {"seq": seq, "topic": event_topic, "key": key, "correlation_id": event_correlation,
+             "authenticated": bool(event_authenticated), "payload": json.loads(payload), "received_at": received_at}
+            for seq, event_topic, key, event_correlation, event_authenticated, payload, received_at in rows
+        ]
+        return events, (events[-1]["seq"] if events else after)
+
+    def wait(self, after=0, timeout=None, limit=DEFAULT_READ_LIMIT, topic=None, correlation_id=None,
+             authenticated=None):
+        """Como `read`, pero si no hay nada nuevo espera hasta `timeout` segundos a que llegue algo
+
+        Los eventos de este proceso despiertan la espera al confirmarse; los que
+        escribe otro proceso sobre el mismo archivo se ven al volver a consultar
+        cada `POLL_INTERVAL_SECONDS`.
+        """
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            with self._new_events:
+                seen = self._last_seq
+            events, cursor = self.read(after, limit, topic, correlation_id, authenticated)
+            remaining = deadline - time.time() if deadline else POLL_INTERVAL_SECONDS
+            if events or remaining <= 0:
+                return events, cursor
+            with self._new_events:
+                if self._last_seq == seen:
+                    self._new_events.wait(min(remaining, POLL_INTERVAL_SECONDS))
+
+    def last_seq(self):
+        return self._last_seq
+
+    def stats(self):
+        return {"appended": self.appended, "duplicates": self.duplicates, "commits": self.commits,
+                "last_seq": self._last_seq, "queued": self._queue.qsize()}
+
+    def close(self):
+        """Termina de escribir lo encolado y cierra las conexiones"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.close()
+        self._reader.close()
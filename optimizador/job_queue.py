@@ -0,0 +1,319 @@
+# job_queue.py
+"""Cola local de trabajos de optimización: pool acotado, prioridades, cancelación y estado persistente
+
+Los trabajos (tipo de solver + parámetros) se guardan en SQLite en modo WAL,
+así que sobreviven a un reinicio y varios procesos (Streamlit y el servidor
+Flask) pueden compartir la misma cola: tomar un trabajo es un UPDATE
+condicionado al estado 'queued', que sólo un proceso gana. Cada hilo del pool
+ejecuta un trabajo a la vez en un proceso hijo, que se puede terminar para
+cancelar un cálculo en curso sin bloquear a nadie más. El hijo se arranca con
+'spawn': un fork desde Streamlit o Flask copiaría un proceso con hilos (y sus
+locks tomados), justo lo que la cola existe para evitar.
+
+Estados: queued → running → done | failed | cancelled.
+"""
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+
+from decomposition import solve_fleet_decomposed
+from fleet_routing import solve_fleet
+from parallel_solver import solve_route_parallel
+from route_solver import solve_route
+from time_windows import solve_fleet_time_windows
+
+DEFAULT_PATH = "optimization_jobs.db"
+DEFAULT_WORKERS = 2
+
+# 1 es la más urgente, como la prioridad de las entregas
+DEFAULT_PRIORITY = 3
+
+DEFAULT_JOB_TIMEOUT_SECONDS = 600
+
+# Cada cuánto los hilos del pool revisan la cola y el proceso hijo, y cada cuánto marcan latido y
+# miran si se pidió cancelar (segundos)
+POLL_INTERVAL_SECONDS = 0.5
+HEARTBEAT_SECONDS = 1
+# Un trabajo 'running' sin latido por este tiempo quedó huérfano (su proceso murió) y vuelve a la cola
+STALE_AFTER_SECONDS = 30
+# Espera para que el proceso de un trabajo cancelado libere sus recursos antes de matarlo (segundos)
+TERMINATE_GRACE_SECONDS = 2
+
+# Tipos de trabajo → solver; los parámetros del trabajo son sus argumentos por nombre
+SOLVERS = {
+    'route': solve_route,
+    'route_parallel': solve_route_parallel,
+    'fleet': solve_fleet,
+    'fleet_decomposed': solve_fleet_decomposed,
+    'fleet_time_windows': solve_fleet_time_windows,
+}
+
+FINAL_STATUSES = ('done', 'failed', 'cancelled')
+
+# Procesos hijos de intérprete nuevo: no heredan hilos ni locks del proceso que encola
+_SOLVER_CONTEXT = multiprocessing.get_context('spawn')
+
+_STATUS_COLUMNS = "id, kind, priority, status, owner, error, created_at, started_at, finished_at"
+
+
+def _exit_on_terminate(signum, frame):
+    raise SystemExit(1)
+
+
+def _run_solver(kind, params, conn):
+    """Proceso hijo: ejecuta el solver y envía ('ok', resultado JSON) o ('error', mensaje)
+
+    El proceso encabeza su propio grupo, así al cancelarlo también se detienen
+    los procesos que abra el solver (el pool de `solve_route_parallel`), y
+    SIGTERM se convierte en SystemExit para que los `finally` del solver
+    liberen la memoria compartida.
+    """
+    if hasattr(os, 'setpgid'):
+        os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, _exit_on_terminate)
+    try:
+        result = SOLVERS[kind](**params)
+        conn.send(('ok', json.dumps(result, ensure_ascii=False, default=str)))
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {str(e)}"))
+    finally:
+        conn.close()
+
+
+class JobQueue:
+    """Cola persistente de trabajos con `workers` hilos de ejecución (0: sólo encolar y consultar)"""
+
+    def __init__(self, path=DEFAULT_PATH, workers=DEFAULT_WORKERS, job_timeout=DEFAULT_JOB_TIMEOUT_SECONDS):
+        self.path = path
+        self.job_timeout = job_timeout
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._stopping = threading.Event()
+        self._last_stale_check = 0.0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                owner TEXT,
+                params TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, priority, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner, created_at)")
+
+        self._threads = [
+            threading.Thread(target=self._worker_loop, name=f"job-worker-{k}", daemon=True)
+            for k in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def submit(self, kind, params, priority=DEFAULT_PRIORITY, owner=None):
+        """Encola un trabajo y devuelve su id; `params` son los argumentos del solver de `kind`"""
+        if kind not in SOLVERS:
+            raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+        job_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO jobs (id, kind, priority, status, owner, params, created_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, int(priority), owner, json.dumps(params, ensure_ascii=False, default=str), time.time())
+        )
+        self._notify()
+        return job_id
+
+    def _status_dict(self, row):
+        status = dict(zip(("id", "kind", "priority", "status", "owner", "error",
+                           "created_at", "started_at", "finished_at"), row))
+        if status["status"] == 'queued':
+            status["position"] = self._execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND (priority < ? OR (priority = ? AND created_at < ?))",
+                (status["priority"], status["priority"], status["created_at"])
+            ).fetchone()[0] + 1
+        return status
+
+    def status(self, job_id):
+        """Estado del trabajo (sin parámetros ni resultado), con su posición si está en cola; None si no existe"""
+        row = self._execute(f"SELECT {_STATUS_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._status_dict(row) if row else None
+
+    def result(self, job_id):
+        """Resultado del solver si el trabajo terminó bien, o None"""
+        row = self._execute("SELECT result FROM jobs WHERE id = ? AND status = 'done'", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_jobs(self, owner=None, limit=50):
+        """Trabajos más recientes (de un dueño, si se indica)"""
+        sql = f"SELECT {_STATUS_COLUMNS} FROM jobs"
+        params = []
+        if owner:
+            sql += " WHERE owner = ?"
+            params.append(owner)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        return [self._status_dict(row) for row in self._execute(sql, params).fetchall()]
+
+    def cancel(self, job_id):
+        """Cancela un trabajo en cola o pide detener uno en curso; False si ya había terminado"""
+        cursor = self._execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id)
+        )
+        if not cursor.rowcount:
+            # El proceso que lo ejecuta lo ve en su próximo latido y termina el proceso hijo
+            cursor = self._execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'",
+                                   (job_id,))
+        self._notify()
+        return bool(cursor.rowcount)
+
+    def wait(self, job_id, timeout=None):
+        """Espera hasta que el trabajo termine o pase `timeout`; devuelve su estado"""
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            status = self.status(job_id)
+            if status is None or status["status"] in FINAL_STATUSES:
+                return status
+            remaining = deadline - time.time() if deadline else POLL_INTERVAL_SECONDS
+            if remaining <= 0:
+                return status
+            with self._changed:
+                self._changed.wait(min(remaining, POLL_INTERVAL_SECONDS))
+
+    def stats(self):
+        counts = dict(self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"workers": len(self._threads), **counts}
+
+    def _requeue_stale(self):
+        """Devuelve a la cola los trabajos cuyo proceso dejó de dar latidos (por ejemplo, tras una caída)"""
+        now = time.time()
+        if now - self._last_stale_check < STALE_AFTER_SECONDS / 2:
+            return
+        self._last_stale_check = now
+        cursor = self._execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL "
+            "WHERE status = 'running' AND heartbeat_at < ?", (now - STALE_AFTER_SECONDS,)
+        )
+        if cursor.rowcount:
+            print(f"Trabajos huérfanos devueltos a la cola: {cursor.rowcount}")
+
+    def _claim(self):
+        """Toma el trabajo en cola más urgente; None si no hay ninguno disponible"""
+        while True:
+            row = self._execute(
+                "SELECT id, kind, params FROM jobs WHERE status = 'queued' ORDER BY priority, created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            cursor = self._execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = ? "
+                "WHERE id = ? AND status = 'queued'", (self._worker_id, now, now, row[0])
+            )
+            if cursor.rowcount:
+                return row[0], row[1], json.loads(row[2])
+            # Otro hilo u otro proceso lo tomó primero: probar con el siguiente
+
+    def _worker_loop(self):
+        while not self._stopping.is_set():
+            try:
+                self._requeue_stale()
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"Error al leer la cola de trabajos: {str(e)}")
+                job = None
+            if job is None:
+                with self._changed:
+                    self._changed.wait(POLL_INTERVAL_SECONDS)
+                continue
+            self._run(*job)
+
+    def _run(self, job_id, kind, params):
+        receiver, sender = _SOLVER_CONTEXT.Pipe(duplex=False)
+        process = _SOLVER_CONTEXT.Process(target=_run_solver, args=(kind, params, sender),
+                                          name=f"job-{job_id[:8]}")
+        process.start()
+        sender.close()
+
+        started = last_beat = time.time()
+        outcome = None
+        while outcome is None:
+            if receiver.poll(POLL_INTERVAL_SECONDS):
+                try:
+                    outcome = receiver.recv()
+                except EOFError:
+                    outcome = ('error', f"El proceso del trabajo terminó sin resultado (código {process.exitcode})")
+                continue
+            now = time.time()
+            if self._stopping.is_set():
+                outcome = ('requeue', None)
+            elif now - started > self.job_timeout:
+                outcome = ('error', f"Tiempo límite de {self.job_timeout} s agotado")
+            elif now - last_beat >= HEARTBEAT_SECONDS:
+                last_beat = now
+                row = self._execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? RETURNING cancel_requested",
+                                    (now, job_id)).fetchone()
+                if row and row[0]:
+                    outcome = ('cancelled', None)
+
+        self._stop_process(process)
+        receiver.close()
+
+        kind_of_end, payload = outcome
+        if kind_of_end == 'requeue':
+            self._execute("UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL WHERE id = ?", (job_id,))
+        elif kind_of_end == 'ok':
+            self._execute("UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ?",
+                          (payload, time.time(), job_id))
+        elif kind_of_end == 'cancelled':
+            self._execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ?", (time.time(), job_id))
+        else:
+            print(f"Error en el trabajo {job_id}: {payload}")
+            self._execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                          (payload, time.time(), job_id))
+        self._notify()
+
+    def _stop_process(self, process):
+        if process.is_alive():
+            process.terminate()
+        process.join(timeout=TERMINATE_GRACE_SECONDS)
+        if hasattr(os, 'killpg'):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        process.join()
+
+    def close(self):
+        """Detiene los hilos; los trabajos en curso vuelven a la cola para el próximo arranque"""
+        self._stopping.set()
+        self._notify()
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            self._conn.close()
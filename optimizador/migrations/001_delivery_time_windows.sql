@@ -0,0 +1,16 @@
+-- 001_delivery_time_windows.sql
+-- Ventanas horarias y tiempo de atención por entrega (ruteo con ventanas horarias, time_windows.py).
+-- Las entregas sin ventana aceptan cualquier hora del turno; sin tiempo de atención se usan 5 minutos.
+-- Ejecutar una vez en el SQL Editor de Supabase antes de desplegar esta versión.
+
+alter table public.deliveries
+    add column if not exists service_time_minutes integer
+        check (service_time_minutes is null or service_time_minutes between 1 and 480),
+    add column if not exists time_window_start time,
+    add column if not exists time_window_end time;
+
+alter table public.deliveries
+    drop constraint if exists deliveries_time_window_order;
+alter table public.deliveries
+    add constraint deliveries_time_window_order
+        check (time_window_start is null or time_window_end is null or time_window_end > time_window_start);
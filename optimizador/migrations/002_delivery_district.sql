@@ -0,0 +1,11 @@
+-- 002_delivery_district.sql
+-- Distrito guardado en cada entrega (districts.py): el filtro por distrito y los conteos del panel
+-- leen esta columna en lugar de volver a inferirla de las coordenadas.
+-- Las filas anteriores quedan en null y se completan desde la app con SupabaseManager.assign_missing_districts.
+-- Ejecutar una vez en el SQL Editor de Supabase antes de desplegar esta versión.
+
+alter table public.deliveries
+    add column if not exists district text;
+
+create index if not exists deliveries_district_idx
+    on public.deliveries (district);
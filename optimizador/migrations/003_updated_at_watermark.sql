@@ -0,0 +1,45 @@
+-- 003_updated_at_watermark.sql
+-- Marca de agua de la réplica local (data_sync.py): cada fila de deliveries y optimized_routes
+-- guarda cuándo cambió por última vez, también si el cambio lo hace n8n, el servidor de webhooks
+-- u otra instancia de la app. Sin esta columna la sincronización incremental sólo ve filas nuevas.
+-- Ejecutar una vez en el SQL Editor de Supabase antes de desplegar esta versión.
+
+create or replace function public.set_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at = now();
+    return new;
+end;
+$$;
+
+alter table public.deliveries
+    add column if not exists updated_at timestamptz;
+update public.deliveries set updated_at = coalesce(created_at, now()) where updated_at is null;
+alter table public.deliveries
+    alter column updated_at set default now(),
+    alter column updated_at set not null;
+
+drop trigger if exists deliveries_set_updated_at on public.deliveries;
+create trigger deliveries_set_updated_at
+    before update on public.deliveries
+    for each row execute function public.set_updated_at();
+
+create index if not exists deliveries_updated_at_idx
+    on public.deliveries (updated_at);
+
+alter table public.optimized_routes
+    add column if not exists updated_at timestamptz;
+update public.optimized_routes set updated_at = coalesce(created_at, now()) where updated_at is null;
+alter table public.optimized_routes
+    alter column updated_at set default now(),
+    alter column updated_at set not null;
+
+drop trigger if exists optimized_routes_set_updated_at on public.optimized_routes;
+create trigger optimized_routes_set_updated_at
+    before update on public.optimized_routes
+    for each row execute function public.set_updated_at();
+
+create index if not exists optimized_routes_updated_at_idx
+    on public.optimized_routes (updated_at);
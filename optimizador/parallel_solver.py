@@ -0,0 +1,147 @@
+# parallel_solver.py
+"""Búsqueda multi-arranque en paralelo: portafolio de heurísticas sobre un pool de procesos
+
+La matriz de distancias se publica una sola vez en memoria compartida y cada
+proceso la adjunta al iniciar, en lugar de recibir una copia serializada por
+tarea. Cada arranque combina una heurística de construcción, un orden de
+vecindarios y una semilla, y sigue con búsqueda local iterada (perturbación
+double-bridge + 2-opt/Or-opt) hasta agotar el presupuesto de tiempo.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory, util
+
+import numpy as np
+
+from route_solver import (build_tour, double_bridge, improve_tour, route_distances, route_points,
+                          route_result, tour_length)
+
+PORTFOLIO = [
+    {"construction": "nearest_neighbor", "neighborhoods": ("two_opt", "or_opt")},
+    {"construction": "farthest_insertion", "neighborhoods": ("or_opt", "two_opt")},
+    {"construction": "randomized_nearest_neighbor", "neighborhoods": ("two_opt", "or_opt")},
+    {"construction": "randomized_nearest_neighbor", "neighborhoods": ("or_opt", "two_opt")},
+]
+
+# Perturbaciones por arranque en modo determinista (trabajo fijo, sin reloj)
+DETERMINISTIC_KICKS = 30
+
+DEFAULT_SEED = 0
+
+# Margen para recoger resultados después del presupuesto
+COLLECT_GRACE_SECONDS = 0.5
+
+# Matriz adjunta en cada proceso del pool
+_worker_state = {}
+
+
+def _attach_matrix(name, shape, dtype):
+    """Inicializador del pool: adjunta la matriz compartida una vez por proceso"""
+    shm = shared_memory.SharedMemory(name=name)
+    _worker_state['shm'] = shm
+    _worker_state['dist'] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    # Al salir el proceso del pool se suelta la vista y se cierra el handle (el padre hace unlink)
+    util.Finalize(None, _detach_matrix, exitpriority=10)
+
+
+def _detach_matrix():
+    _worker_state.pop('dist', None)
+    shm = _worker_state.pop('shm', None)
+    if shm is not None:
+        shm.close()
+
+
+def _search(strategy, seed, deadline, max_kicks):
+    """Un arranque: construcción + mejora + búsqueda local iterada; devuelve (longitud, tour)"""
+    dist = _worker_state['dist']
+    rng = np.random.default_rng(seed)
+
+    def remaining():
+        return max(deadline - time.time(), 0.0) if deadline else None
+
+    tour = build_tour(strategy["construction"], dist, rng)
+    # Un arranque que empieza con el plazo vencido entrega sólo la construcción
+    if deadline and remaining() <= 0:
+        return tour_length(tour, dist), np.asarray(tour, dtype=np.int64).tolist()
+    tour = improve_tour(tour, dist, time_limit=remaining(), neighborhoods=strategy["neighborhoods"])
+    best, best_length = tour, tour_length(tour, dist)
+
+    # Tours muy cortos no admiten double-bridge: no hay nada que perturbar
+    if len(best) < 8:
+        return best_length, best.tolist()
+
+    kicks = 0
+    while max_kicks is None or kicks < max_kicks:
+        if deadline and time.time() >= deadline:
+            break
+        candidate = improve_tour(double_bridge(best, rng), dist, time_limit=remaining(),
+                                 neighborhoods=strategy["neighborhoods"])
+        candidate_length = tour_length(candidate, dist)
+        if candidate_length < best_length:
+            best, best_length = candidate, candidate_length
+        kicks += 1
+
+    return best_length, best.tolist()
+
+
+def solve_route_parallel(deliveries, depot, return_to_depot=True, time_budget=5.0, starts=None,
+                         workers=None, seed=None, deterministic=False):
+    """Ejecuta `starts` búsquedas independientes en paralelo y devuelve la mejor ruta
+
+    Con `deterministic=True` cada arranque hace un número fijo de
+    perturbaciones sin mirar el reloj, de modo que la misma entrada y semilla
+    producen siempre la misma ruta (el presupuesto de tiempo no se aplica).
+    El resultado tiene la estructura de `solve_route` más los datos del
+    arranque ganador.
+
+    Abre un pool de procesos: llamado directamente desde Streamlit (o
+    cualquier proceso con hilos) hace fork de un proceso multihilo, por eso
+    la app lo ejecuta a través de job_queue, en un proceso hijo propio.
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    starts = starts or max(workers, len(PORTFOLIO))
+    if seed is None:
+        seed = DEFAULT_SEED if deterministic else int.from_bytes(os.urandom(4), 'little')
+
+    indices, points = route_points(deliveries, depot)
+    dist, search_dist = route_distances(points, return_to_depot)
+
+    deadline = None if deterministic else time.time() + time_budget
+    max_kicks = DETERMINISTIC_KICKS if deterministic else None
+
+    shm = shared_memory.SharedMemory(create=True, size=max(search_dist.nbytes, 1))
+    try:
+        shared = np.ndarray(search_dist.shape, dtype=search_dist.dtype, buffer=shm.buf)
+        shared[:] = search_dist
+
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_attach_matrix,
+                                       initargs=(shm.name, search_dist.shape, search_dist.dtype))
+        try:
+            futures = {
+                executor.submit(_search, PORTFOLIO[k % len(PORTFOLIO)], seed + k, deadline, max_kicks): k
+                for k in range(starts)
+            }
+            timeout = None if deterministic else time_budget + COLLECT_GRACE_SECONDS
+            done, _ = wait(futures, timeout=timeout)
+        finally:
+            executor.shutdown(wait=deterministic, cancel_futures=True)
+
+        finished = sorted((f.result()[0], futures[f], f.result()[1]) for f in done if not f.exception())
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if not finished:
+        raise TimeoutError("Ningún arranque terminó dentro del presupuesto de tiempo")
+
+    best_length, best_start, best_tour = finished[0]
+    result = route_result(deliveries, indices, points, dist, np.array(best_tour), return_to_depot, started)
+    result.update({
+        "starts_completed": len(finished),
+        "best_start": best_start,
+        "best_strategy": PORTFOLIO[best_start % len(PORTFOLIO)]["construction"],
+        "seed": seed,
+    })
+    return result
@@ -0,0 +1,134 @@
+# query_cache.py
+"""Caché de lectura compartida por todas las sesiones para las consultas a Supabase
+
+Cada entrada depende de una o más tablas; su vigencia es el menor TTL de esas
+tablas y cualquier escritura en una de ellas la invalida. Las entradas
+vencidas se descartan al consultarlas y, pasado `max_entries`, se desalojan
+primero las vencidas y luego las menos usadas (LRU). Las cargas
+concurrentes de una misma clave se hacen una sola vez: los demás hilos esperan
+el resultado en lugar de repetir la consulta.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Segundos de vigencia por tabla
+DEFAULT_TABLE_TTLS = {
+    'deliveries': 30,
+    'route_deliveries': 30,
+    'optimized_routes': 60,
+    'vehicles': 300,
+    'drivers': 300,
+}
+DEFAULT_TTL_SECONDS = 30
+
+# Entradas máximas: cada texto de búsqueda y cada página es una clave distinta
+DEFAULT_MAX_ENTRIES = 512
+
+
+def _copy(value):
+    """Copia superficial de listas/dicts para que quien llama no modifique la entrada cacheada"""
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+class QueryCache:
+    """Caché read-through con TTL por tabla, invalidación por escritura y contadores"""
+
+    def __init__(self, table_ttls=None, default_ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.table_ttls = dict(DEFAULT_TABLE_TTLS if table_ttls is None else table_ttls)
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # clave → (expira, tablas, valor), de menos a más usada
+        self._generations = {}  # tabla → contador de escrituras
+        self._loading = {}  # clave → lock de la carga en curso
+        self._lock = threading.Lock()
+
+    def get_or_load(self, tables, key, loader):
+        """Devuelve el valor de `key` o lo carga con `loader()` si no está vigente"""
+        tables = tuple(tables)
+        key = (tables, key)
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if entry[0] > time.monotonic():
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return _copy(entry[2])
+                    del self._entries[key]
+                load_lock = self._loading.get(key)
+                if load_lock is None:
+                    load_lock = self._loading[key] = threading.Lock()
+                    load_lock.acquire()
+                    self.misses += 1
+                    generations = [self._generations.get(t, 0) for t in tables]
+                    break
+            # Otro hilo está cargando la misma clave: esperar y volver a mirar
+            with load_lock:
+                pass
+
+        try:
+            value = loader()
+            with self._lock:
+                # Si hubo una escritura durante la carga, el resultado puede estar obsoleto
+                if generations == [self._generations.get(t, 0) for t in tables]:
+                    ttl = min(self.table_ttls.get(t, self.default_ttl) for t in tables)
+                    self._entries[key] = (time.monotonic() + ttl, tables, value)
+                    self._entries.move_to_end(key)
+                    self._evict()
+            return _copy(value)
+        finally:
+            with self._lock:
+                del self._loading[key]
+            load_lock.release()
+
+    def _evict(self):
+        """Con el lock tomado: deja como máximo `max_entries`, sacando primero las vencidas"""
+        if len(self._entries) <= self.max_entries:
+            return
+        now = time.monotonic()
+        expired = [k for k, entry in self._entries.items() if entry[0] <= now]
+        for key in expired:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *tables):
+        """Descarta las entradas que dependen de cualquiera de `tables`"""
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            stale = [k for k, entry in self._entries.items() if set(entry[1]) & set(tables)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            for table in {t for entry in self._entries.values() for t in entry[1]}:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,179 @@
+# route_geometry.py
+"""Geometría de rutas: codec de polilíneas vectorizado, simplificación Douglas-Peucker y caché LRU
+
+El formato es el Encoded Polyline Algorithm de Google (precisión 1e-5), el
+mismo de la librería `polyline` y de la columna `optimized_routes.polyline`.
+Codificar y decodificar opera sobre arreglos NumPy completos en lugar de
+carácter por carácter.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from geo_distance import km_per_pixel, project
+
+PRECISION = 5
+
+# Tolerancia de simplificación en píxeles de pantalla
+DEFAULT_TOLERANCE_PIXELS = 1.5
+
+DEFAULT_CACHE_ENTRIES = 256
+
+# Un entero zigzag de 35 bits ocupa a lo sumo 7 grupos de 5 bits
+_MAX_CHUNKS = 7
+
+
+def encode(coords, precision=PRECISION):
+    """Codifica una secuencia de (lat, lon) como polilínea"""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if not len(coords):
+        return ''
+    scaled = np.rint(coords * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+
+    values = (deltas << 1) ^ (deltas >> 63)  # zigzag: signo en el bit menos significativo
+    shifts = 5 * np.arange(_MAX_CHUNKS)
+    chunks = (values[:, None] >> shifts) & 0x1F
+    # Grupos necesarios por valor (al menos uno, aunque el valor sea 0)
+    n_chunks = 1 + np.count_nonzero(values[:, None] >= (1 << shifts[1:]), axis=1)
+    used = np.arange(_MAX_CHUNKS) < n_chunks[:, None]
+    continued = np.arange(_MAX_CHUNKS) < (n_chunks - 1)[:, None]
+    chars = (chunks | np.where(continued, 0x20, 0)) + 63
+    return chars[used].astype(np.uint8).tobytes().decode('ascii')
+
+
+def _decode_values(data):
+    """Enteros con signo contenidos en los bytes de una o varias polilíneas"""
+    raw = np.frombuffer(data, dtype=np.uint8).astype(np.int64) - 63
+    if len(raw) and (raw.min() < 0 or raw.max() > 63 or raw[-1] & 0x20):
+        raise ValueError("Polilínea inválida")
+    ends = (raw & 0x20) == 0
+    group = np.concatenate([[0], np.cumsum(ends)[:-1]])
+    starts = np.flatnonzero(np.concatenate([[True], ends[:-1]]))
+    position = np.arange(len(raw)) - starts[group]
+    if len(position) and position.max() >= _MAX_CHUNKS:
+        raise ValueError("Polilínea inválida")
+    values = np.add.reduceat((raw & 0x1F) << (5 * position), starts) if len(raw) else raw
+    return (values >> 1) ^ -(values & 1)
+
+
+def decode(encoded, precision=PRECISION):
+    """Arreglo (n, 2) de lat/lon a partir de una polilínea; ValueError si está corrupta"""
+    return decode_many([encoded], precision)[0]
+
+
+def decode_many(encoded_list, precision=PRECISION):
+    """Decodifica varias polilíneas en una sola pasada sobre sus bytes concatenados"""
+    encoded_list = [e or '' for e in encoded_list]
+    data = ''.join(encoded_list).encode('ascii')
+    values = _decode_values(data)
+
+    # Cuántos valores aporta cada polilínea (cada valor termina en un byte sin bit de continuación)
+    ends = ((np.frombuffer(data, dtype=np.uint8).astype(np.int64) - 63) & 0x20) == 0
+    lengths = np.array([len(e) for e in encoded_list], dtype=np.int64)
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    ends_before = np.concatenate([[0], np.cumsum(ends)])
+    counts = ends_before[bounds[1:]] - ends_before[bounds[:-1]]
+    if np.any(counts % 2):
+        raise ValueError("Polilínea inválida: cantidad impar de valores")
+
+    pairs = values.reshape(-1, 2)
+    totals = np.cumsum(pairs, axis=0)
+    result = []
+    start = 0
+    for count in counts // 2:
+        segment = totals[start:start + count]
+        base = totals[start - 1] if start else 0
+        result.append((segment - base) / 10 ** precision)
+        start += count
+    return result
+
+
+def simplify(points, tolerance_km):
+    """Douglas-Peucker: conserva los vértices a más de `tolerance_km` de la recta simplificada"""
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 3 or tolerance_km <= 0:
+        return points
+    x, y = project(points[:, 0], points[:, 1], points[0])
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        length_sq = dx * dx + dy * dy
+        if length_sq == 0:
+            distances = np.hypot(px, py)
+        else:
+            # Distancia al segmento (no a la recta infinita)
+            t = np.clip((px * dx + py * dy) / length_sq, 0, 1)
+            distances = np.hypot(px - t * dx, py - t * dy)
+        k = int(np.argmax(distances))
+        if distances[k] > tolerance_km:
+            split = first + 1 + k
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return points[keep]
+
+
+def tolerance_for_zoom(zoom, latitude, pixels=DEFAULT_TOLERANCE_PIXELS):
+    """Tolerancia en km equivalente a `pixels` de pantalla al nivel de zoom dado"""
+    return pixels * km_per_pixel(zoom, latitude)
+
+
+class RouteGeometryCache:
+    """LRU acotado de geometrías decodificadas y simplificadas por (ruta, zoom)"""
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, route_id, encoded, zoom):
+        """Puntos (n, 2) de la ruta listos para dibujar al zoom dado"""
+        # La huella evita servir una geometría vieja si la polilínea de la ruta cambió
+        key = (route_id, zoom, hashlib.blake2b((encoded or '').encode('ascii'), digest_size=8).digest())
+        with self._lock:
+            points = self._entries.get(key)
+            if points is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return points
+            self.misses += 1
+
+        points = decode(encoded)
+        if len(points):
+            points = simplify(points, tolerance_for_zoom(zoom, float(points[:, 0].mean())))
+        points.setflags(write=False)
+
+        with self._lock:
+            self._entries[key] = points
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return points
+
+    def get_many(self, routes, zoom):
+        """{route_id: puntos} para varias rutas ({'id', 'polyline'}); las polilíneas corruptas se omiten"""
+        result = {}
+        for route in routes:
+            if not route.get('polyline'):
+                continue
+            try:
+                result[route['id']] = self.get(route['id'], route['polyline'], zoom)
+            except ValueError as e:
+                print(f"Polilínea inválida en la ruta {route['id']}: {str(e)}")
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -0,0 +1,256 @@
+# route_solver.py
+"""Motor local de optimización de rutas (TSP con depósito) para Trujillo"""
+import time
+
+import numpy as np
+
+from geo_distance import haversine_matrix
+
+# Velocidad media urbana usada para estimar la duración de la ruta
+AVERAGE_SPEED_KMH = 25.0
+
+# Mejoras menores a este valor (km) se consideran ruido numérico
+IMPROVEMENT_EPS = 1e-9
+
+
+def tour_length(tour, dist):
+    """Longitud de un tour cerrado (el último nodo vuelve al primero)"""
+    tour = np.asarray(tour)
+    return float(dist[tour, np.roll(tour, -1)].sum())
+
+
+def nearest_neighbor_tour(dist, start=0):
+    """Construye un tour inicial por vecino más cercano partiendo de `start`"""
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    tour = np.empty(n, dtype=np.int64)
+    tour[0] = start
+    visited[start] = True
+
+    for k in range(1, n):
+        row = np.where(visited, np.inf, dist[tour[k - 1]])
+        nxt = int(np.argmin(row))
+        tour[k] = nxt
+        visited[nxt] = True
+
+    return tour
+
+
+def randomized_nearest_neighbor_tour(dist, rng, candidates=3, start=0):
+    """Vecino más cercano eligiendo al azar entre los `candidates` más próximos en cada paso"""
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    tour = np.empty(n, dtype=np.int64)
+    tour[0] = start
+    visited[start] = True
+
+    for k in range(1, n):
+        row = np.where(visited, np.inf, dist[tour[k - 1]])
+        pool = min(candidates, n - k)
+        nearest = np.argpartition(row, pool - 1)[:pool]
+        nxt = int(rng.choice(nearest))
+        tour[k] = nxt
+        visited[nxt] = True
+
+    return tour
+
+
+def farthest_insertion_tour(dist, start=0):
+    """Inserción más lejana: agrega la parada más alejada del tour en su hueco más barato"""
+    n = len(dist)
+    tour = np.array([start], dtype=np.int64)
+    in_tour = np.zeros(n, dtype=bool)
+    in_tour[start] = True
+    to_tour = dist[start].astype(np.float64).copy()
+
+    for _ in range(n - 1):
+        x = int(np.argmax(np.where(in_tour, -np.inf, to_tour)))
+        u = tour
+        v = np.roll(tour, -1)
+        cost = dist[u, x] + dist[x, v] - dist[u, v]
+        gap = int(np.argmin(cost))
+        tour = np.insert(tour, gap + 1, x)
+        in_tour[x] = True
+        to_tour = np.minimum(to_tour, dist[x])
+
+    return tour
+
+
+def build_tour(construction, dist, rng=None):
+    """Construye un tour inicial con la heurística indicada por nombre"""
+    if construction == "nearest_neighbor":
+        return nearest_neighbor_tour(dist)
+    if construction == "randomized_nearest_neighbor":
+        return randomized_nearest_neighbor_tour(dist, rng or np.random.default_rng())
+    if construction == "farthest_insertion":
+        return farthest_insertion_tour(dist)
+    raise ValueError(f"Heurística de construcción desconocida: {construction}")
+
+
+def double_bridge(tour, rng):
+    """Perturbación double-bridge (4-opt) que mantiene el depósito en la posición 0"""
+    n = len(tour)
+    if n < 8:
+        return np.array(tour, dtype=np.int64)
+    a, b, c = np.sort(rng.choice(np.arange(1, n), size=3, replace=False))
+    return np.concatenate((tour[:a], tour[b:c], tour[a:b], tour[c:]))
+
+
+def two_opt(tour, dist, deadline=None):
+    """Mejora un tour con 2-opt; para cada arista evalúa todos los cortes en bloque con NumPy"""
+    tour = np.array(tour, dtype=np.int64)
+    n = len(tour)
+    if n < 4:
+        return tour
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 2):
+            a, b = tour[i], tour[i + 1]
+            c = tour[i + 2:]
+            d = np.append(tour[i + 3:], tour[0])
+
+            delta = dist[a, c] + dist[b, d] - dist[a, b] - dist[c, d]
+            k = int(np.argmin(delta))
+            if delta[k] < -IMPROVEMENT_EPS:
+                j = i + 2 + k
+                tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1]
+                improved = True
+
+        if deadline and time.perf_counter() > deadline:
+            break
+
+    return tour
+
+
+def or_opt(tour, dist, max_segment=3, deadline=None):
+    """Mejora un tour con Or-opt: reubica segmentos de 1 a `max_segment` paradas (también invertidos)"""
+    tour = np.array(tour, dtype=np.int64)
+    n = len(tour)
+    if n < 5:
+        return tour
+
+    improved = True
+    while improved:
+        improved = False
+        for seg_len in range(1, max_segment + 1):
+            i = 1  # El depósito (posición 0) nunca se mueve
+            while i + seg_len <= n:
+                seg = tour[i:i + seg_len]
+                prev_node = tour[i - 1]
+                next_node = tour[(i + seg_len) % n]
+                first, last = seg[0], seg[-1]
+
+                removal_gain = dist[prev_node, first] + dist[last, next_node] - dist[prev_node, next_node]
+
+                # Tour sin el segmento: aristas candidatas (u -> v) para reinsertarlo
+                rest = np.concatenate((tour[:i], tour[i + seg_len:]))
+                u = rest
+                v = np.roll(rest, -1)
+                insert_cost = dist[u, first] + dist[last, v] - dist[u, v]
+                insert_cost_rev = dist[u, last] + dist[first, v] - dist[u, v]
+                # La arista que ya ocupaba el segmento no cuenta como movimiento
+                insert_cost[i - 1] = np.inf
+                insert_cost_rev[i - 1] = np.inf
+
+                best_fwd = int(np.argmin(insert_cost))
+                best_rev = int(np.argmin(insert_cost_rev))
+                if insert_cost_rev[best_rev] < insert_cost[best_fwd]:
+                    pos, cost, new_seg = best_rev, insert_cost_rev[best_rev], seg[::-1]
+                else:
+                    pos, cost, new_seg = best_fwd, insert_cost[best_fwd], seg
+
+                if cost - removal_gain < -IMPROVEMENT_EPS:
+                    tour = np.concatenate((rest[:pos + 1], new_seg, rest[pos + 1:]))
+                    improved = True
+                else:
+                    i += 1
+
+            if deadline and time.perf_counter() > deadline:
+                return tour
+
+    return tour
+
+
+NEIGHBORHOODS = {
+    "two_opt": lambda tour, dist, deadline: two_opt(tour, dist, deadline),
+    "or_opt": lambda tour, dist, deadline: or_opt(tour, dist, deadline=deadline),
+}
+
+
+def improve_tour(tour, dist, time_limit=None, neighborhoods=("two_opt", "or_opt")):
+    """Aplica los vecindarios en el orden dado hasta que ninguno encuentre mejoras
+
+    `time_limit=None` no pone límite; 0 (tiempo ya agotado) hace a lo sumo una pasada acotada.
+    """
+    deadline = time.perf_counter() + time_limit if time_limit is not None else None
+    best = np.array(tour, dtype=np.int64)
+    best_length = tour_length(best, dist)
+
+    while True:
+        candidate = best
+        for name in neighborhoods:
+            candidate = NEIGHBORHOODS[name](candidate, dist, deadline)
+        candidate_length = tour_length(candidate, dist)
+        if candidate_length < best_length - IMPROVEMENT_EPS:
+            best, best_length = candidate, candidate_length
+        else:
+            break
+        if deadline and time.perf_counter() > deadline:
+            break
+
+    return best
+
+
+def route_points(deliveries, depot):
+    """Índices de las entregas con coordenadas y puntos [(lat, lon)] con el depósito en la posición 0"""
+    indices = [k for k, d in enumerate(deliveries) if d.get('customer_latitude') and d.get('customer_longitude')]
+    points = [tuple(depot)] + [
+        (float(deliveries[k]['customer_latitude']), float(deliveries[k]['customer_longitude'])) for k in indices
+    ]
+    return indices, points
+
+
+def route_distances(points, return_to_depot=True):
+    """Matriz real y matriz de búsqueda (en ruta abierta el regreso al depósito no cuesta nada)"""
+    coords = np.asarray(points, dtype=np.float64)
+    dist = haversine_matrix(coords[:, 0], coords[:, 1])
+    search_dist = dist
+    if not return_to_depot:
+        search_dist = dist.copy()
+        search_dist[:, 0] = 0.0
+    return dist, search_dist
+
+
+def route_result(deliveries, indices, points, dist, tour, return_to_depot, started):
+    """Arma el dict de resultado a partir de un tour sobre `points`"""
+    order = [indices[int(node) - 1] for node in tour[1:]]
+    path = list(tour) + ([0] if return_to_depot else [])
+    total_distance_km = float(sum(dist[path[k], path[k + 1]] for k in range(len(path) - 1)))
+
+    return {
+        "stops": [deliveries[k] for k in order],
+        "order": order,
+        "coordinates": [points[node] for node in path],
+        "total_distance_km": round(total_distance_km, 2),
+        "estimated_duration_minutes": round(total_distance_km / AVERAGE_SPEED_KMH * 60, 1),
+        "solve_time_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def solve_route(deliveries, depot, return_to_depot=True, time_limit=None):
+    """Ordena las entregas en una ruta que sale de `depot` (lat, lon)
+
+    Devuelve un dict con las entregas en orden de visita, la secuencia de
+    índices respecto a `deliveries`, la distancia total y la duración estimada.
+    """
+    start = time.perf_counter()
+
+    indices, points = route_points(deliveries, depot)
+    dist, search_dist = route_distances(points, return_to_depot)
+
+    tour = nearest_neighbor_tour(search_dist, start=0)
+    tour = improve_tour(tour, search_dist, time_limit=time_limit)
+
+    return route_result(deliveries, indices, points, dist, tour, return_to_depot, start)
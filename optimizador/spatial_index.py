@@ -0,0 +1,229 @@
+# spatial_index.py
+"""Índice espacial de grilla uniforme para consultas por radio, k vecinos y rectángulo
+
+Las coordenadas se proyectan a km en un plano local y cada punto se guarda en
+la celda que le corresponde. Una consulta sólo revisa las celdas que tocan la
+zona buscada y calcula distancias vectorizadas sobre esos candidatos. Insertar,
+mover o quitar un punto es O(1), así que el índice se mantiene al día a medida
+que cambian los estados sin reconstruirlo.
+
+`nearest_neighbor_lists` usa la misma grilla para las listas de candidatos de
+los optimizadores: cada punto sólo se compara con las celdas cercanas.
+"""
+import math
+import threading
+
+import numpy as np
+
+from geo_distance import haversine_matrix, haversine_one_to_many, project
+
+DEFAULT_CELL_SIZE_KM = 0.5
+
+
+class GridIndex:
+    """Puntos identificados por id en una grilla de celdas de `cell_size_km`"""
+
+    def __init__(self, cell_size_km=DEFAULT_CELL_SIZE_KM, origin=(0.0, 0.0)):
+        self.cell_size_km = cell_size_km
+        self.origin = tuple(origin)
+        self._cells = {}  # (i, j) → set de ids
+        self._points = {}  # id → (lat, lon, x, y, celda)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, point_id):
+        return point_id in self._points
+
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size_km), math.floor(y / self.cell_size_km))
+
+    def insert_many(self, ids, lats, lons):
+        """Inserta o mueve varios puntos (la proyección se calcula en bloque)"""
+        xs, ys = project(lats, lons, self.origin)
+        with self._lock:
+            for point_id, lat, lon, x, y in zip(ids, lats, lons, xs.tolist(), ys.tolist()):
+                self._remove(point_id)
+                cell = self._cell(x, y)
+                self._cells.setdefault(cell, set()).add(point_id)
+                self._points[point_id] = (float(lat), float(lon), x, y, cell)
+
+    def insert(self, point_id, lat, lon):
+        self.insert_many([point_id], [lat], [lon])
+
+    def remove(self, point_id):
+        with self._lock:
+            self._remove(point_id)
+
+    def _remove(self, point_id):
+        entry = self._points.pop(point_id, None)
+        if entry is not None:
+            members = self._cells[entry[4]]
+            members.discard(point_id)
+            if not members:
+                del self._cells[entry[4]]
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._points.clear()
+
+    def _candidates(self, x0, y0, x1, y1):
+        """Ids de las celdas que intersecan el rectángulo [x0, x1] × [y0, y1] del plano local"""
+        (i0, j0), (i1, j1) = self._cell(x0, y0), self._cell(x1, y1)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._cells):
+            # Rectángulo más grande que la parte ocupada: recorrer las celdas existentes
+            return [p for (i, j), members in self._cells.items()
+                    if i0 <= i <= i1 and j0 <= j <= j1 for p in members]
+        candidates = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                candidates.extend(self._cells.get((i, j), ()))
+        return candidates
+
+    def _coordinates(self, ids):
+        entries = [self._points[p] for p in ids]
+        return np.array([e[0] for e in entries]), np.array([e[1] for e in entries])
+
+    def within_radius(self, lat, lon, radius_km):
+        """[(id, distancia_km)] de los puntos a menos de `radius_km`, del más cercano al más lejano"""
+        (x,), (y,) = project([lat], [lon], self.origin)
+        with self._lock:
+            ids = self._candidates(x - radius_km, y - radius_km, x + radius_km, y + radius_km)
+            if not ids:
+                return []
+            lats, lons = self._coordinates(ids)
+        distances = haversine_one_to_many((lat, lon), lats, lons)
+        order = np.argsort(distances, kind='stable')
+        return [(ids[k], float(distances[k])) for k in order if distances[k] <= radius_km]
+
+    def nearest(self, lat, lon, k=1, max_radius_km=None, exclude=()):
+        """Los `k` puntos más cercanos [(id, distancia_km)], ampliando la búsqueda por anillos"""
+        (x,), (y,) = project([lat], [lon], self.origin)
+        exclude = set(exclude)
+        with self._lock:
+            if len(self._points) - len(exclude & self._points.keys()) <= 0:
+                return []
+            radius = self.cell_size_km
+            while True:
+                ids = [p for p in self._candidates(x - radius, y - radius, x + radius, y + radius)
+                       if p not in exclude]
+                exhausted = len(ids) >= len(self._points) - len(exclude & self._points.keys())
+                capped = max_radius_km is not None and radius >= max_radius_km
+                if len(ids) >= k or exhausted or capped:
+                    lats, lons = self._coordinates(ids) if ids else (np.array([]), np.array([]))
+                    distances = haversine_one_to_many((lat, lon), lats, lons)
+                    order = np.argsort(distances, kind='stable')[:k]
+                    limit = radius if not exhausted else math.inf
+                    if max_radius_km is not None:
+                        limit = min(limit, max_radius_km)
+                    # Sólo es exacto si el k-ésimo está dentro del radio cubierto por completo
+                    if exhausted or capped or (len(order) == k and distances[order[-1]] <= limit):
+                        return [(ids[j], float(distances[j])) for j in order if distances[j] <= limit]
+                radius *= 2
+
+    def in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Ids de los puntos dentro del rectángulo geográfico (por ejemplo, la vista del mapa)"""
+        xs, ys = project([min_lat, max_lat], [min_lon, max_lon], self.origin)
+        with self._lock:
+            ids = self._candidates(xs[0], ys[0], xs[1], ys[1])
+            if not ids:
+                return []
+            lats, lons = self._coordinates(ids)
+        inside = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+        return [p for p, ok in zip(ids, inside) if ok]
+
+    def apply(self, rows, deleted_ids=(), reset=False, keep=None):
+        """Mantiene el índice a partir de filas de entregas cambiadas
+
+        Las filas con coordenadas que cumplen `keep(fila)` se insertan o mueven;
+        las demás se quitan. Con `reset=True` el índice se vacía antes.
+        """
+        inserts = []
+        with self._lock:
+            if reset:
+                self.clear()
+            for row in rows:
+                lat, lon = row.get('customer_latitude'), row.get('customer_longitude')
+                if lat and lon and (keep is None or keep(row)):
+                    inserts.append((row['id'], lat, lon))
+                else:
+                    self._remove(row['id'])
+            for point_id in deleted_ids:
+                self._remove(point_id)
+            if inserts:
+                ids, lats, lons = zip(*inserts)
+                self.insert_many(ids, lats, lons)
+
+    @classmethod
+    def from_store(cls, store, mask=None, cell_size_km=DEFAULT_CELL_SIZE_KM, origin=None):
+        """Índice con las filas de un `DeliveryStore` que tienen coordenadas (y cumplen `mask`)"""
+        select = store.has_coords if mask is None else (mask & store.has_coords)
+        if origin is None:
+            origin = (float(np.mean(store.latitude[select])), float(np.mean(store.longitude[select]))) \
+                if select.any() else (0.0, 0.0)
+        index = cls(cell_size_km, origin)
+        index.insert_many(store.ids[select].tolist(), store.latitude[select], store.longitude[select])
+        return index
+
+
+def nearest_neighbor_lists(lats, lons, k, max_radius_km=None):
+    """Índices de los `k` vecinos más cercanos de cada punto (sin él mismo), del más cercano al más lejano
+
+    Da lo mismo que `geo_distance.nearest_neighbors` sin la matriz n×n: las
+    celdas se dimensionan para ~k puntos y los puntos de una celda se comparan
+    en bloque con los de las celdas a su alrededor. El anillo se duplica sólo
+    para los puntos cuyo k-ésimo vecino podría estar fuera de lo revisado. Con
+    `max_radius_km` la búsqueda se corta en ese radio y las listas pueden
+    quedar más cortas.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    n = len(lats)
+    k = min(k, n - 1)
+    if k <= 0:
+        return [[] for _ in range(n)]
+
+    origin = (float(lats.mean()), float(lons.mean()))
+    x, y = project(lats, lons, origin)
+    cell_size = max(math.sqrt(max(np.ptp(x) * np.ptp(y), 1e-6) * k / n), 0.05)
+    index = GridIndex(cell_size, origin)
+    index.insert_many(range(n), lats, lons)
+
+    result = [None] * n
+    for (i, j), members in list(index._cells.items()):
+        members = np.fromiter(members, dtype=np.int64, count=len(members))
+        ring = 1
+        while len(members):
+            # Celdas i-ring..i+ring × j-ring..j+ring: todo punto a menos de ring celdas queda dentro
+            candidates = np.asarray(index._candidates((i - ring + 0.5) * cell_size, (j - ring + 0.5) * cell_size,
+                                                      (i + ring + 0.5) * cell_size, (j + ring + 0.5) * cell_size),
+                                    dtype=np.int64)
+            exhausted = len(candidates) >= n
+            capped = max_radius_km is not None and ring * cell_size >= max_radius_km
+            found = min(k, len(candidates) - 1)
+            if found < k and not (exhausted or capped):
+                ring *= 2
+                continue
+
+            distances = haversine_matrix(lats[members], lons[members], lats[candidates], lons[candidates])
+            distances[members[:, None] == candidates[None, :]] = np.inf
+            nearest = np.argpartition(distances, found - 1, axis=1)[:, :found] if found > 0 \
+                else np.empty((len(members), 0), dtype=np.int64)
+            nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1, kind='stable')
+            nearest = np.take_along_axis(nearest, order, axis=1)
+            nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+
+            if exhausted or capped:
+                done = np.ones(len(members), dtype=bool)
+            else:
+                done = nearest_distances[:, -1] <= ring * cell_size
+            limit = max_radius_km if capped else math.inf
+            for row in np.flatnonzero(done).tolist():
+                keep = nearest_distances[row] <= limit
+                result[members[row]] = candidates[nearest[row][keep]].tolist()
+            members = members[~done]
+            ring *= 2
+    return result
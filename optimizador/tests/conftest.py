@@ -0,0 +1,31 @@
+# conftest.py
+"""Configuración común de las pruebas: los módulos de optimizador/ se importan sin paquete"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TRUJILLO_CENTER = (-8.1092, -79.0215)
+
+
+@pytest.fixture
+def make_deliveries():
+    """Fábrica de entregas con coordenadas aleatorias alrededor del centro de Trujillo"""
+    def make(n, seed=0, spread=0.05, **fields):
+        rng = random.Random(seed)
+        return [{
+            'id': f"d{k}",
+            'tracking_number': f"TRU{k:05d}",
+            'customer_latitude': TRUJILLO_CENTER[0] + rng.uniform(-spread, spread),
+            'customer_longitude': TRUJILLO_CENTER[1] + rng.uniform(-spread, spread),
+            **fields
+        } for k in range(n)]
+    return make
+
+
+@pytest.fixture
+def depot():
+    return TRUJILLO_CENTER
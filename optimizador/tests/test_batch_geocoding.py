@@ -0,0 +1,165 @@
+# test_batch_geocoding.py
+import asyncio
+import time
+
+import httpx
+
+from batch_geocoding import BatchGeocoder, TokenBucket
+from geocoding import GeocodeCache
+
+BASE_URL = 'http://geocoder.test/json'
+
+# Coordenadas que el proveedor simulado devuelve por dirección (sin el sufijo de Trujillo)
+KNOWN = {
+    'Av. España 1234': (-8.1100, -79.0280),
+    'Jr. Pizarro 567': (-8.1120, -79.0290),
+    'Av. Larco 890': (-8.1250, -79.0400),
+}
+
+DISTRICT_CENTROIDS = {'Víctor Larco Herrera': (-8.1395, -79.0410)}
+
+
+def _street(request):
+    return request.url.params['address'].split(',')[0]
+
+
+def _ok(coords):
+    return httpx.Response(200, json={'status': 'OK', 'results': [
+        {'geometry': {'location': {'lat': coords[0], 'lng': coords[1]}}}]})
+
+
+def _provider(request):
+    coords = KNOWN.get(_street(request))
+    return _ok(coords) if coords else httpx.Response(200, json={'status': 'ZERO_RESULTS', 'results': []})
+
+
+def _geocoder(handler, **options):
+    options.setdefault('backoff_seconds', 0.001)
+    return BatchGeocoder('clave', base_url=BASE_URL, transport=httpx.MockTransport(handler), **options)
+
+
+def test_over_query_limit_backs_off_and_retries():
+    calls = []
+
+    def handler(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return httpx.Response(429)
+        if len(calls) == 2:
+            return httpx.Response(200, json={'status': 'OVER_QUERY_LIMIT', 'results': []})
+        return _provider(request)
+
+    results = _geocoder(handler, backoff_seconds=0.05).geocode_all([{'address': 'Av. España 1234'}])
+
+    assert results == [{'key': None, 'address': 'Av. España 1234', 'coords': KNOWN['Av. España 1234'],
+                        'status': 'OK', 'source': 'google'}]
+    assert len(calls) == 3
+    # Backoff exponencial: 0.05 s y luego 0.1 s como mínimo
+    assert calls[1] - calls[0] >= 0.05
+    assert calls[2] - calls[1] >= 0.1
+
+
+def test_gives_up_after_max_retries_without_caching(tmp_path):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={'status': 'OVER_QUERY_LIMIT', 'results': []})
+
+    cache = GeocodeCache(str(tmp_path / 'geo.db'))
+    results = _geocoder(handler, cache=cache, max_retries=2).geocode_all([{'address': 'Av. España 1234'}])
+
+    assert len(calls) == 3
+    assert results[0]['coords'] is None and results[0]['status'] == 'OVER_QUERY_LIMIT'
+    assert cache.stats()['entries'] == 0
+
+
+def test_unknown_addresses_fall_back_to_the_district_centroid(tmp_path):
+    cache = GeocodeCache(str(tmp_path / 'geo.db'))
+    geocoder = _geocoder(_provider, cache=cache, district_centroids=DISTRICT_CENTROIDS)
+    items = [{'key': 1, 'address': 'Calle Inexistente 1', 'district': 'Víctor Larco Herrera'},
+             {'key': 2, 'address': 'Calle Inexistente 2', 'district': 'Otro'}]
+
+    results = {r['key']: r for r in geocoder.geocode_all(items)}
+
+    assert results[1]['coords'] == DISTRICT_CENTROIDS['Víctor Larco Herrera']
+    assert (results[1]['status'], results[1]['source']) == ('ZERO_RESULTS', 'district')
+    assert results[2]['coords'] is None and results[2]['source'] is None
+
+    # La caché negativa evita volver a consultar y mantiene el respaldo
+    def fail(request):
+        raise AssertionError('no debería consultar al proveedor')
+
+    again = _geocoder(fail, cache=cache, district_centroids=DISTRICT_CENTROIDS).geocode_all(items[:1])
+    assert again[0]['source'] == 'district'
+
+
+def test_cached_addresses_skip_the_provider(tmp_path):
+    cache = GeocodeCache(str(tmp_path / 'geo.db'))
+    _geocoder(_provider, cache=cache).geocode_all([{'address': 'Jr. Pizarro 567'}])
+
+    def fail(request):
+        raise AssertionError('no debería consultar al proveedor')
+
+    results = _geocoder(fail, cache=cache).geocode_all([{'address': 'jr. pizarro 567, Trujillo'}])
+    assert (results[0]['coords'], results[0]['source']) == (KNOWN['Jr. Pizarro 567'], 'cache')
+
+
+def test_token_bucket_paces_after_the_burst():
+    async def take(n):
+        bucket = TokenBucket(rate=20, capacity=2)
+        start = time.monotonic()
+        for _ in range(n):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # Dos de ráfaga y cuatro más a 20 por segundo
+    assert asyncio.run(take(2)) < 0.05
+    assert asyncio.run(take(6)) >= 0.19
+
+
+def test_batch_respects_the_rate_limit():
+    calls = []
+
+    def handler(request):
+        calls.append(time.monotonic())
+        return _provider(request)
+
+    items = [{'key': n, 'address': 'Av. España 1234'} for n in range(8)]
+    results = _geocoder(handler, rate_per_second=5, concurrency=8).geocode_all(items)
+
+    # Cinco de ráfaga y tres más a 5 por segundo, aunque la concurrencia permitiría las ocho a la vez
+    assert len(results) == 8 and len(calls) == 8
+    assert calls[-1] - calls[0] >= 0.55
+
+
+def test_results_stream_as_they_finish():
+    delays = {'Av. España 1234': 0.3, 'Jr. Pizarro 567': 0.0, 'Av. Larco 890': 0.15}
+
+    async def handler(request):
+        await asyncio.sleep(delays[_street(request)])
+        return _provider(request)
+
+    async def collect():
+        geocoder = _geocoder(handler)
+        items = [{'key': address, 'address': address} for address in delays]
+        seen = []
+        async for result in geocoder.stream(items):
+            seen.append((result['key'], time.monotonic()))
+        return seen
+
+    start = time.monotonic()
+    seen = asyncio.run(collect())
+
+    assert [key for key, _ in seen] == ['Jr. Pizarro 567', 'Av. Larco 890', 'Av. España 1234']
+    # El primero llega antes de que termine el más lento
+    assert seen[0][1] - start < 0.2
+
+
+def test_geocode_all_reports_each_result():
+    reported = []
+    items = [{'key': n, 'address': address} for n, address in enumerate(KNOWN)]
+    results = _geocoder(_provider).geocode_all(items, on_result=reported.append)
+
+    assert reported == results
+    assert sorted((r['key'], r['coords']) for r in results) == sorted(enumerate(KNOWN.values()))
@@ -0,0 +1,61 @@
+# test_bulk_import.py
+import io
+
+from bulk_import import import_deliveries, tracking_prefix, validate_row
+from districts import DISTRICT_CENTROIDS
+
+
+class _DuplicateKey(Exception):
+    code = '23505'
+
+
+class _Store:
+    """Tabla deliveries en memoria con tracking_number único"""
+
+    def __init__(self, existing=(), fail_once_with=None):
+        self.trackings = set(existing)
+        self.fail_once_with = fail_once_with
+
+    def get_tracking_numbers(self, prefix):
+        return [t for t in self.trackings if t.startswith(prefix)]
+
+    def insert_deliveries(self, deliveries, batch_size=500):
+        if self.fail_once_with:
+            # Otro proceso inserta el mismo tracking justo antes
+            self.trackings.add(deliveries[0]['tracking_number'])
+            self.fail_once_with = None
+        if any(d['tracking_number'] in self.trackings for d in deliveries):
+            raise _DuplicateKey("duplicate key value violates unique constraint")
+        self.trackings.update(d['tracking_number'] for d in deliveries)
+        return deliveries
+
+
+class _Geocoder:
+    def geocode_all(self, items):
+        return [{'key': item['key'], 'coords': None, 'status': 'ZERO_RESULTS'} for item in items]
+
+
+def _csv(rows):
+    lines = ["cliente,telefono,direccion,latitud,longitud"]
+    lines += [f"Cliente {k},9990000{k:02d},Av. España {k},-8.11,-79.02" for k in range(rows)]
+    return io.StringIO("\n".join(lines))
+
+
+def test_validate_row_rejects_bad_priority():
+    row = {'customer_name': 'Ana', 'customer_phone': '999', 'customer_address': 'Jr. Pizarro 1', 'priority': '9'}
+    delivery, error = validate_row(row, {})
+    assert delivery is None and 'prioridad' in error
+
+
+def test_tracking_numbers_skip_existing_ones():
+    existing = {f"{tracking_prefix()}{k:06d}" for k in range(1000)}
+    sb = _Store(existing)
+    report = import_deliveries(_csv(20), 'entregas.csv', sb, _Geocoder(), DISTRICT_CENTROIDS)
+    assert report['inserted'] == 20 and not report['errors']
+    assert len(sb.trackings) == 1020
+
+
+def test_duplicate_key_retries_the_batch_once():
+    sb = _Store(fail_once_with=True)
+    report = import_deliveries(_csv(5), 'entregas.csv', sb, _Geocoder(), DISTRICT_CENTROIDS)
+    assert report['inserted'] == 5 and not report['errors']
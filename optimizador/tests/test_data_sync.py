@@ -0,0 +1,75 @@
+# test_data_sync.py
+from data_sync import ChangeFeed, DataReplica, TableReplica
+from delivery_store import DeliveryStore
+
+
+class FakeTables:
+    """`fetch_page` sobre tablas en memoria; una columna ausente falla como en PostgREST"""
+
+    def __init__(self, **tables):
+        self.tables = tables
+        self.calls = []
+
+    def fetch_page(self, table, field, since, offset, limit):
+        self.calls.append((table, field, since))
+        rows = self.tables[table]
+        if rows and field not in rows[0]:
+            raise KeyError(f"column {field} does not exist")
+        rows = [r for r in rows if since is None or r[field] >= since]
+        rows.sort(key=lambda r: (r[field], r['id']))
+        return [dict(r) for r in rows[offset:offset + limit]]
+
+
+def _deliveries():
+    return [
+        {'id': 'a', 'status': 'pending', 'created_at': '2026-10-01T10:00:00', 'updated_at': '2026-10-01T10:00:00',
+         'customer_latitude': -8.1, 'customer_longitude': -79.0},
+        {'id': 'b', 'status': 'pending', 'created_at': '2026-10-01T11:00:00', 'updated_at': '2026-10-01T11:00:00',
+         'customer_latitude': -8.2, 'customer_longitude': -79.1},
+    ]
+
+
+def test_delta_sync_sees_updates_through_updated_at():
+    source = FakeTables(deliveries=_deliveries())
+    replica = TableReplica('deliveries', source.fetch_page, page_size=1)
+    replica.sync()
+    assert replica.watermark_field == 'updated_at'
+
+    # Otro proceso cambia el estado: el trigger de migrations/003 mueve updated_at
+    source.tables['deliveries'][0].update(status='delivered', updated_at='2026-10-02T09:00:00')
+    replica.sync(force=True)
+    assert replica.get('a')['status'] == 'delivered'
+    assert source.calls[-1] == ('deliveries', 'updated_at', '2026-10-01T11:00:00')
+    assert replica.watermark == '2026-10-02T09:00:00'
+
+
+def test_falls_back_to_created_at_quietly(capsys):
+    rows = [{k: v for k, v in r.items() if k != 'updated_at'} for r in _deliveries()]
+    source = FakeTables(deliveries=rows)
+    replica = TableReplica('deliveries', source.fetch_page, full_resync_seconds=0)
+    replica.sync()
+    replica.sync()
+    assert replica.watermark_field == 'created_at'
+    assert capsys.readouterr().out == ''
+    # La segunda carga completa ya no prueba updated_at
+    assert [field for _, field, _ in source.calls] == ['updated_at', 'created_at', 'created_at']
+
+
+def test_store_is_the_only_copy_of_deliveries():
+    source = FakeTables(deliveries=_deliveries(), optimized_routes=[])
+    feed = ChangeFeed()
+    replica = DataReplica(source.fetch_page, ('deliveries', 'optimized_routes'), feed=feed,
+                          storages={'deliveries': lambda rows, version: DeliveryStore(rows, version=version)})
+    store = replica.store('deliveries')
+    assert isinstance(store, DeliveryStore) and store.version == replica.tables['deliveries'].version
+
+    seen = []
+    replica.listen('deliveries', lambda rows, deleted_ids, reset: seen.append((rows, deleted_ids, reset)))
+    feed.publish('deliveries', [{'id': 'b', 'status': 'assigned'}], deleted_ids=['a'])
+    updated = replica.store('deliveries')
+    assert updated.ids.tolist() == ['b'] and updated.row('b')['status'] == 'assigned'
+    assert updated.row('b')['customer_latitude'] == -8.2
+    # La versión anterior no cambia
+    assert store.row('b')['status'] == 'pending' and len(store) == 2
+    assert seen[-1][1:] == (['a'], False) and seen[-1][0][0]['status'] == 'assigned'
+    assert replica.stats()['deliveries']['rows'] == 1
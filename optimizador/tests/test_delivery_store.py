@@ -0,0 +1,97 @@
+# test_delivery_store.py
+from datetime import datetime
+
+import numpy as np
+
+from delivery_store import ROW_FIELDS, DeliveryStore
+from districts import DISTRICT_CENTROIDS, fold_text
+
+
+def _rows():
+    return [
+        {'id': 'a', 'status': 'pending', 'priority': 1, 'package_weight': 2.5, 'customer_latitude': -8.11,
+         'customer_longitude': -79.02, 'customer_address': 'Jr. Pizarro 100', 'tracking_number': 'TRU1',
+         'customer_name': 'Ana', 'created_at': '2026-10-01T10:00:00', 'district': 'Trujillo Centro',
+         'customer_email': 'ana@example.com', 'package_description': 'Caja'},
+        {'id': 'b', 'status': 'delivered', 'priority': None, 'package_weight': None, 'customer_latitude': None,
+         'customer_longitude': None, 'customer_address': 'Av. Larco 500, Víctor Larco', 'tracking_number': 'TRU2',
+         'customer_name': 'Beto', 'created_at': '2026-10-02T10:00:00+00:00'},
+    ]
+
+
+def test_rows_are_rebuilt_from_columns():
+    rows = _rows()
+    store = DeliveryStore(rows, DISTRICT_CENTROIDS)
+    built = store.rows()
+    assert [r['id'] for r in built] == ['a', 'b']
+    assert set(built[0]) == set(ROW_FIELDS)
+    assert 'customer_email' not in built[0]
+    assert abs(built[0]['customer_latitude'] - -8.11) < 1e-5
+    assert built[1]['customer_latitude'] is None
+    assert built[0]['status'] == 'pending' and built[1]['priority'] == 3
+    # No se entregan los dicts de la réplica
+    built[0]['status'] = 'failed'
+    assert rows[0]['status'] == 'pending'
+    assert store.row('a')['status'] == 'pending'
+    assert store.row('zz') is None
+
+
+def test_masks_and_district_from_address():
+    store = DeliveryStore(_rows(), ['Trujillo Centro', 'Victor Larco'])
+    assert store.mask(status='pending').tolist() == [True, False]
+    assert store.mask(has_coords=True).tolist() == [True, False]
+    assert store.mask(since=datetime(2026, 10, 2)).tolist() == [False, True]
+    assert list(store.district) == ['Trujillo Centro', 'Victor Larco']
+    assert store.positions(['b', 'x']).tolist() == [1, -1]
+
+
+def test_empty_store():
+    store = DeliveryStore([])
+    assert len(store) == 0 and store.rows() == []
+    assert store.positions(['a']).tolist() == [-1]
+    assert np.array_equal(store.mask(), np.array([], dtype=bool))
+
+
+def test_fold_text():
+    assert fold_text('  Víctor LARCO ') == 'victor larco'
+
+
+def test_missing_status_and_district_are_none():
+    store = DeliveryStore([{'id': 'x', 'status': None}])
+    row = store.rows()[0]
+    assert row['status'] is None and row['district'] is None
+
+
+def test_coordinates_keep_float64_precision():
+    store = DeliveryStore([{'id': 'a', 'customer_latitude': -8.1092345678, 'customer_longitude': -79.0215123456}])
+    row = store.rows()[0]
+    assert row['customer_latitude'] == -8.1092345678
+    assert row['customer_longitude'] == -79.0215123456
+    assert store.coordinates().dtype == np.float64
+
+
+def test_merged_returns_new_version():
+    store = DeliveryStore(_rows(), DISTRICT_CENTROIDS, version=1)
+    merged = store.merged([{'id': 'b', 'status': 'assigned', 'customer_latitude': -8.12,
+                            'customer_longitude': -79.03},
+                           {'id': 'c', 'status': 'pending', 'customer_name': 'Caro'}],
+                          deleted_ids=['a'], version=2)
+    assert merged.version == 2
+    assert merged.ids.tolist() == ['b', 'c']
+    b = merged.row('b')
+    # Los campos que no vienen en la fila parcial se conservan
+    assert b['status'] == 'assigned' and b['tracking_number'] == 'TRU2' and b['customer_latitude'] == -8.12
+    assert merged.row('c')['customer_name'] == 'Caro' and merged.row('c')['priority'] == 3
+    assert merged.mask(status='pending').tolist() == [False, True]
+    assert merged.has_coords.tolist() == [True, False]
+    assert store.ids.tolist() == ['a', 'b'] and store.row('b')['status'] == 'delivered'
+
+
+def test_merged_with_new_categories():
+    store = DeliveryStore(_rows(), ['Trujillo Centro'])
+    merged = store.merged([{'id': 'a', 'status': 'returned', 'district': 'Huanchaco'}])
+    assert merged.row('a')['status'] == 'returned' and merged.row('a')['district'] == 'Huanchaco'
+    assert list(merged.status.categories[:6]) == ['pending', 'assigned', 'in_transit', 'delivered', 'failed',
+                                                  'cancelled']
+    assert merged.mask(district='Huanchaco').tolist() == [True, False]
+    assert merged.row('b')['status'] == 'delivered'
@@ -0,0 +1,56 @@
+# test_fetch_timings.py
+"""show_fetch_timings se extrae de app2.py y se ejecuta con un `st` mínimo (Streamlit no hace falta)"""
+import ast
+import os
+
+
+class FakeStreamlit:
+    def __init__(self, secrets=None):
+        self.secrets = secrets or {}
+        self.calls = []
+
+    def __getattr__(self, name):
+        def record(*args, **kwargs):
+            self.calls.append(name)
+        return record
+
+
+def load_show_fetch_timings(st):
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app2.py')
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    node = next(n for n in tree.body if isinstance(n, ast.FunctionDef) and n.name == 'show_fetch_timings')
+    namespace = {'st': st}
+    exec(compile(ast.Module(body=[node], type_ignores=[]), path, 'exec'), namespace)
+    return namespace['show_fetch_timings']
+
+
+def _timing(error=None, timed_out=False):
+    return {'ms': 12.0, 'error': error, 'timed_out': timed_out}
+
+
+def test_returns_true_when_required_data_loaded():
+    st = FakeStreamlit()
+    show_fetch_timings = load_show_fetch_timings(st)
+    assert show_fetch_timings({'store': _timing(), 'drivers': _timing()}, required=('store', 'drivers')) is True
+    assert st.calls == []
+
+
+def test_optional_failure_only_warns():
+    st = FakeStreamlit()
+    show_fetch_timings = load_show_fetch_timings(st)
+    assert show_fetch_timings({'store': _timing(), 'vehicles': _timing('boom')}, required=('store',)) is True
+    assert st.calls == ['warning']
+
+
+def test_returns_false_and_shows_loading_on_timeout():
+    st = FakeStreamlit()
+    show_fetch_timings = load_show_fetch_timings(st)
+    assert show_fetch_timings({'store': _timing('timeout', timed_out=True)}, required=('store',)) is False
+    assert st.calls == ['info', 'button']
+
+
+def test_timings_caption_behind_flag():
+    st = FakeStreamlit({'SHOW_FETCH_TIMINGS': True})
+    assert load_show_fetch_timings(st)({'store': _timing()}, required=('store',)) is True
+    assert st.calls == ['caption']
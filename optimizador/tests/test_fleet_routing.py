@@ -0,0 +1,36 @@
+# test_fleet_routing.py
+from fleet_routing import solve_fleet
+
+
+def _assigned_ids(result):
+    return sorted(d['id'] for route in result['routes'] for d in route['stops'])
+
+
+def test_vehicles_without_capacity_share_the_stops(make_deliveries, depot):
+    deliveries = make_deliveries(200)
+    vehicles = [{'id': f"v{k}", 'license_plate': f"T{k}"} for k in range(5)]
+    result = solve_fleet(deliveries, vehicles, depot, time_limit=2)
+    sizes = [len(route['stops']) for route in result['routes']]
+    assert len(sizes) == 5
+    assert min(sizes) >= 20
+    assert _assigned_ids(result) == sorted(d['id'] for d in deliveries)
+
+
+def test_capacity_is_respected(make_deliveries, depot):
+    deliveries = make_deliveries(60, package_weight=2)
+    vehicles = [{'id': 'v1', 'capacity_kg': 50}, {'id': 'v2', 'capacity_kg': 40}]
+    result = solve_fleet(deliveries, vehicles, depot, time_limit=2)
+    for route in result['routes']:
+        assert route['load_kg'] <= route['capacity_kg']
+    # 90 kg de capacidad para 120 kg de paquetes
+    assert len(result['unassigned']) == 15
+    assert len(_assigned_ids(result)) + len(result['unassigned']) == 60
+
+
+def test_mixed_registered_and_missing_capacity(make_deliveries, depot):
+    deliveries = make_deliveries(100)
+    vehicles = [{'id': 'v1', 'capacity_kg': 30}, {'id': 'v2'}]
+    result = solve_fleet(deliveries, vehicles, depot, time_limit=2)
+    loads = {route['vehicle']['id']: route['load_kg'] for route in result['routes']}
+    assert loads['v1'] <= 30
+    assert not result['unassigned']
@@ -0,0 +1,41 @@
+# test_geo_distance.py
+import numpy as np
+
+from geo_distance import haversine_km, haversine_matrix, project, unproject
+
+
+def test_matrix_matches_pairwise_haversine(make_deliveries):
+    lats = np.array([d['customer_latitude'] for d in make_deliveries(30)])
+    lons = np.array([d['customer_longitude'] for d in make_deliveries(30)])
+    matrix = haversine_matrix(lats, lons, block_size=7)
+    assert np.allclose(matrix, haversine_km(lats[:, None], lons[:, None], lats[None, :], lons[None, :]))
+    assert np.allclose(np.diag(matrix), 0.0)
+
+
+def test_projection_round_trip_and_scale(depot):
+    lats = np.array([depot[0], depot[0] + 0.05])
+    lons = np.array([depot[1], depot[1] + 0.05])
+    x, y = project(lats, lons, depot)
+    assert np.allclose(unproject(x, y, depot), (lats, lons))
+    # A escala de ciudad el plano local coincide con haversine
+    planar = np.hypot(x[1] - x[0], y[1] - y[0])
+    assert abs(planar - haversine_km(lats[0], lons[0], lats[1], lons[1])) < 0.01
+
+
+def test_km_per_pixel_halves_per_zoom_level():
+    from geo_distance import km_per_pixel
+
+    assert abs(km_per_pixel(0, 0.0) - 156.54303392) < 1e-9
+    assert abs(km_per_pixel(13, -8.1) * 2 - km_per_pixel(12, -8.1)) < 1e-12
+
+
+def test_viewport_bounds_cover_the_map_size():
+    from geo_distance import km_per_pixel, viewport_bounds
+
+    center = (-8.1092, -79.0215)
+    min_lat, min_lon, max_lat, max_lon = viewport_bounds(center, 16, 600, 400)
+    assert min_lat < center[0] < max_lat and min_lon < center[1] < max_lon
+    width = haversine_km(center[0], min_lon, center[0], max_lon)
+    height = haversine_km(min_lat, center[1], max_lat, center[1])
+    assert np.isclose(width, 600 * km_per_pixel(16, center[0]), rtol=1e-3)
+    assert np.isclose(height, 400 * km_per_pixel(16, center[0]), rtol=1e-3)
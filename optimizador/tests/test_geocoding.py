@@ -0,0 +1,144 @@
+# test_geocoding.py
+import pytest
+
+import geocoding
+from geocoding import GeocodeCache, GeocodingService, build_query, normalize_address
+
+DAY = 24 * 3600
+
+
+class FakeClock:
+    """Reemplaza el módulo `time` de geocoding para mover el reloj a voluntad"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(geocoding, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'geocode.db')
+
+
+def test_normalize_folds_accents_case_and_spacing():
+    assert normalize_address('Av.  España   1234') == 'av espana 1234'
+    assert normalize_address('JR. PIZARRO 567') == normalize_address('jr. pizarro 567')
+    assert normalize_address('Calle Los Álamos #12') == 'calle los alamos #12'
+
+
+def test_normalize_drops_city_region_and_country_suffixes():
+    base = normalize_address('Av. España 1234')
+    assert normalize_address('Av. España 1234, Trujillo') == base
+    assert normalize_address('Av. España 1234, Trujillo, La Libertad, Perú') == base
+    assert normalize_address('av españa 1234 , TRUJILLO , la libertad , peru ,') == base
+    # Sólo se quitan al final: el distrito sigue distinguiendo direcciones
+    assert normalize_address('Av. España 1234, Víctor Larco') == 'av espana 1234, victor larco'
+    assert normalize_address(None) == ''
+
+
+def test_build_query_adds_the_city_only_when_missing():
+    assert build_query('Av. España 1234') == 'Av. España 1234, Trujillo, La Libertad, Perú'
+    assert build_query('Av. España 1234, Trujillo') == 'Av. España 1234, Trujillo'
+
+
+def test_entries_expire_after_their_ttl(clock, cache_path):
+    cache = GeocodeCache(cache_path, ttl_seconds=10 * DAY)
+    cache.set('av espana 1234', (-8.11, -79.028))
+
+    clock.advance(10 * DAY)
+    assert cache.get('av espana 1234') == (True, (-8.11, -79.028))
+    clock.advance(1)
+    assert cache.get('av espana 1234') is None
+    # La entrada vencida se borra
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'entries': 0}
+
+
+def test_negative_entries_use_their_own_shorter_ttl(clock, cache_path):
+    cache = GeocodeCache(cache_path, ttl_seconds=90 * DAY, negative_ttl_seconds=DAY)
+    cache.set('calle inexistente', None)
+    cache.set('av espana 1234', (-8.11, -79.028))
+
+    assert cache.get('calle inexistente') == (False, None)
+    clock.advance(DAY + 1)
+    assert cache.get('calle inexistente') is None
+    assert cache.get('av espana 1234') == (True, (-8.11, -79.028))
+
+
+def test_lru_eviction_keeps_recently_used_entries(clock, cache_path):
+    cache = GeocodeCache(cache_path, max_entries=10)
+    for n in range(10):
+        cache.set(f'calle {n}', (-8.0, -79.0 - n / 100))
+        clock.advance(1)
+    # Leer las tres más antiguas las vuelve las más recientes
+    for n in range(3):
+        assert cache.get(f'calle {n}') is not None
+        clock.advance(1)
+
+    cache.set('calle 10', (-8.0, -79.1))
+
+    # 11 > 10: se desaloja el exceso más un 10%, los dos menos usados
+    assert cache.stats()['entries'] == 9
+    assert cache.get('calle 3') is None and cache.get('calle 4') is None
+    assert all(cache.get(f'calle {n}') is not None for n in (0, 1, 2, 5, 10))
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def _google(monkeypatch, statuses):
+    """Simula requests.get devolviendo en orden los estados dados; devuelve las direcciones consultadas"""
+    queried = []
+
+    def get(url, params=None, headers=None, timeout=None):
+        queried.append(params['address'])
+        status = statuses[min(len(queried), len(statuses)) - 1]
+        if status == 'OK':
+            location = {'lat': -8.11, 'lng': -79.03}
+            return FakeResponse({'status': 'OK', 'results': [{'geometry': {'location': location}}]})
+        return FakeResponse({'status': status, 'results': []})
+
+    monkeypatch.setattr(geocoding.requests, 'get', get)
+    return queried
+
+
+def test_service_caches_misses_and_serves_them_without_calling_google(monkeypatch, cache_path):
+    queried = _google(monkeypatch, ['ZERO_RESULTS'])
+    service = GeocodingService('clave', cache=GeocodeCache(cache_path))
+
+    first = service.lookup('Calle Inexistente 9, Trujillo')
+    assert first == {'coords': None, 'status': 'ZERO_RESULTS', 'cached': False}
+    # Se reintentó con sólo la calle antes de registrar el fallo
+    assert queried == ['Calle Inexistente 9, Trujillo', 'Calle Inexistente 9, Trujillo, La Libertad, Perú']
+
+    second = service.lookup('calle inexistente 9')
+    assert second == {'coords': None, 'status': 'ZERO_RESULTS', 'cached': True}
+    assert len(queried) == 2
+
+
+def test_service_never_caches_transient_errors(monkeypatch, cache_path):
+    queried = _google(monkeypatch, ['OVER_QUERY_LIMIT', 'OK'])
+    cache = GeocodeCache(cache_path)
+    service = GeocodingService('clave', cache=cache)
+
+    assert service.lookup('Av. España 1234')['status'] == 'OVER_QUERY_LIMIT'
+    assert cache.stats()['entries'] == 0
+    assert service.lookup('Av. España 1234') == {'coords': (-8.11, -79.03), 'status': 'OK', 'cached': False}
+    assert service.lookup('AV. ESPAÑA 1234, Perú')['cached'] is True
+    assert len(queried) == 2
@@ -0,0 +1,126 @@
+# test_ingest_log.py
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from ingest_log import IngestLog, correlation_id, idempotency_key
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / 'events.db')
+
+
+def test_retries_with_the_same_key_are_stored_once(log_path):
+    log = IngestLog(log_path)
+    first = log.append({'pedido': 1}, key='exec-1')
+    retry = log.append({'pedido': 1, 'reintento': True}, key='exec-1')
+    other = log.append({'pedido': 2}, key='exec-2')
+
+    assert first == {'seq': first['seq'], 'duplicate': False}
+    assert retry == {'seq': first['seq'], 'duplicate': True}
+    assert other['seq'] > first['seq'] and not other['duplicate']
+    events, _ = log.read()
+    assert [event['payload'] for event in events] == [{'pedido': 1}, {'pedido': 2}]
+    assert log.stats()['duplicates'] == 1
+    log.close()
+
+
+def test_events_without_key_are_never_deduplicated(log_path):
+    log = IngestLog(log_path)
+    assert log.append({'pedido': 1})['seq'] != log.append({'pedido': 1})['seq']
+    log.close()
+
+
+def test_keys_come_from_headers_before_the_payload():
+    assert idempotency_key({'Idempotency-Key': 'h'}, {'execution_id': 'p'}) == 'h'
+    assert idempotency_key({}, {'executionId': 42}) == '42'
+    assert idempotency_key({}, ['sin', 'clave']) is None
+    assert correlation_id({'X-Correlation-Id': 'job-h'}, {'job_id': 'job-p'}) == 'job-h'
+    assert correlation_id({}, {'correlation_id': 'job-p'}) == 'job-p'
+
+
+def test_cursor_reads_only_what_is_new(log_path):
+    log = IngestLog(log_path)
+    for n in range(5):
+        log.append({'n': n})
+
+    events, cursor = log.read(limit=2)
+    assert [event['payload']['n'] for event in events] == [0, 1]
+    events, cursor = log.read(cursor, limit=2)
+    assert [event['payload']['n'] for event in events] == [2, 3]
+    events, cursor = log.read(cursor)
+    assert [event['payload']['n'] for event in events] == [4]
+
+    # Sin nada nuevo el cursor no se mueve
+    assert log.read(cursor) == ([], cursor)
+    log.append({'n': 5})
+    events, _ = log.read(cursor)
+    assert [event['payload']['n'] for event in events] == [5]
+    log.close()
+
+
+def test_reads_filter_by_topic_and_correlation(log_path):
+    log = IngestLog(log_path)
+    log.append({'n': 0}, topic='a', correlation_id='job-1')
+    log.append({'n': 1}, topic='b', correlation_id='job-2')
+    log.append({'n': 2}, topic='a', correlation_id='job-2')
+
+    assert [e['payload']['n'] for e in log.read(topic='a')[0]] == [0, 2]
+    assert [e['payload']['n'] for e in log.read(correlation_id='job-2')[0]] == [1, 2]
+    assert [e['payload']['n'] for e in log.read(topic='a', correlation_id='job-2')[0]] == [2]
+    log.close()
+
+
+def test_only_authenticated_events_when_asked(log_path):
+    log = IngestLog(log_path)
+    log.append({'route': {'id': 'falsa'}}, correlation_id='job-1')
+    log.append({'route': {'id': 'real'}}, correlation_id='job-1', authenticated=True)
+
+    events, _ = log.read(correlation_id='job-1', authenticated=True)
+    assert [event['payload']['route']['id'] for event in events] == ['real']
+    assert [event['authenticated'] for event in log.read()[0]] == [False, True]
+    log.close()
+
+
+def test_wait_wakes_up_on_a_new_event(log_path):
+    log = IngestLog(log_path)
+    timer = threading.Timer(0.1, log.append, args=({'n': 1},), kwargs={'authenticated': True})
+    timer.start()
+    start = time.time()
+    events, cursor = log.wait(0, timeout=5, authenticated=True)
+    timer.join()
+
+    assert [event['payload'] for event in events] == [{'n': 1}]
+    assert cursor == events[0]['seq']
+    assert time.time() - start < 2
+    assert log.wait(cursor, timeout=0.1) == ([], cursor)
+    log.close()
+
+
+def test_events_and_keys_survive_a_restart(log_path):
+    log = IngestLog(log_path)
+    first = log.append({'n': 0}, key='exec-1')
+    log.close()
+
+    log = IngestLog(log_path)
+    assert log.last_seq() == first['seq']
+    assert log.append({'n': 0}, key='exec-1') == {'seq': first['seq'], 'duplicate': True}
+    assert [event['payload'] for event in log.read()[0]] == [{'n': 0}]
+    log.close()
+
+
+def test_old_logs_gain_the_authenticated_column(log_path):
+    conn = sqlite3.connect(log_path)
+    conn.execute("CREATE TABLE events (seq INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, "
+                 "idempotency_key TEXT UNIQUE, payload TEXT NOT NULL, received_at REAL NOT NULL)")
+    conn.execute("INSERT INTO events (topic, payload, received_at) VALUES ('n8n', '{\"route\": {}}', 0)")
+    conn.commit()
+    conn.close()
+
+    log = IngestLog(log_path)
+    assert [event['authenticated'] for event in log.read()[0]] == [False]
+    assert log.read(authenticated=True)[0] == []
+    log.close()
@@ -0,0 +1,93 @@
+# test_job_queue.py
+import sqlite3
+import time
+
+import pytest
+
+import job_queue
+from job_queue import JobQueue
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / 'jobs.db')
+
+
+def _route_params(make_deliveries, depot, n=8):
+    return {'deliveries': make_deliveries(n), 'depot': list(depot)}
+
+
+def test_claims_by_priority_then_age(queue_path, make_deliveries, depot):
+    queue = JobQueue(queue_path, workers=0)
+    params = _route_params(make_deliveries, depot)
+    low = queue.submit('route', params, priority=5)
+    first_urgent = queue.submit('route', params, priority=1)
+    second_urgent = queue.submit('route', params, priority=1)
+    normal = queue.submit('route', params)
+
+    assert [queue.status(j)['position'] for j in (first_urgent, second_urgent, normal, low)] == [1, 2, 3, 4]
+    assert [queue._claim()[0] for _ in range(4)] == [first_urgent, second_urgent, normal, low]
+    assert queue._claim() is None
+    queue.close()
+
+
+def test_unknown_kind_is_rejected(queue_path):
+    queue = JobQueue(queue_path, workers=0)
+    with pytest.raises(ValueError):
+        queue.submit('nope', {})
+    queue.close()
+
+
+def test_jobs_survive_a_restart(queue_path, make_deliveries, depot):
+    queue = JobQueue(queue_path, workers=0)
+    job_id = queue.submit('route', _route_params(make_deliveries, depot), owner='ana')
+    queue.close()
+
+    # Otro proceso (o la app reiniciada) encuentra el trabajo y lo ejecuta
+    queue = JobQueue(queue_path, workers=1)
+    assert [job['id'] for job in queue.list_jobs('ana')] == [job_id]
+    status = queue.wait(job_id, timeout=60)
+    assert status['status'] == 'done'
+    assert sorted(queue.result(job_id)['order']) == list(range(8))
+    queue.close()
+
+
+def test_cancel_queued_and_running(queue_path, make_deliveries, depot):
+    queue = JobQueue(queue_path, workers=1)
+    # Un cálculo largo ocupa el único hilo; el segundo queda en cola
+    running = queue.submit('route_parallel', {**_route_params(make_deliveries, depot, n=200), 'time_budget': 60,
+                                              'workers': 1, 'starts': 1})
+    queued = queue.submit('route', _route_params(make_deliveries, depot), priority=5)
+
+    assert queue.cancel(queued)
+    assert queue.status(queued)['status'] == 'cancelled'
+
+    deadline = time.time() + 30
+    while queue.status(running)['status'] != 'running' and time.time() < deadline:
+        time.sleep(0.1)
+    started = time.time()
+    assert queue.cancel(running)
+    assert queue.wait(running, timeout=20)['status'] == 'cancelled'
+    assert time.time() - started < 10
+    assert not queue.cancel(running)
+    queue.close()
+
+
+def test_stale_running_jobs_are_requeued(queue_path, make_deliveries, depot, monkeypatch):
+    queue = JobQueue(queue_path, workers=0)
+    job_id = queue.submit('route', _route_params(make_deliveries, depot))
+    assert queue._claim()[0] == job_id
+
+    # El proceso que lo tomó murió: su último latido es viejo
+    with sqlite3.connect(queue_path) as conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?",
+                     (time.time() - job_queue.STALE_AFTER_SECONDS - 1, job_id))
+    queue._requeue_stale()
+    status = queue.status(job_id)
+    assert status['status'] == 'queued' and status['started_at'] is None
+    assert queue._claim()[0] == job_id
+    queue.close()
+
+
+def test_solver_child_is_spawned():
+    assert job_queue._SOLVER_CONTEXT.get_start_method() == 'spawn'
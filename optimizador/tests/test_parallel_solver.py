@@ -0,0 +1,54 @@
+# test_parallel_solver.py
+from parallel_solver import solve_route_parallel
+from route_solver import solve_route
+
+
+def test_deterministic_with_fixed_seed(make_deliveries, depot):
+    deliveries = make_deliveries(40, seed=7)
+    first = solve_route_parallel(deliveries, depot, workers=2, starts=4, seed=11, deterministic=True)
+    second = solve_route_parallel(deliveries, depot, workers=2, starts=4, seed=11, deterministic=True)
+    assert first['order'] == second['order']
+    assert first['best_start'] == second['best_start']
+    assert first['starts_completed'] == 4
+
+
+def test_visits_every_stop_and_matches_single_start(make_deliveries, depot):
+    deliveries = make_deliveries(40, seed=8)
+    result = solve_route_parallel(deliveries, depot, workers=2, starts=4, deterministic=True)
+    assert sorted(result['order']) == list(range(40))
+    # El portafolio incluye el arranque de solve_route, más perturbaciones que sólo aceptan mejoras
+    assert result['total_distance_km'] <= solve_route(deliveries, depot)['total_distance_km'] + 0.01
+
+
+def test_start_after_deadline_returns_construction(make_deliveries, depot, monkeypatch):
+    import time
+
+    import parallel_solver
+    from route_solver import nearest_neighbor_tour, route_distances, route_points, tour_length
+
+    _, points = route_points(make_deliveries(60, seed=9), depot)
+    dist, _ = route_distances(points)
+    monkeypatch.setitem(parallel_solver._worker_state, 'dist', dist)
+    length, tour = parallel_solver._search(parallel_solver.PORTFOLIO[0], seed=1, deadline=time.time() - 1,
+                                           max_kicks=None)
+    assert tour == nearest_neighbor_tour(dist).tolist()
+    assert length == tour_length(nearest_neighbor_tour(dist), dist)
+
+
+def test_zero_time_limit_is_a_limit(make_deliveries, depot, monkeypatch):
+    import route_solver
+
+    calls = []
+    original = route_solver.two_opt
+
+    def counting_two_opt(tour, dist, deadline=None):
+        calls.append(deadline)
+        return original(tour, dist, deadline)
+
+    monkeypatch.setitem(route_solver.NEIGHBORHOODS, 'two_opt',
+                        lambda tour, dist, deadline: counting_two_opt(tour, dist, deadline))
+    _, points = route_solver.route_points(make_deliveries(80, seed=2), depot)
+    dist, _ = route_solver.route_distances(points)
+    route_solver.improve_tour(route_solver.nearest_neighbor_tour(dist), dist, time_limit=0.0)
+    # Con plazo vencido: una sola pasada y con deadline, nunca sin límite
+    assert len(calls) == 1 and calls[0] is not None
@@ -0,0 +1,41 @@
+# test_query_cache.py
+import time
+
+from query_cache import QueryCache
+
+
+def test_hit_returns_copy_and_counts():
+    cache = QueryCache()
+    value = cache.get_or_load(['deliveries'], 'all', lambda: [{'id': 1}])
+    value[0]['id'] = 99
+    assert cache.get_or_load(['deliveries'], 'all', lambda: []) == [{'id': 1}]
+    assert cache.stats()['hits'] == 1
+
+
+def test_write_invalidates_dependent_entries():
+    cache = QueryCache()
+    cache.get_or_load(['deliveries'], 'a', lambda: 1)
+    cache.get_or_load(['vehicles'], 'b', lambda: 2)
+    cache.invalidate('deliveries')
+    assert cache.get_or_load(['deliveries'], 'a', lambda: 3) == 3
+    assert cache.get_or_load(['vehicles'], 'b', lambda: 4) == 2
+
+
+def test_size_is_bounded_least_recently_used_first():
+    cache = QueryCache(max_entries=3)
+    for k in range(3):
+        cache.get_or_load(['deliveries'], k, lambda k=k: k)
+    cache.get_or_load(['deliveries'], 0, lambda: 'recargado')  # 0 pasa a ser la más reciente
+    cache.get_or_load(['deliveries'], 3, lambda: 3)
+    assert cache.stats()['entries'] == 3
+    assert cache.get_or_load(['deliveries'], 1, lambda: 'recargado') == 'recargado'
+    assert cache.get_or_load(['deliveries'], 0, lambda: 'recargado') == 0
+
+
+def test_expired_entries_are_dropped():
+    cache = QueryCache(table_ttls={'deliveries': 0.01})
+    cache.get_or_load(['deliveries'], 'a', lambda: 1)
+    time.sleep(0.02)
+    assert cache.get_or_load(['deliveries'], 'b', lambda: 2) == 2
+    assert cache.get_or_load(['deliveries'], 'a', lambda: 3) == 3
+    assert cache.stats()['entries'] == 2
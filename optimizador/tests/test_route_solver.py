@@ -0,0 +1,48 @@
+# test_route_solver.py
+import numpy as np
+
+from route_solver import (improve_tour, nearest_neighbor_tour, route_distances, route_points, solve_route,
+                          tour_length)
+
+
+def test_every_stop_visited_once(make_deliveries, depot):
+    deliveries = make_deliveries(60)
+    result = solve_route(deliveries, depot, time_limit=2)
+    assert sorted(result['order']) == list(range(60))
+    assert [d['id'] for d in result['stops']] == [deliveries[k]['id'] for k in result['order']]
+    # Sale y vuelve al depósito
+    assert tuple(result['coordinates'][0]) == tuple(depot)
+    assert tuple(result['coordinates'][-1]) == tuple(depot)
+
+
+def test_improvement_never_longer_than_nearest_neighbor(make_deliveries, depot):
+    for seed in range(5):
+        _, points = route_points(make_deliveries(40, seed=seed), depot)
+        dist, _ = route_distances(points)
+        initial = nearest_neighbor_tour(dist)
+        improved = improve_tour(initial, dist)
+        assert sorted(improved) == list(range(len(points)))
+        assert tour_length(improved, dist) <= tour_length(initial, dist) + 1e-9
+
+
+def test_deterministic_without_time_limit(make_deliveries, depot):
+    deliveries = make_deliveries(50, seed=3)
+    first = solve_route(deliveries, depot)
+    second = solve_route(deliveries, depot)
+    assert first['order'] == second['order']
+    assert first['total_distance_km'] == second['total_distance_km']
+
+
+def test_deliveries_without_coordinates_are_skipped(make_deliveries, depot):
+    deliveries = make_deliveries(5)
+    deliveries[2]['customer_latitude'] = None
+    result = solve_route(deliveries, depot)
+    assert sorted(result['order']) == [0, 1, 3, 4]
+
+
+def test_open_route_does_not_return_to_depot(make_deliveries, depot):
+    result = solve_route(make_deliveries(20), depot, return_to_depot=False)
+    assert len(result['coordinates']) == 21
+    closed = solve_route(make_deliveries(20), depot)
+    assert result['total_distance_km'] <= closed['total_distance_km']
+    assert np.isfinite(result['total_distance_km'])
@@ -0,0 +1,46 @@
+# test_spatial_index.py
+import numpy as np
+
+from geo_distance import haversine_km, nearest_neighbors
+from spatial_index import GridIndex, nearest_neighbor_lists
+
+
+def _coordinates(make_deliveries, n, **options):
+    deliveries = make_deliveries(n, **options)
+    return (np.array([d['customer_latitude'] for d in deliveries]),
+            np.array([d['customer_longitude'] for d in deliveries]))
+
+
+def test_neighbor_lists_match_the_dense_search(make_deliveries):
+    lats, lons = _coordinates(make_deliveries, 400)
+    # Un barrio denso y otro disperso dentro de la misma grilla
+    lats[:100] = lats[:100] * 0.01 + lats.mean() * 0.99
+    assert nearest_neighbor_lists(lats, lons, 12) == nearest_neighbors(lats, lons, 12).tolist()
+
+
+def test_neighbor_lists_on_tiny_inputs():
+    assert nearest_neighbor_lists([], [], 12) == []
+    assert nearest_neighbor_lists([-8.1], [-79.0], 12) == [[]]
+    assert nearest_neighbor_lists([-8.1, -8.2, -8.14], [-79.0, -79.0, -79.0], 12) == [[2, 1], [2, 0], [0, 1]]
+
+
+def test_neighbor_lists_stop_at_the_radius(make_deliveries):
+    lats, lons = _coordinates(make_deliveries, 200)
+    for stop, others in enumerate(nearest_neighbor_lists(lats, lons, 12, max_radius_km=0.5)):
+        assert len(others) <= 12 and stop not in others
+        assert (haversine_km(lats[stop], lons[stop], lats[others], lons[others]) <= 0.5).all()
+
+
+def test_in_bbox_and_radius_queries(make_deliveries):
+    lats, lons = _coordinates(make_deliveries, 300)
+    index = GridIndex(origin=(float(lats.mean()), float(lons.mean())))
+    index.insert_many(range(300), lats, lons)
+
+    box = (-8.12, -79.03, -8.10, -79.01)
+    inside = (lats >= box[0]) & (lats <= box[2]) & (lons >= box[1]) & (lons <= box[3])
+    assert sorted(index.in_bbox(*box)) == np.flatnonzero(inside).tolist()
+
+    distances = haversine_km(lats[0], lons[0], lats, lons)
+    found = index.within_radius(lats[0], lons[0], 1.0)
+    assert [p for p, _ in found] == np.flatnonzero(distances <= 1.0)[np.argsort(distances[distances <= 1.0],
+                                                                               kind='stable')].tolist()
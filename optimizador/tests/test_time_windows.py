@@ -0,0 +1,54 @@
+# test_time_windows.py
+from time_windows import format_clock, parse_clock, solve_fleet_time_windows
+
+
+def test_clock_round_trip():
+    assert parse_clock('09:30') == 570
+    assert parse_clock('09:30:00') == 570
+    assert parse_clock(None, 480) == 480
+    assert format_clock(570) == '09:30'
+
+
+def test_arrivals_respect_windows(make_deliveries, depot):
+    deliveries = make_deliveries(30, spread=0.03)
+    for k, delivery in enumerate(deliveries):
+        if k % 2:
+            delivery['time_window_start'] = '10:00'
+            delivery['time_window_end'] = '12:00'
+    vehicles = [{'id': 'v1'}, {'id': 'v2'}]
+    result = solve_fleet_time_windows(deliveries, vehicles, depot, time_limit=2)
+
+    served = 0
+    for route in result['routes']:
+        for stop, arrival in zip(route['stops'], route['schedule']):
+            served += 1
+            begin = parse_clock(arrival)
+            assert parse_clock(stop.get('time_window_start'), 0) <= begin
+            assert begin <= parse_clock(stop.get('time_window_end'), 24 * 60)
+    assert served + len(result['unassigned']) == 30
+    assert not result['unassigned']
+
+
+def test_relocation_costs_match_rebuilt_route(make_deliveries, depot):
+    import random
+
+    import numpy as np
+
+    from time_windows import _Problem, _Route
+
+    rng = random.Random(7)
+    for seed in range(10):
+        stops = make_deliveries(12, seed=seed, spread=0.04)
+        for stop in stops:
+            start = rng.randint(8, 14)
+            if rng.random() < 0.6:
+                stop['time_window_start'] = f"{start:02d}:00"
+                stop['time_window_end'] = f"{start + rng.randint(1, 3):02d}:00"
+            stop['service_time_minutes'] = rng.randint(2, 15)
+        problem = _Problem(stops, depot, 8 * 60, 20 * 60, 25.0)
+        route = _Route(problem, float('inf'), rng.sample(range(12), 12))
+        for pos in range(1, len(route.nodes) - 1):
+            rest = route.customers[:pos - 1] + route.customers[pos:]
+            expected = _Route(problem, float('inf'), rest).insertion_costs(route.nodes[pos])
+            expected[pos - 1] = np.inf
+            assert np.allclose(route.relocation_costs(pos), expected, equal_nan=True)
@@ -0,0 +1,54 @@
+# test_webhook_server.py
+import importlib
+import os
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    path = tmp_path_factory.mktemp('webhook')
+    os.environ['INGEST_LOG_PATH'] = str(path / 'ingest.db')
+    os.environ['JOB_QUEUE_PATH'] = str(path / 'jobs.db')
+    os.environ['JOB_WORKERS'] = '1'
+    server = importlib.import_module('webhook_server')
+    assert server.ingest_log is None and server.job_queue is None
+    server.API_KEY = 'secreto'
+    app = server.create_app()
+    assert server.create_app() is app and server.ingest_log is not None
+    return app.test_client()
+
+
+def test_webhook_requires_api_key(client):
+    assert client.post('/webhook', json={'pedido': 0}).status_code == 401
+    assert client.post('/webhook', json={'pedido': 0}, headers={'X-API-KEY': 'otra'}).status_code == 401
+    response = client.get('/events', headers={'X-API-KEY': 'secreto'})
+    assert response.get_json()['events'] == []
+
+
+def test_events_require_api_key(client):
+    assert client.post('/webhook', json={'pedido': 1}, headers={'X-API-KEY': 'secreto'}).status_code == 200
+    assert client.get('/events').status_code == 401
+    assert client.get('/events', headers={'X-API-KEY': 'otra'}).status_code == 401
+    assert client.get('/events/stream').status_code == 401
+
+    response = client.get('/events', headers={'X-API-KEY': 'secreto'})
+    assert response.status_code == 200
+    assert [row['payload'] for row in response.get_json()['events']] == [{'pedido': 1}]
+    assert [row['authenticated'] for row in response.get_json()['events']] == [True]
+
+
+def test_health_stays_public(client):
+    assert client.get('/health').status_code == 200
+
+
+def test_jobs_require_api_key(client):
+    assert client.get('/jobs').status_code == 401
+    assert client.post('/jobs', json={'kind': 'route', 'params': {}}).status_code == 401
+    assert client.get('/jobs/abc').status_code == 401
+    assert client.get('/jobs/abc/result').status_code == 401
+    assert client.post('/jobs/abc/cancel').status_code == 401
+
+    headers = {'X-API-KEY': 'secreto'}
+    assert client.get('/jobs', headers=headers).status_code == 200
+    assert client.get('/jobs/abc', headers=headers).status_code == 404
@@ -0,0 +1,266 @@
+# time_windows.py
+"""Ruteo multi-vehículo con ventanas horarias (VRPTW)
+
+Cada ruta guarda, por posición, el inicio de servicio más temprano (`begin`,
+hacia adelante) y el inicio más tardío que no rompe ninguna ventana posterior
+(`latest`, hacia atrás). Con ambos arrays, insertar una parada entre dos
+posiciones se valida en O(1) sin volver a simular la ruta; mover una parada
+dentro de su ruta también, corrigiendo los arrays por el tiempo que libera.
+"""
+import math
+import time
+
+import numpy as np
+
+from fleet_routing import package_weight, vehicle_capacity
+from geo_distance import haversine_matrix
+from route_solver import AVERAGE_SPEED_KMH
+
+# Tiempo de atención por defecto en cada parada (minutos)
+DEFAULT_SERVICE_MINUTES = 5
+
+DEFAULT_SHIFT_START = "08:00"
+DEFAULT_SHIFT_END = "20:00"
+
+IMPROVEMENT_EPS = 1e-9
+
+
+def parse_clock(value, default=None):
+    """Convierte 'HH:MM' u 'HH:MM:SS' a minutos desde medianoche"""
+    if not value:
+        return default
+    parts = str(value).split(':')
+    return int(parts[0]) * 60 + int(parts[1])
+
+
+def format_clock(minutes):
+    """Convierte minutos desde medianoche a 'HH:MM'"""
+    minutes = int(round(minutes))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class _Route:
+    """Secuencia depósito → paradas → depósito con sus tiempos hacia adelante y hacia atrás"""
+
+    def __init__(self, problem, capacity, customers=()):
+        self.problem = problem
+        self.capacity = capacity
+        self.nodes = [problem.depot] + list(customers) + [problem.depot]
+        self.load = sum(problem.weight[c] for c in customers)
+        self.refresh()
+
+    @property
+    def customers(self):
+        return self.nodes[1:-1]
+
+    def refresh(self):
+        """Recalcula begin/latest en O(n); sólo se llama al aplicar un movimiento
+
+        Con C[k] = tiempo acumulado (servicio + viaje) hasta la posición k:
+        begin[k] = C[k] + max_{m<=k}(early[m] - C[m]) y
+        latest[k] = C[k] + min_{m>=k}(late[m] - C[m]), ambos con acumulados de NumPy.
+        """
+        p = self.problem
+        nodes = np.array(self.nodes)
+        legs = p.service[nodes[:-1]] + p.travel[nodes[:-1], nodes[1:]]
+        elapsed = np.concatenate(([0.0], np.cumsum(legs)))
+
+        begin = elapsed + np.maximum.accumulate(p.early[nodes] - elapsed)
+        latest = elapsed + np.minimum.accumulate((p.late[nodes] - elapsed)[::-1])[::-1]
+
+        self.array = nodes
+        self.elapsed = elapsed
+        self.begin = begin
+        self.latest = latest
+
+    def insertion_costs(self, x):
+        """Costo de insertar `x` en cada hueco (inf si rompe capacidad o ventanas)"""
+        p = self.problem
+        if self.load + p.weight[x] > self.capacity:
+            return np.full(len(self.nodes) - 1, np.inf)
+        return _gap_costs(p, x, self.array, self.begin, self.latest)
+
+    def relocation_costs(self, pos):
+        """Costo de mover la parada de `pos` a cada hueco de la ruta sin ella (inf si no es factible)
+
+        Quitar la parada adelanta `delta` minutos todo lo que viene después; los
+        tiempos de la ruta acortada salen de `elapsed`, `begin` y `latest` sin
+        simularla de nuevo. El hueco que deja la parada (`pos - 1`) queda en inf.
+        """
+        p = self.problem
+        nodes, elapsed = self.array, self.elapsed
+        a, x, b = nodes[pos - 1], nodes[pos], nodes[pos + 1]
+        delta = p.travel[a, x] + p.service[x] + p.travel[x, b] - p.travel[a, b]
+
+        # Después de la parada: inicio más temprano con el tiempo acumulado corrido en `delta`
+        after = nodes[pos + 1:]
+        shifted = elapsed[pos + 1:] - delta
+        begin_after = shifted + np.maximum(self.begin[pos - 1] - elapsed[pos - 1],
+                                           np.maximum.accumulate(p.early[after] - shifted))
+        # Antes de la parada: inicio más tardío, con lo que queda después ahora `delta` más holgado
+        slack_before = (p.late[nodes[:pos]] - elapsed[:pos])[::-1]
+        latest_before = elapsed[:pos] + np.minimum(np.minimum.accumulate(slack_before)[::-1],
+                                                   self.latest[pos + 1] - elapsed[pos + 1] + delta)
+
+        cost = _gap_costs(p, x, np.concatenate((nodes[:pos], after)),
+                          np.concatenate((self.begin[:pos], begin_after)),
+                          np.concatenate((latest_before, self.latest[pos + 1:])))
+        cost[pos - 1] = np.inf
+        return cost
+
+    def removal_gain(self, pos):
+        p = self.problem
+        a, x, b = self.nodes[pos - 1], self.nodes[pos], self.nodes[pos + 1]
+        return p.dist[a, x] + p.dist[x, b] - p.dist[a, b]
+
+    def insert(self, x, gap):
+        self.nodes.insert(gap + 1, x)
+        self.load += self.problem.weight[x]
+        self.refresh()
+
+    def remove(self, pos):
+        x = self.nodes.pop(pos)
+        self.load -= self.problem.weight[x]
+        self.refresh()
+        return x
+
+    def distance(self):
+        return float(self.problem.dist[self.array[:-1], self.array[1:]].sum())
+
+
+def _gap_costs(p, x, nodes, begin, latest):
+    """Costo de insertar `x` entre cada par de nodos consecutivos (inf si rompe alguna ventana)"""
+    i = nodes[:-1]
+    j = nodes[1:]
+    begin_x = np.maximum(p.early[x], begin[:-1] + p.service[i] + p.travel[i, x])
+    ok = (begin_x <= p.late[x]) & (begin_x + p.service[x] + p.travel[x, j] <= latest[1:] + IMPROVEMENT_EPS)
+    cost = p.dist[i, x] + p.dist[x, j] - p.dist[i, j]
+    return np.where(ok, cost, np.inf)
+
+
+class _Problem:
+    """Matrices de distancia/tiempo y ventanas; el depósito es el último nodo"""
+
+    def __init__(self, stops, depot, shift_start, shift_end, speed_kmh):
+        lats = np.array([float(d['customer_latitude']) for d in stops] + [depot[0]])
+        lons = np.array([float(d['customer_longitude']) for d in stops] + [depot[1]])
+        self.dist = haversine_matrix(lats, lons)
+        self.travel = self.dist / speed_kmh * 60
+        self.depot = len(stops)
+
+        self.early = np.array([parse_clock(d.get('time_window_start'), shift_start) for d in stops] + [shift_start],
+                              dtype=np.float64)
+        self.late = np.array([parse_clock(d.get('time_window_end'), shift_end) for d in stops] + [shift_end],
+                             dtype=np.float64)
+        self.service = np.array([float(d.get('service_time_minutes') or DEFAULT_SERVICE_MINUTES) for d in stops]
+                                + [0.0])
+        self.weight = [package_weight(d) for d in stops] + [0.0]
+
+
+def _best_insertion(routes, x):
+    best = (math.inf, None, None)
+    for r, route in enumerate(routes):
+        cost = route.insertion_costs(x)
+        gap = int(np.argmin(cost))
+        if cost[gap] < best[0]:
+            best = (float(cost[gap]), r, gap)
+    return best
+
+
+def _relocate(routes, deadline):
+    """Reubica paradas (entre rutas y dentro de la misma) mientras baje la distancia"""
+    improved = True
+    while improved:
+        improved = False
+        for r, route in enumerate(routes):
+            pos = 1
+            while pos < len(route.nodes) - 1:
+                x = route.nodes[pos]
+                gain = route.removal_gain(pos)
+
+                best = (-IMPROVEMENT_EPS, None, None)
+                for s, target in enumerate(routes):
+                    if s == r:
+                        continue
+                    cost = target.insertion_costs(x) - gain
+                    gap = int(np.argmin(cost))
+                    if cost[gap] < best[0]:
+                        best = (float(cost[gap]), s, gap)
+
+                # Dentro de la misma ruta: huecos de la ruta sin la parada, sin reconstruirla
+                cost = route.relocation_costs(pos) - gain
+                gap = int(np.argmin(cost))
+                if cost[gap] < best[0]:
+                    best = (float(cost[gap]), r, gap)
+
+                if best[1] is None:
+                    pos += 1
+                    continue
+
+                _, s, gap = best
+                route.remove(pos)
+                routes[s].insert(x, gap)
+                improved = True
+
+                if deadline and time.perf_counter() > deadline:
+                    return routes
+
+    return routes
+
+
+def solve_fleet_time_windows(deliveries, vehicles, depot, shift_start=DEFAULT_SHIFT_START,
+                             shift_end=DEFAULT_SHIFT_END, speed_kmh=AVERAGE_SPEED_KMH, time_limit=None):
+    """Reparte entregas entre vehículos respetando capacidad y ventanas horarias
+
+    Las entregas sin `time_window_start`/`time_window_end` aceptan cualquier
+    hora del turno. Devuelve la misma estructura que `solve_fleet`, y cada
+    parada incluye su hora estimada de llegada en `schedule`.
+    """
+    start = time.perf_counter()
+    deadline = start + time_limit if time_limit else None
+
+    stops = [d for d in deliveries if d.get('customer_latitude') and d.get('customer_longitude')]
+    if not stops or not vehicles:
+        return {"routes": [], "unassigned": stops, "total_distance_km": 0.0,
+                "solve_time_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    problem = _Problem(stops, depot, parse_clock(shift_start), parse_clock(shift_end), speed_kmh)
+    routes = [_Route(problem, vehicle_capacity(v)) for v in vehicles]
+
+    # 1. Inserción más barata factible, atendiendo primero los cierres de ventana más tempranos
+    unassigned = []
+    for x in np.argsort(problem.late[:-1], kind='stable'):
+        cost, r, gap = _best_insertion(routes, int(x))
+        if r is None:
+            unassigned.append(int(x))
+        else:
+            routes[r].insert(int(x), gap)
+
+    # 2. Búsqueda local con chequeos de factibilidad O(1)
+    routes = _relocate(routes, deadline)
+
+    results = []
+    for vehicle, route in zip(vehicles, routes):
+        if not route.customers:
+            continue
+        distance_km = route.distance()
+        results.append({
+            "stops": [stops[c] for c in route.customers],
+            "coordinates": [tuple(depot)] + [
+                (float(stops[c]['customer_latitude']), float(stops[c]['customer_longitude']))
+                for c in route.customers
+            ] + [tuple(depot)],
+            "schedule": [format_clock(b) for b in route.begin[1:-1]],
+            "total_distance_km": round(distance_km, 2),
+            "estimated_duration_minutes": round(route.begin[-1] - route.begin[0], 1),
+            "vehicle": vehicle,
+            "load_kg": round(route.load, 2),
+            "capacity_kg": route.capacity,
+        })
+
+    return {
+        "routes": results,
+        "unassigned": [stops[x] for x in unassigned],
+        "total_distance_km": round(sum(r['total_distance_km'] for r in results), 2),
+        "solve_time_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
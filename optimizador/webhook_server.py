@@ -1,38 +1,181 @@
 # webhook_server.py
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import hmac
 import json
 import os
 from datetime import datetime
+from functools import wraps
+
+from ingest_log import DEFAULT_PATH, DEFAULT_READ_LIMIT, DEFAULT_TOPIC, IngestLog, correlation_id, idempotency_key
+from job_queue import DEFAULT_PATH as JOB_QUEUE_PATH, DEFAULT_PRIORITY, DEFAULT_WORKERS, JobQueue
 
 app = Flask(__name__)
 
+# Registro de eventos y cola de optimizaciones compartidos con Streamlit; los crea create_app
+# para que importar el módulo no abra bases de datos ni arranque hilos
+ingest_log = None
+job_queue = None
+
+# Clave que deben enviar en X-API-KEY n8n al notificar y los consumidores del registro de eventos
+# y de la cola de trabajos
+API_KEY = os.environ.get('WEBHOOK_API_KEY', '')
+
+# Espera máxima de una lectura long-poll en /events (segundos)
+MAX_WAIT_SECONDS = 30
+
+# Cada cuánto el stream SSE manda un comentario para mantener viva la conexión (segundos)
+SSE_HEARTBEAT_SECONDS = 15
+
+def require_api_key(view):
+    """Rechaza con 401 las peticiones sin la clave de WEBHOOK_API_KEY en la cabecera X-API-KEY
+
+    Sin la variable configurada las rutas protegidas quedan cerradas.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        api_key = request.headers.get('X-API-KEY', '').encode('utf-8')
+        if not API_KEY or not hmac.compare_digest(api_key, API_KEY.encode('utf-8')):
+            return jsonify({"error": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
 # Endpoint para recibir notificaciones de n8n
 @app.route('/webhook', methods=['POST'])
+@require_api_key
 def webhook():
     try:
-        data = request.json
-        print(f"✅ Webhook recibido: {datetime.now().isoformat()}")
-        print(f"📦 Datos recibidos: {json.dumps(data, indent=2)}")
-        
-        # Guardar en archivo para que Streamlit pueda leerlo
-        with open('webhook_data.json', 'w') as f:
-            json.dump(data, f, indent=2)
-        
+        data = request.get_json(silent=True)
+        if data is None:
+            return jsonify({"error": "Se esperaba un cuerpo JSON"}), 400
+
+        key = idempotency_key(request.headers, data)
+        result = ingest_log.append(data, key=key, topic=request.args.get('topic', DEFAULT_TOPIC),
+                                   correlation_id=correlation_id(request.headers, data), authenticated=True)
+        print(f"✅ Webhook recibido: {datetime.now().isoformat()} | seq {result['seq']}"
+              f"{' (reintento duplicado)' if result['duplicate'] else ''}")
+
         return jsonify({
             "status": "success",
             "message": "Webhook recibido correctamente",
+            "seq": result['seq'],
+            "duplicate": result['duplicate'],
             "received_at": datetime.now().isoformat()
         }), 200
-        
+
     except Exception as e:
         print(f"❌ Error en webhook: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# Lectura por cursor: los consumidores piden sólo los eventos posteriores a `after`
+@app.route('/events', methods=['GET'])
+@require_api_key
+def events():
+    try:
+        after = int(request.args.get('after', 0))
+        limit = min(int(request.args.get('limit', DEFAULT_READ_LIMIT)), 1000)
+        wait = min(float(request.args.get('wait', 0)), MAX_WAIT_SECONDS)
+    except ValueError:
+        return jsonify({"error": "after, limit y wait deben ser numéricos"}), 400
+
+    filters = {'topic': request.args.get('topic'), 'correlation_id': request.args.get('correlation_id')}
+    if wait > 0:
+        rows, cursor = ingest_log.wait(after, timeout=wait, limit=limit, **filters)
+    else:
+        rows, cursor = ingest_log.read(after, limit=limit, **filters)
+    return jsonify({"events": rows, "cursor": cursor}), 200
+
+# Server-sent events: cada evento nuevo se envía apenas se confirma, con su seq como id
+@app.route('/events/stream', methods=['GET'])
+@require_api_key
+def events_stream():
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        return jsonify({"error": "after debe ser numérico"}), 400
+    filters = {'topic': request.args.get('topic'), 'correlation_id': request.args.get('correlation_id')}
+
+    def stream(cursor):
+        while True:
+            rows, cursor = ingest_log.wait(cursor, timeout=SSE_HEARTBEAT_SECONDS, **filters)
+            if not rows:
+                yield ": keep-alive\n\n"
+            for row in rows:
+                yield f"id: {row['seq']}\nevent: {row['topic']}\ndata: {json.dumps(row, ensure_ascii=False)}\n\n"
+
+    return Response(stream(after), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Optimizaciones en segundo plano: se encolan y se consultan por id
+@app.route('/jobs', methods=['POST'])
+@require_api_key
+def submit_job():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('params'), dict):
+        return jsonify({"error": "Se esperaba un JSON con 'kind' y 'params'"}), 400
+    try:
+        job_id = job_queue.submit(data.get('kind'), data['params'],
+                                  priority=int(data.get('priority', DEFAULT_PRIORITY)), owner=data.get('owner'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+@app.route('/jobs', methods=['GET'])
+@require_api_key
+def list_jobs():
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+    except ValueError:
+        return jsonify({"error": "limit debe ser numérico"}), 400
+    return jsonify({"jobs": job_queue.list_jobs(request.args.get('owner'), limit)}), 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@require_api_key
+def job_status(job_id):
+    try:
+        wait = min(float(request.args.get('wait', 0)), MAX_WAIT_SECONDS)
+    except ValueError:
+        return jsonify({"error": "wait debe ser numérico"}), 400
+    status = job_queue.wait(job_id, timeout=wait) if wait > 0 else job_queue.status(job_id)
+    if status is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(status), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+@require_api_key
+def job_result(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    if status['status'] != 'done':
+        return jsonify({"error": f"El trabajo está en estado {status['status']}", "status": status}), 409
+    return jsonify({"job_id": job_id, "result": job_queue.result(job_id)}), 200
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@require_api_key
+def cancel_job(job_id):
+    if job_queue.status(job_id) is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    if not job_queue.cancel(job_id):
+        return jsonify({"error": "El trabajo ya terminó"}), 409
+    return jsonify({"job_id": job_id, "cancel_requested": True}), 202
+
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy"}), 200
+    return jsonify({"status": "healthy", "ingest": ingest_log.stats(), "jobs": job_queue.stats()}), 200
+
+def create_app():
+    """Abre el registro de eventos y la cola de trabajos (una sola vez) y devuelve la app."""
+    global ingest_log, job_queue
+    if ingest_log is None:
+        ingest_log = IngestLog(os.environ.get('INGEST_LOG_PATH', DEFAULT_PATH))
+    if job_queue is None:
+        # Sus hilos también ejecutan trabajos
+        job_queue = JobQueue(os.environ.get('JOB_QUEUE_PATH', JOB_QUEUE_PATH),
+                             workers=int(os.environ.get('JOB_WORKERS', DEFAULT_WORKERS)))
+    return app
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8501))
     print(f"🚀 Iniciando servidor webhook en puerto {port}")
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    # Sin debug: el recargador importaría el módulo dos veces y duplicaría los workers de la cola
+    create_app().run(host='0.0.0.0', port=port)
\ No newline at end of file